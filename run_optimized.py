@@ -47,7 +47,8 @@ def check_dependencies():
         ('httpx', 'httpx'),
         ('aiohttp', 'aiohttp'),
         ('pandas', 'pandas'),
-        ('numpy', 'numpy')
+        ('numpy', 'numpy'),
+        ('orjson', 'orjson')
     ]
 
     # psutil在Windows上可能有问题，作为可选依赖
@@ -101,5 +101,6 @@ if not app_config or not _NEW_CONFIG_AVAILABLE:
         "API_KEY": os.getenv("DEEPSEEK_API_KEY"),
         "BASE_URL": os.getenv("DEEPSEEK_BASE_URL"),
         "MODEL": os.getenv("DEEPSEEK_MODEL"),
-        "MAX_HISTORY": 10
+        "MAX_HISTORY": 10,
+        "MAX_SESSIONS": 10000
     }
@@ -223,6 +223,13 @@ DEEPSEEK_CONFIG_FIELDS = [
         validator=validate_positive_int,
         description="最大历史记录数"
     ),
+    ConfigField(
+        "DEEPSEEK_MAX_SESSIONS",
+        required=False,
+        default=10000,
+        validator=validate_positive_int,
+        description="内存中保留的最大会话数"
+    ),
 ]
 
 APP_CONFIG_FIELDS = [
@@ -333,7 +340,8 @@ class ApplicationConfig:
             "API_KEY": deepseek_config["DEEPSEEK_API_KEY"],
             "BASE_URL": deepseek_config["DEEPSEEK_BASE_URL"],
             "MODEL": deepseek_config["DEEPSEEK_MODEL"],
-            "MAX_HISTORY": deepseek_config["DEEPSEEK_MAX_HISTORY"]
+            "MAX_HISTORY": deepseek_config["DEEPSEEK_MAX_HISTORY"],
+            "MAX_SESSIONS": deepseek_config["DEEPSEEK_MAX_SESSIONS"]
         }
 
     def get_app_config(self) -> Dict[str, Any]:
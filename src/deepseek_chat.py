@@ -1,10 +1,12 @@
 import logging
-from typing import List, Optional
-import json
+from collections import namedtuple, OrderedDict, deque, defaultdict
+from typing import List, Optional, Callable, Awaitable, Iterator, AsyncIterator, Tuple, TYPE_CHECKING
+import orjson
 from config import DEEPSEEK_CONFIG, FEISHU_CONFIG
 import asyncio
 from feishu_sheet import FeishuSheet
 import re
+import time
 from datetime import datetime
 from table_manage import (
     WarehouseManager, 
@@ -13,8 +15,161 @@ from table_manage import (
     OutboundManager, 
     InventorySummaryManager
 )
-import pandas as pd
 import httpx
+from retry_manager import create_http_client, API_RETRY_CONFIG
+
+# pandas 只在加载数据时用到，运行时按需导入
+if TYPE_CHECKING:
+    import pandas as pd
+
+# 仓库信息只在提示词和校验中使用，用轻量的 namedtuple 代替 DataFrame
+Warehouse = namedtuple('Warehouse', 'name remark address')
+
+# 出入库记录的字段规则，(字段名, 类型) 元组在模块加载时构建一次，校验时按操作类型直接取用
+_QUERY_FIELDS = (
+    ('商品ID', str),
+    ('商品名称', str),
+)
+
+_BASE_FIELDS = (
+    ('出入库日期', str),
+    ('商品ID', str),
+    ('商品名称', str),
+    ('仓库名', str),
+    ('操作类型', str),
+)
+
+_RECORD_FIELDS = {
+    '入库': _BASE_FIELDS + (
+        ('入库数量', (int, float)),
+        ('入库单价', (int, float)),
+        ('供应商', str),
+    ),
+    '出库': _BASE_FIELDS + (
+        ('出库数量', (int, float)),
+        ('出库单价', (int, float)),
+        ('客户', str),
+    ),
+}
+
+_OPTIONAL_FIELDS = (
+    ('快递单号', str),
+    ('快递手机号', str),
+)
+
+# 各操作类型需要大于 0 的数量、单价字段
+_AMOUNT_FIELDS = {
+    '入库': ('入库数量', '入库单价'),
+    '出库': ('出库数量', '出库单价'),
+}
+
+# 模型偶尔在数量、单价里带上的单位、货币符号和千分位分隔符，一次 translate 全部去掉
+_UNIT_STRIP = str.maketrans('', '', 'kg个件元¥$￥,， ')
+
+# DeepSeek 限流及服务端临时错误，可以退避后重试
+_RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+
+# 提示词中仓库、商品条目的模板，预先取出绑定的 format 方法，逐条只做一次格式化调用
+_WAREHOUSE_TMPL = "- 仓库名: {}\n  仓库地址: {}\n".format
+_WAREHOUSE_REMARK_TMPL = "  仓库备注: {}\n".format
+_PRODUCT_TMPL = (
+    "- 商品ID: {}\n"
+    "  商品名称: {}\n"
+    "  商品分类: {}\n"
+    "  商品规格: {}\n"
+    "  商品单位: {}\n"
+    "{}\n"
+).format
+
+# 商品表中取值高度重复、适合存为 category 的列
+_CATEGORY_COLUMNS = ('商品分类', '商品单位')
+
+# 仓库和商品信息的缓存有效期（秒），过期后在下一次对话前重新加载
+_REFERENCE_TTL = 300
+# 读取失败（管理器返回空结果）时的重试间隔（秒），期间沿用上一份数据
+_REFERENCE_RETRY = 30
+
+# 回复中 JSON 数据块的起止标记
+_JSON_START = '<JSON>'
+_JSON_END = '</JSON>'
+
+
+def _extract_json_block(text: str) -> Optional[str]:
+    """取出第一个 <JSON>...</JSON> 数据块的内容，用 str.find 定位标记而不走正则，没有时返回 None"""
+    start = text.find(_JSON_START)
+    if start == -1:
+        return None
+    start += len(_JSON_START)
+    end = text.find(_JSON_END, start)
+    if end == -1:
+        return None
+    return text[start:end].strip()
+
+# 用户单独补充一个缺失字段时，可以不经模型直接识别的取值格式
+_NUMBER_RE = re.compile(r'\d+(?:\.\d+)?')
+_DATE_RE = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})')
+
+
+def _dumps_pretty(data) -> str:
+    """缩进格式输出 JSON 文本（orjson 不转义中文）"""
+    return orjson.dumps(data, option=orjson.OPT_INDENT_2).decode()
+
+
+# 当天日期字符串按天缓存：((年, 月, 日), "YYYY-MM-DD")
+_today_cache = (None, None)
+
+
+def _today() -> str:
+    """返回本地当天日期 YYYY-MM-DD，同一天内复用已格式化的字符串"""
+    global _today_cache
+    now = time.localtime()
+    key = (now.tm_year, now.tm_mon, now.tm_mday)
+    if _today_cache[0] != key:
+        _today_cache = (key, f"{key[0]:04d}-{key[1]:02d}-{key[2]:02d}")
+    return _today_cache[1]
+
+
+def _now_str() -> str:
+    """返回本地当前时间 YYYY-MM-DD HH:MM:SS"""
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _date_to_ms(text: str) -> Optional[int]:
+    """将 YYYY-MM-DD（月、日可不补零）转为本地零点的毫秒时间戳，格式或日期不合法时返回 None"""
+    match = _DATE_RE.fullmatch(text) if isinstance(text, str) else None
+    if not match:
+        return None
+    try:
+        return int(datetime(*map(int, match.groups())).timestamp() * 1000)
+    except ValueError:
+        return None
+
+
+def _is_invalid_value(value, field_type) -> bool:
+    """字段缺失（None）、类型不符或为空字符串时视为无效"""
+    if not isinstance(value, field_type):
+        return True
+    return isinstance(value, str) and not value.strip()
+
+
+def _parse_number(text: str):
+    """将纯数字文本转为 int 或 float"""
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+
+_LOCAL_FILL_RULES = {
+    '入库数量': (_NUMBER_RE, _parse_number),
+    '入库单价': (_NUMBER_RE, _parse_number),
+    '出库数量': (_NUMBER_RE, _parse_number),
+    '出库单价': (_NUMBER_RE, _parse_number),
+    '出入库日期': (_DATE_RE, str),
+}
+
+# 无上下文问答（问候、帮助等）的回复缓存上限，超出后按先进先出淘汰
+_RESPONSE_CACHE_SIZE = 1024
+# 归一化消息时忽略的空白和常见标点
+_NORMALIZE_RE = re.compile(r"[\s，。！？、,.!?~～]+")
 
 # 配置日志记录器
 logger = logging.getLogger(__name__)
@@ -24,16 +179,31 @@ logging.basicConfig(
 )
 
 class DeepSeekChat:
-    def __init__(self):
+    # 所有实例共享的仓库、商品信息：(加载时间, 仓库列表, 商品表)，按 _REFERENCE_TTL 过期
+    _shared_reference: Optional[Tuple[float, List[Warehouse], "pd.DataFrame"]] = None
+
+    def __init__(self, load_data: bool = True):
         self.api_key = DEEPSEEK_CONFIG["API_KEY"]
         self.api_base = DEEPSEEK_CONFIG["BASE_URL"]
         self.model = DEEPSEEK_CONFIG["MODEL"]
+        # 复用同一个 HTTP 客户端，避免每轮对话重新建立 TCP/TLS 连接
+        self._client: Optional[httpx.AsyncClient] = None
         
         # 获取仓库和商品信息
         self.warehouse_manager = WarehouseManager()
         self.product_manager = ProductManager()
-        self.warehouses = self._get_warehouses()
-        self.products = self._get_products()
+        self._reference_loaded_at = 0.0
+        self._reference_lock = asyncio.Lock()
+        if load_data:
+            shared = self._shared_reference_if_fresh()
+            if shared is None:
+                shared = self._store_shared_reference(self._get_warehouses(), self._get_products())
+            self._reference_loaded_at, self.warehouses, self.products = shared
+        else:
+            # 由 create() 异步加载
+            import pandas as pd
+            self.warehouses = []
+            self.products = pd.DataFrame()
         
         # 修改基础系统提示词
         self.system_prompt = """你是一个出入库管理助手。你需要帮助收集完整的出入库信息，或查询库存信息，并以JSON格式返回。
@@ -152,108 +322,376 @@ class DeepSeekChat:
    - 明确指出缺少哪些字段
    - 友好地询问缺失信息"""
 
-        self.conversations = {}
+        # 仓库和商品信息在加载后不变，预先渲染好提示词的静态部分及校验用的索引
+        self._build_reference_cache()
+
+        # 按最近使用顺序保存会话，超过上限时淘汰最久未使用的会话
+        self.conversations = OrderedDict()
         self.max_history = DEEPSEEK_CONFIG.get("MAX_HISTORY", 10)
+        self.max_sessions = DEEPSEEK_CONFIG.get("MAX_SESSIONS", 10000)
         self.inventory_manager = InventorySummaryManager()
+        # 出入库管理器创建时要获取令牌并校验表头，只创建一次供每次写入复用
+        self.inbound_manager = InboundManager()
+        self.outbound_manager = OutboundManager()
         self.current_inventory_data = {}
         self.current_user_id = None
         
         # 添加 pending_data 字典用于存储待处理的数据
         self.pending_data = {}
 
-    def _get_warehouses(self) -> pd.DataFrame:
+        # 每个会话一把锁，同一用户的消息按顺序处理，不同用户之间并发
+        self._session_locks = defaultdict(asyncio.Lock)
+
+        # 模型返回的未补全出入库记录，用于本地合并用户补充的单个字段
+        self._pending_records = {}
+
+        # 新会话首条消息的回复缓存：(日期, 归一化消息) -> 回复
+        self._response_cache = OrderedDict()
+
+    def _get_warehouses(self) -> List[Warehouse]:
         """获取仓库信息"""
         try:
-            return self.warehouse_manager.get_data()
+            records = self.warehouse_manager.get_records()
         except Exception as e:
             logger.error(f"获取仓库信息失败: {str(e)}")
-            return pd.DataFrame()
+            return []
+        return [
+            Warehouse(row['仓库名'], row['仓库备注'] or '', row['仓库地址'])
+            for row in records
+        ]
 
-    def _get_products(self) -> pd.DataFrame:
+    def _get_products(self) -> "pd.DataFrame":
         """获取商品信息"""
         try:
-            return self.product_manager.get_data()
+            df = self.product_manager.get_data()
         except Exception as e:
             logger.error(f"获取商品信息失败: {str(e)}")
+            import pandas as pd
             return pd.DataFrame()
 
+        # 分类、单位取值高度重复，转为 category 减少内存中的重复字符串对象
+        for column in _CATEGORY_COLUMNS:
+            if column in df:
+                df[column] = df[column].astype('category')
+        return df
+
+    def _build_reference_cache(self) -> None:
+        """根据仓库、商品信息构建校验索引，并拼接系统提示词的静态部分"""
+        # str.startswith 直接接受元组，在 C 层完成前缀匹配
+        self._warehouse_names = tuple(warehouse.name for warehouse in self.warehouses)
+        self._warehouse_by_name = {warehouse.name: warehouse for warehouse in self.warehouses}
+        if self.products.empty:
+            self._valid_product_ids = frozenset()
+            self._valid_product_names = frozenset()
+        else:
+            self._valid_product_ids = frozenset(self.products['商品ID'].dropna().astype(str))
+            self._valid_product_names = frozenset(self.products['商品名称'].dropna())
+
+        self._warehouse_info_str = self._format_warehouse_info()
+        self._product_info_str = self._format_product_info()
+        self._system_prompt_static = (
+            f"{self.system_prompt}\n\n可选仓库信息：\n{self._warehouse_info_str}"
+            f"\n\n可选商品信息：\n{self._product_info_str}"
+        )
+        # 请求里的系统消息也只在数据刷新时构建；日期消息按天缓存
+        self._system_message = {"role": "system", "content": self._system_prompt_static}
+        self._date_message = None
+
+    @classmethod
+    async def create(cls) -> "DeepSeekChat":
+        """异步创建实例：管理器初始化在线程中完成，仓库和商品信息并发加载"""
+        instance = await asyncio.to_thread(cls, load_data=False)
+        await instance.ensure_reference_data()
+        return instance
+
+    def _get_date_message(self, today: str) -> dict:
+        """返回当天的日期系统消息，同一天内复用"""
+        if self._date_message is None or self._date_message["date"] != today:
+            self._date_message = {"date": today, "message": {"role": "system", "content": f"今天是 {today}"}}
+        return self._date_message["message"]
+
+    @classmethod
+    def _shared_reference_if_fresh(cls) -> Optional[Tuple[float, List[Warehouse], "pd.DataFrame"]]:
+        """返回未过期的共享仓库、商品信息，过期或未加载时返回 None"""
+        shared = cls._shared_reference
+        if shared is not None and time.monotonic() - shared[0] < _REFERENCE_TTL:
+            return shared
+        return None
+
+    @classmethod
+    def _store_shared_reference(
+        cls,
+        warehouses: List[Warehouse],
+        products: "pd.DataFrame"
+    ) -> Tuple[float, List[Warehouse], "pd.DataFrame"]:
+        """保存新加载的仓库、商品信息，供所有实例共享
+
+        管理器读取失败时返回空结果：此时沿用上一份数据，并只保留 _REFERENCE_RETRY 秒的有效期，
+        尽快重新读取，避免一次失败让之后的 _REFERENCE_TTL 秒内校验和提示词都按空数据处理
+        """
+        loaded_at = time.monotonic()
+        if not warehouses or products.empty:
+            logger.warning("仓库或商品信息加载为空，沿用上一份数据，%d 秒后重试", _REFERENCE_RETRY)
+            previous = cls._shared_reference
+            if previous is not None:
+                warehouses = warehouses or previous[1]
+                products = previous[2] if products.empty else products
+            loaded_at -= _REFERENCE_TTL - _REFERENCE_RETRY
+        cls._shared_reference = (loaded_at, warehouses, products)
+        return cls._shared_reference
+
+    def refresh(self) -> None:
+        """重新加载仓库和商品信息，并刷新缓存的提示词"""
+        self._apply_reference_data(
+            self._store_shared_reference(self._get_warehouses(), self._get_products())
+        )
+
+    async def arefresh(self) -> None:
+        """refresh 的异步版本，两张表在线程中并发读取，不阻塞事件循环"""
+        warehouses, products = await asyncio.gather(
+            asyncio.to_thread(self._get_warehouses),
+            asyncio.to_thread(self._get_products)
+        )
+        self._apply_reference_data(self._store_shared_reference(warehouses, products))
+
+    async def ensure_reference_data(self) -> None:
+        """确保仓库和商品信息在有效期内：优先采用其他实例刚加载的数据，都过期时才重新读取飞书表格"""
+        async with self._reference_lock:
+            shared = self._shared_reference_if_fresh()
+            if shared is None:
+                await self.arefresh()
+            elif shared[0] != self._reference_loaded_at:
+                self._apply_reference_data(shared)
+
+    def _apply_reference_data(self, shared: Tuple[float, List[Warehouse], "pd.DataFrame"]) -> None:
+        """替换仓库和商品信息，并重建依赖它们的缓存"""
+        self._reference_loaded_at, self.warehouses, self.products = shared
+        self._build_reference_cache()
+        self._response_cache.clear()
+
     def _format_warehouse_info(self) -> str:
         """格式化仓库信息为字符串"""
-        if self.warehouses.empty:
+        if not self.warehouses:
             return "暂无可用仓库信息"
         
-        warehouse_str = ""
-        for _, row in self.warehouses.iterrows():
-            warehouse_str += f"- 仓库名: {row['仓库名']}\n"
-            warehouse_str += f"  仓库地址: {row['仓库地址']}\n"
-            if pd.notna(row.get('仓库备注')) and row['仓库备注']:
-                warehouse_str += f"  仓库备注: {row['仓库备注']}\n"
-        return warehouse_str
+        parts = []
+        for warehouse in self.warehouses:
+            parts.append(_WAREHOUSE_TMPL(warehouse.name, warehouse.address))
+            if warehouse.remark:
+                parts.append(_WAREHOUSE_REMARK_TMPL(warehouse.remark))
+        return "".join(parts)
 
     def _format_product_info(self) -> str:
         """格式化商品信息为字符串"""
         if self.products.empty:
             return "暂无可用商品信息"
         
-        product_str = "可用商品列表：\n"
-        for _, row in self.products.iterrows():
-            product_str += (
-                f"- 商品ID: {row['商品ID']}\n"
-                f"  商品名称: {row['商品名称']}\n"
-                f"  商品分类: {row['商品分类']}\n"
-                f"  商品规格: {row['商品规格']}\n"
-                f"  商品单位: {row['商品单位']}\n"
-            )
-            # 只有当备注不为空时才添加备注信息
-            if pd.notna(row.get('商品备注')) and row['商品备注']:
-                product_str += f"  商品备注（别称）: {row['商品备注']}\n"
-            product_str += "\n"  # 在每个商品之间添加空行
-        return product_str
+        # 备注后缀整列一次生成，无备注的行为空串
+        remarks = self.products['商品备注']
+        has_remark = remarks.notna() & remarks.astype(bool)
+        remark_suffix = ("  商品备注（别称）: " + remarks.astype(str) + "\n").where(has_remark, "")
+
+        # 按列取出 Python 列表后 zip，避免逐行构造 pandas 对象；每个商品之间空一行
+        columns = [self.products[c].tolist() for c in ('商品ID', '商品名称', '商品分类', '商品规格', '商品单位')]
+        parts = ["可用商品列表：\n"]
+        parts.extend(_PRODUCT_TMPL(*row) for row in zip(*columns, remark_suffix.tolist()))
+        return "".join(parts)
 
     def _validate_location(self, location: str) -> bool:
         """验证存放位置是否有效"""
-        if self.warehouses.empty:
+        if not self._warehouse_names:
             return True  # 如果没有仓库信息，暂时允许任何位置
         
-        return any(location.startswith(warehouse) 
-                  for warehouse in self.warehouses['仓库名'].tolist())
+        return location.startswith(self._warehouse_names)
 
     def create_session(self, session_id: str) -> None:
         """创建新的会话"""
-        if session_id not in self.conversations:
-            self.conversations[session_id] = []
+        if session_id in self.conversations:
+            self.conversations.move_to_end(session_id)
+            return
+
+        # 每轮对话包含用户和助手两条消息，deque 达到上限后追加会自动丢弃最旧的消息
+        self.conversations[session_id] = deque(maxlen=self.max_history * 2)
+        while len(self.conversations) > self.max_sessions:
+            stale_id, _ = self.conversations.popitem(last=False)
+            self.pending_data.pop(stale_id, None)
+            self._pending_records.pop(stale_id, None)
+            lock = self._session_locks.get(stale_id)
+            if lock is not None and not lock.locked():
+                del self._session_locks[stale_id]
+            logger.debug("Evicted stale session %s", stale_id)
             
-    def get_conversation(self, session_id: str) -> List[dict]:
-        """获取指定会话的上下文历史"""
-        # 如果会话不存在，返回空列表
-        if session_id not in self.conversations:
-            self.create_session(session_id)
-        return self.conversations[session_id][-self.max_history:]  # 只返回最近的消息
+    def get_conversation(self, session_id: str) -> Iterator[dict]:
+        """获取指定会话的上下文历史，返回消息的迭代器而不复制列表"""
+        # 如果会话不存在，先创建空会话
+        self.create_session(session_id)
+        # deque 的 maxlen 已经限定为最近 max_history 轮对话，发送的上下文与保留的一致
+        return iter(self.conversations[session_id])
         
     def print_conversation(self, session_id: str) -> None:
-        """打印指定会话的上下文历史"""
+        """以 debug 级别输出指定会话的上下文历史"""
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
         if session_id not in self.conversations:
-            print(f"Session {session_id} does not exist.")
+            logger.debug("Session %s does not exist.", session_id)
             return
         
-        print(f"\n=== Conversation History for Session {session_id} ===")
+        logger.debug("Conversation history for session %s:", session_id)
         for msg in self.conversations[session_id]:
-            timestamp = msg.get('timestamp', 'No timestamp')
-            print(f"[{timestamp}] {msg['role'].upper()}: {msg['content']}\n")
-        print("=" * 50)
+            logger.debug("[%s] %s: %s", msg.get('timestamp', 'No timestamp'), msg['role'].upper(), msg['content'])
+
+    async def _stream_completion(
+        self,
+        messages: List[dict],
+        on_token: Optional[Callable[[str], Awaitable[None]]] = None,
+        on_json: Optional[Callable[[str], None]] = None
+    ) -> str:
+        """以流式方式调用 DeepSeek，逐段回调并返回完整回复
+
+        限流 (429) 和服务端错误 (5xx) 以及连接错误在开始输出前按指数退避重试，优先遵循 Retry-After；
+        第一个 <JSON> 数据块生成完毕时立即以其内容调用 on_json，不必等待整段回复结束
+        """
+        retry_config = API_RETRY_CONFIG
+        for attempt in range(1, retry_config.max_attempts + 1):
+            chunks = []
+            json_seen = on_json is None
+            delay = None
+            try:
+                async with self._get_client().stream(
+                    "POST",
+                    "/chat/completions",
+                    json={
+                        "model": self.model,
+                        "messages": messages,
+                        "stream": True,
+                        # 在最后一个数据块中返回 usage，用于观察前缀缓存命中情况
+                        "stream_options": {"include_usage": True}
+                    }
+                ) as response:
+                    if response.status_code != 200:
+                        await response.aread()
+                        if response.status_code not in _RETRYABLE_STATUS or attempt == retry_config.max_attempts:
+                            raise Exception(f"API 调用失败: {response.status_code} - {response.text}")
+                        delay = self._retry_after(response, retry_config.max_delay)
+                        if delay is None:
+                            delay = retry_config.calculate_delay(attempt)
+                        logger.warning(
+                            f"DeepSeek 返回 {response.status_code}，{delay:.1f} 秒后重试 "
+                            f"({attempt}/{retry_config.max_attempts})"
+                        )
+                    else:
+                        # SSE 格式：每行 "data: {...}"，以 "data: [DONE]" 结束，其余为保活注释
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            payload = line[5:].strip()
+                            if payload == "[DONE]":
+                                break
+                            chunk = orjson.loads(payload)
+                            usage = chunk.get("usage")
+                            if usage:
+                                logger.debug(
+                                    "DeepSeek usage: prompt=%s cache_hit=%s cache_miss=%s completion=%s",
+                                    usage.get("prompt_tokens"),
+                                    usage.get("prompt_cache_hit_tokens"),
+                                    usage.get("prompt_cache_miss_tokens"),
+                                    usage.get("completion_tokens")
+                                )
+                            choices = chunk.get("choices")
+                            if not choices:
+                                continue
+                            delta = choices[0].get("delta", {}).get("content")
+                            if delta:
+                                chunks.append(delta)
+                                if on_token:
+                                    await on_token(delta)
+                                # 结束标记以 ">" 收尾，只在出现 ">" 时才拼接检查
+                                if not json_seen and ">" in delta:
+                                    json_str = _extract_json_block("".join(chunks))
+                                    if json_str is not None:
+                                        json_seen = True
+                                        on_json(json_str)
+                        return "".join(chunks)
+            except httpx.TransportError as e:
+                # 已经向调用方输出过内容时不能重试，否则会重复输出
+                if chunks or attempt == retry_config.max_attempts:
+                    raise
+                delay = retry_config.calculate_delay(attempt)
+                logger.warning(
+                    f"连接 DeepSeek 失败: {e}，{delay:.1f} 秒后重试 ({attempt}/{retry_config.max_attempts})"
+                )
+
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _retry_after(response: httpx.Response, max_delay: float) -> Optional[float]:
+        """解析以秒为单位的 Retry-After 响应头"""
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return min(max(float(value), 0.0), max_delay)
+        except ValueError:
+            return None
 
-    async def chat(self, message: str, user_id: str) -> str:
-        """处理用户消息并返回回复"""
+    def _get_client(self) -> httpx.AsyncClient:
+        """获取（必要时创建）复用的 DeepSeek HTTP 客户端"""
+        if self._client is None or self._client.is_closed:
+            self._client = create_http_client(
+                timeout=30.0,
+                http2=True,
+                base_url=self.api_base,
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                }
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        """关闭复用的 HTTP 客户端"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def chat(
+        self,
+        message: str,
+        user_id: str,
+        on_token: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> str:
+        """处理用户消息并返回回复，on_token 可用于逐段接收流式输出"""
+        async with self._session_locks[user_id]:
+            return await self._chat(message, user_id, on_token)
+
+    async def chat_many(self, pairs: List[Tuple[str, str]]) -> List[str]:
+        """并发处理多条 (消息, 用户ID)，不同用户的请求同时发出，同一用户按顺序处理"""
+        return await asyncio.gather(*(self.chat(message, user_id) for message, user_id in pairs))
+
+    async def _chat(
+        self,
+        message: str,
+        user_id: str,
+        on_token: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> str:
+        """chat 的实现，调用方需持有该会话的锁"""
         try:
+            # 仓库、商品信息过期时先重新加载，保证提示词和校验使用的数据不会长期陈旧
+            await self.ensure_reference_data()
             self.current_user_id = user_id
-            today = datetime.now().strftime("%Y-%m-%d")
+            today = _today()
             current_data = self.pending_data.get(user_id, [])
+
+            # 用户只补充了一个可确定的缺失字段时，直接在本地补全并写入
+            local_reply = await self._try_complete_locally(message, user_id)
+            if local_reply is not None:
+                return local_reply
             
             # 构建消息
             if current_data:
                 message = f"""基于之前的信息：
 <JSON>
-{json.dumps(current_data, ensure_ascii=False, indent=2)}
+{_dumps_pretty(current_data)}
 </JSON>
 
 用户补充信息：{message}
@@ -263,105 +701,99 @@ class DeepSeekChat:
             # 构建消息历史
             messages = []
             if self.system_prompt:
-                # 添加今天的日期到系统提示词 还有仓库以及商品信息
-                final_system_prompt = f"{self.system_prompt}\n\n今天是 {today}\n\n可选仓库信息：\n{self._format_warehouse_info()}\n\n可选商品信息：\n{self._format_product_info()}"
-                messages.append({"role": "system", "content": final_system_prompt})
+                # 静态提示词（含仓库以及商品信息）放在最前且逐字节不变，便于命中 DeepSeek 的前缀缓存；
+                # 每天变化的日期单独作为第二条系统消息
+                messages.append(self._system_message)
+                messages.append(self._get_date_message(today))
             
-            conversation = self.get_conversation(user_id)
-            messages.extend(conversation)
+            history_start = len(messages)
+            messages.extend(self.get_conversation(user_id))
+            history_length = len(messages) - history_start
             messages.append({"role": "user", "content": message})
             
             # 确保会话存在
             self.create_session(user_id)
             
-            # 打印当前上下文信息
-            print("\n=== Current Context ===")
-            print(f"Session ID: {user_id}")
-            print(f"System Prompt: {self.system_prompt}")
-            print(f"History Length: {len(conversation)}")
-            print(f"Current Message: {message}")
-            print("=" * 50)
+            logger.debug("Current context: session=%s history=%d msg=%s", user_id, history_length, message)
+
+            # 流式输出期间提前发起的库存查询：JSON 数据块 -> Task
+            prefetch = {}
+
+            # 只有没有上下文的新会话才走回复缓存，保证回复不依赖历史信息
+            cache_key = None
+            if not current_data and history_length == 0:
+                cache_key = (today, _NORMALIZE_RE.sub("", message).casefold())
 
             try:
-                async with httpx.AsyncClient() as client:
-                    response = await client.post(
-                        f"{self.api_base}/chat/completions",
-                        headers={
-                            "Authorization": f"Bearer {self.api_key}",
-                            "Content-Type": "application/json"
-                        },
-                        json={
-                            "model": self.model,
-                            "messages": messages
-                        },
-                        timeout=30.0
-                    )
-                    
-                    if response.status_code == 200:
-                        result = response.json()
-                        assistant_message = result["choices"][0]["message"]["content"]
-                        logger.info(f"AI 回复: {assistant_message}")
-                        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                        
-                        # 更新会话历史
-                        self.conversations[user_id].append({
-                            "role": "user",
-                            "content": message,
-                            "timestamp": current_time
-                        })
-                        self.conversations[user_id].append({
-                            "role": "assistant",
-                            "content": assistant_message,
-                            "timestamp": current_time
-                        })
-                        
-                        # 在处理 JSON 数据时添加查询库存的处理
-                        if "<JSON>" in assistant_message and "</JSON>" in assistant_message:
-                            json_match = re.search(r'<JSON>(.*?)</JSON>', assistant_message, re.DOTALL)
-                            if json_match:
-                                json_str = json_match.group(1).strip()
-                                data = json.loads(json_str)
-                                
-                                # 处理查询库存请求
-                                if isinstance(data, list) and data[0].get('操作类型') == '查询库存':
-                                    if self._validate_inventory_data(data):
-                                        # 查询所有商品的库存
-                                        stock_info_list = []
-                                        for item in data:
-                                            stock_info = self._get_stock_info(item['商品ID'])
-                                            stock_info_list.append(stock_info)
-                                        
-                                        # 查询完成后清空会话历史
-                                        self.clear_session(user_id)
-                                        # 用两个换行符分隔每个商品的库存信息
-                                        return f"{assistant_message}\n\n" + "\n\n".join(stock_info_list)
-                                
-                                # 验证数据是否完整
-                                if self._validate_inventory_data(data):
-                                    # 尝试写入表格
-                                    try:
-                                        self._write_inventory_record(assistant_message)
-                                        # 写入成功后的处理
-                                        success_message = "✔数据已成功写入"
-                                        if data[0]['操作类型'] == '入库':
-                                            success_message += "入库表。"
-                                        else:
-                                            success_message += "出库表。"
-                                        assistant_message += f"\n\n{success_message}"
-                                        self.clear_session(user_id)
-                                    except Exception as e:
-                                        # 写入失败时，修改 AI 的回复
-                                        error_msg = f"\n\n写入失败: {str(e)}\n请重新提交。"
-                                        assistant_message += error_msg
-                        else:
-                            # 正常的历史记录管理
-                            if len(self.conversations[user_id]) > self.max_history * 2:
-                                self.conversations[user_id] = self.conversations[user_id][-self.max_history * 2:]
-                        
-                        return assistant_message
+                assistant_message = self._response_cache.get(cache_key) if cache_key else None
+                if assistant_message is not None:
+                    logger.debug("Response cache hit: session=%s", user_id)
+                    if on_token:
+                        await on_token(assistant_message)
+                else:
+                    # JSON 块一生成完就提前发起库存查询，与模型继续输出剩余文本并行
+                    def start_prefetch(block: str) -> None:
+                        task = self._start_stock_prefetch(block)
+                        if task is not None:
+                            prefetch[block] = task
+
+                    assistant_message = await self._stream_completion(messages, on_token, start_prefetch)
+                    # 含出入库数据的回复必须经过模型处理，不能缓存
+                    if cache_key and "<JSON>" not in assistant_message:
+                        self._response_cache[cache_key] = assistant_message
+                        if len(self._response_cache) > _RESPONSE_CACHE_SIZE:
+                            self._response_cache.popitem(last=False)
+                logger.info("AI 回复: %s", assistant_message)
+                self._pending_records.pop(user_id, None)
+                current_time = _now_str()
+
+                # 更新会话历史，一问一答一次追加
+                self.conversations[user_id].extend((
+                    {"role": "user", "content": message, "timestamp": current_time},
+                    {"role": "assistant", "content": assistant_message, "timestamp": current_time}
+                ))
+
+                # 在处理 JSON 数据时添加查询库存的处理
+                json_str = _extract_json_block(assistant_message)
+                if json_str is not None:
+                    data = orjson.loads(json_str)
+                    # 流式输出期间按同一数据块提前发起的库存查询
+                    prefetched = prefetch.get(json_str)
+
+                    # 处理查询库存请求
+                    if isinstance(data, list) and data[0].get('操作类型') == '查询库存':
+                        if self._validate_inventory_data(data):
+                            # 查询所有商品的库存
+                            stock_info_list = await (prefetched or self._query_stock_info(data))
+
+                            # 查询完成后清空会话历史
+                            self.clear_session(user_id)
+                            # 用两个换行符分隔每个商品的库存信息
+                            return f"{assistant_message}\n\n" + "\n\n".join(stock_info_list)
+
+                    # 验证数据是否完整
+                    if self._validate_inventory_data(data):
+                        # 尝试写入表格
+                        try:
+                            await self._write_inventory_record(data, user_id, stock_check=prefetched)
+                            # 写入成功后的处理
+                            success_message = "✔数据已成功写入"
+                            if data[0]['操作类型'] == '入库':
+                                success_message += "入库表。"
+                            else:
+                                success_message += "出库表。"
+                            assistant_message += f"\n\n{success_message}"
+                            self.clear_session(user_id)
+                        except Exception as e:
+                            # 写入失败时，修改 AI 的回复
+                            error_msg = f"\n\n写入失败: {str(e)}\n请重新提交。"
+                            assistant_message += error_msg
                     else:
-                        raise Exception(f"API 调用失败: {response.status_code} - {response.text}")
-                    
+                        # 记录尚未补全，留待用户补充
+                        self._pending_records[user_id] = data if isinstance(data, list) else [data]
+
+                return assistant_message
+
             except Exception as e:
                 raise Exception(f"与 DeepSeek 通信时发生错误: {str(e)}")
             
@@ -372,22 +804,94 @@ class DeepSeekChat:
         finally:
             self.current_user_id = None  # 清理当前用户ID
 
+    async def _try_complete_locally(self, message: str, user_id: str) -> Optional[str]:
+        """待补全记录只缺一个字段且用户消息恰好是该字段的值时，不调用模型直接补全写入
+
+        无法确定时返回 None，由模型继续处理
+        """
+        records = self._pending_records.get(user_id)
+        if not records or len(records) != 1:
+            return None
+        record = records[0]
+        fields = _RECORD_FIELDS.get(record.get('操作类型'))
+        if fields is None:
+            return None
+
+        amount_fields = _AMOUNT_FIELDS[record['操作类型']]
+        missing = [
+            field for field, field_type in fields
+            if _is_invalid_value(record.get(field), field_type)
+            or (field in amount_fields and record[field] <= 0)
+        ]
+        if len(missing) != 1 or missing[0] not in _LOCAL_FILL_RULES:
+            return None
+
+        field = missing[0]
+        pattern, convert = _LOCAL_FILL_RULES[field]
+        text = message.strip()
+        if not pattern.fullmatch(text):
+            return None
+
+        candidate = dict(record, **{field: convert(text)})
+        if not self._validate_inventory_data(candidate):
+            return None
+
+        operation = candidate['操作类型']
+        reply = (
+            f"<JSON>\n{_dumps_pretty([candidate])}\n</JSON>\n"
+            f"{operation}信息已收集完整，我已记录。"
+        )
+        logger.info(f"本地补全字段 {field}，跳过模型调用: session={user_id}")
+        try:
+            await self._write_inventory_record([candidate], user_id)
+        except Exception as e:
+            current_time = _now_str()
+            reply += f"\n\n写入失败: {str(e)}\n请重新提交。"
+            self.create_session(user_id)
+            self.conversations[user_id].extend((
+                {"role": "user", "content": message, "timestamp": current_time},
+                {"role": "assistant", "content": reply, "timestamp": current_time}
+            ))
+            self._pending_records.pop(user_id, None)
+            return reply
+
+        self.clear_session(user_id)
+        return f"{reply}\n\n✔数据已成功写入{operation}表。"
+
+    async def chat_stream(self, message: str, user_id: str) -> AsyncIterator[str]:
+        """chat 的流式版本：逐段产出模型输出，最后产出写表结果等追加内容"""
+        queue: asyncio.Queue = asyncio.Queue()
+        task = asyncio.create_task(self.chat(message, user_id, on_token=queue.put))
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+
+        streamed = []
+        while (token := await queue.get()) is not None:
+            streamed.append(token)
+            yield token
+
+        # chat 可能在模型输出后追加内容（写表结果、库存信息），出错时则整体返回错误信息
+        reply = await task
+        streamed_text = "".join(streamed)
+        tail = reply[len(streamed_text):] if reply.startswith(streamed_text) else f"\n\n{reply}"
+        if tail:
+            yield tail
+
     def clear_session(self, session_id: str) -> None:
         """清除指定会话的上下文历史"""
         if session_id in self.conversations:
-            self.conversations[session_id] = []
+            self.conversations[session_id].clear()
+        self._pending_records.pop(session_id, None)
 
-    def _process_inventory_message(self, message: str) -> None:
+    async def _process_inventory_message(self, message: str) -> None:
         """处理入库相关的消息"""
         try:
             # 尝试从消息中提取 JSON 数据
-            json_match = re.search(r'<JSON>(.*?)</JSON>', message, re.DOTALL)
-            if not json_match:
+            json_str = _extract_json_block(message)
+            if json_str is None:
                 logger.info("消息中未找到 JSON 数据")
                 return None
                 
-            json_str = json_match.group(1).strip()
-            new_data = json.loads(json_str)
+            new_data = orjson.loads(json_str)
             
             # 将新数据合并到现有数据中
             self.current_inventory_data.update(new_data)
@@ -417,7 +921,7 @@ class DeepSeekChat:
                 return response_data
             
             # 所有信息收集完毕，可以写入数据库
-            self._write_inventory_record(self.current_inventory_data)
+            await self._write_inventory_record(self.current_inventory_data)
             
             # 写入成功后清空当前数据并返回成功响应
             response_data = {
@@ -427,85 +931,130 @@ class DeepSeekChat:
             self.current_inventory_data = {}
             return response_data
             
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             logger.error("JSON 解析错误")
             return {'status': 'error', 'message': 'JSON 格式错误'}
         except Exception as e:
             logger.error(f"处理入库记录时发生错误: {str(e)}", exc_info=True)
             return {'status': 'error', 'message': str(e)}
             
-    def _write_inventory_record(self, message: str) -> None:
-        """解析出入库信息并写入相应的表格"""
+    async def _write_inventory_record_from_message(self, message: str, user_id: Optional[str] = None) -> None:
+        """从包含 <JSON> 数据块的回复中解析出入库记录并写入表格"""
+        json_str = _extract_json_block(message)
+        if json_str is None:
+            raise ValueError("消息中未找到 JSON 数据")
         try:
-            if isinstance(message, str):
-                json_match = re.search(r'<JSON>(.*?)</JSON>', message, re.DOTALL)
-                if not json_match:
-                    raise ValueError("消息中未找到 JSON 数据")
-                json_str = json_match.group(1).strip()
-                data = json.loads(json_str)
-                
-                if isinstance(data, dict):
-                    data = [data]
-                
-                # 检查出库库存
-                if data[0]['操作类型'] == '出库':
-                    insufficient_stock = []
-                    for record in data:
-                        is_sufficient, current_stock = self._check_stock(
-                            record['商品ID'],
-                            record['仓库名'],
-                            float(record['出库数量'])
-                        )
-                        if not is_sufficient:
-                            insufficient_stock.append({
-                                'name': record['商品名称'],
-                                'required': float(record['出库数量']),
-                                'current': current_stock
-                            })
-                    
-                    if insufficient_stock:
-                        error_msg = "以下商品库存不足：\n"
-                        for item in insufficient_stock:
-                            error_msg += f"- {item['name']}: 需要 {item['required']}, 当前库存 {item['current']}\n"
-                        error_msg += "\n请调整出库数量或等待库存补充。"
-                        raise ValueError(error_msg)
-
-                # 处理记录
-                current_time = int(datetime.now().timestamp() * 1000)
-                processed_records = []
-                
-                for record in data:
-                    record['操作时间'] = current_time
-                    record['操作者ID'] = [{"id": self.current_user_id}] if self.current_user_id else []
-                    
-                    if not self._validate_inventory_data(record):
-                        continue
+            data = orjson.loads(json_str)
+        except orjson.JSONDecodeError:
+            raise ValueError("JSON 格式错误")
+        if not self._validate_inventory_data(data):
+            raise ValueError("没有有效的记录可以处理")
+        await self._write_inventory_record(data, user_id)
 
-                    try:
-                        date_obj = datetime.strptime(record['出入库日期'], '%Y-%m-%d')
-                        record['出入库日期'] = int(date_obj.timestamp() * 1000)
-                    except ValueError:
-                        continue
+    def _start_stock_prefetch(self, json_str: str) -> Optional[asyncio.Task]:
+        """为刚生成完的 JSON 数据块提前发起只读的库存查询，写入仍在回复完整后进行
 
-                    processed_records.append(record)
+        查询库存请求预取库存信息，出库请求预先检查库存；其他情况返回 None
+        """
+        try:
+            data = orjson.loads(json_str)
+        except orjson.JSONDecodeError:
+            return None
+        if not isinstance(data, list) or not data or not self._validate_inventory_data(data):
+            return None
 
-                if not processed_records:
-                    raise ValueError("没有有效的记录可以处理")
-                
-                # 写入记录
-                if processed_records[0]['操作类型'] == '入库':
-                    manager = InboundManager()
-                    if not manager.add_inbound(processed_records):
-                        raise Exception("写入入库记录失败")
-                else:
-                    manager = OutboundManager()
-                    if not manager.add_outbound(processed_records):
-                        raise Exception("写入出库记录失败")
+        operation = data[0].get('操作类型')
+        if operation == '查询库存':
+            task = asyncio.ensure_future(self._query_stock_info(data))
+        elif operation == '出库':
+            task = asyncio.ensure_future(self._check_outbound_stock(data))
+        else:
+            return None
+        # 回复中途失败时没有人等待结果，在这里取走异常，避免未处理异常的告警
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
 
-        except json.JSONDecodeError as e:
-            raise ValueError("JSON 格式错误")
-        except Exception as e:
-            raise
+    async def _query_stock_info(self, data: List[dict]) -> List[str]:
+        """在线程中并发查询各商品的库存信息"""
+        return await asyncio.gather(*(
+            asyncio.to_thread(self._get_stock_info, item['商品ID'])
+            for item in data
+        ))
+
+    async def _check_outbound_stock(self, data: List[dict]) -> None:
+        """检查出库库存，不足时抛出 ValueError；各商品的库存查询互不依赖，并发执行"""
+        stock_results = await asyncio.gather(*(
+            asyncio.to_thread(
+                self._check_stock,
+                record['商品ID'],
+                record['仓库名'],
+                float(record['出库数量'])
+            )
+            for record in data
+        ))
+        insufficient_stock = []
+        for record, (is_sufficient, current_stock) in zip(data, stock_results):
+            if not is_sufficient:
+                insufficient_stock.append({
+                    'name': record['商品名称'],
+                    'required': float(record['出库数量']),
+                    'current': current_stock
+                })
+        
+        if insufficient_stock:
+            error_msg = "以下商品库存不足：\n"
+            for item in insufficient_stock:
+                error_msg += f"- {item['name']}: 需要 {item['required']}, 当前库存 {item['current']}\n"
+            error_msg += "\n请调整出库数量或等待库存补充。"
+            raise ValueError(error_msg)
+
+    async def _write_inventory_record(
+        self,
+        data: List[dict],
+        user_id: Optional[str] = None,
+        stock_check: Optional[Awaitable[None]] = None
+    ) -> None:
+        """将已解析并校验过的出入库记录写入相应的表格，user_id 为操作者（并发时需显式传入）
+
+        stock_check 为已提前发起的出库库存检查，给出时直接等待其结果，不再重复查询
+        """
+        user_id = user_id or self.current_user_id
+        if isinstance(data, dict):
+            data = [data]
+        
+        if data[0]['操作类型'] == '出库':
+            await (stock_check or self._check_outbound_stock(data))
+
+        # 处理记录
+        # 同一批记录共用操作时间和操作者，日期按取值只解析一次
+        current_time = time.time_ns() // 1_000_000
+        operator = [{"id": user_id}] if user_id else []
+        date_ms = {}
+        processed_records = []
+        
+        for record in data:
+            record['操作时间'] = current_time
+            record['操作者ID'] = operator
+
+            entry_date = record['出入库日期']
+            if entry_date not in date_ms:
+                date_ms[entry_date] = _date_to_ms(entry_date)
+            if date_ms[entry_date] is None:
+                continue
+            record['出入库日期'] = date_ms[entry_date]
+
+            processed_records.append(record)
+
+        if not processed_records:
+            raise ValueError("没有有效的记录可以处理")
+        
+        # 写入记录（管理器内部持有 INVENTORY_WRITE_LOCK，同一汇总行的读改写在进程内串行，整批放到线程中执行）
+        if processed_records[0]['操作类型'] == '入库':
+            if not await asyncio.to_thread(self.inbound_manager.add_inbound, processed_records):
+                raise Exception("写入入库记录失败")
+        else:
+            if not await asyncio.to_thread(self.outbound_manager.add_outbound, processed_records):
+                raise Exception("写入出库记录失败")
 
     def _validate_inventory_data(self, data: dict) -> bool:
         """验证库存数据的完整性"""
@@ -513,102 +1062,90 @@ class DeepSeekChat:
             if isinstance(data, list):
                 return all(self._validate_inventory_data(item) for item in data)
             
-            # 添加对查询库存操作的验证
-            if data.get('操作类型') == '查询库存':
-                required_fields = {
-                    '商品ID': str,
-                    '商品名称': str
-                }
-                # 验证必要字段
-                for field, field_type in required_fields.items():
-                    if field not in data:
-                        return False
-                    if not isinstance(data[field], field_type):
-                        return False
-                    if isinstance(data[field], str) and not data[field].strip():
-                        return False
-                return True
+            if '商品ID' in data:
+                data['商品ID'] = str(data['商品ID'])
             
-            base_fields = {
-                '出入库日期': str,
-                '商品ID': str,
-                '商品名称': str,
-                '仓库名': str,
-                '操作类型': str,
-            }
+            # 查询库存只需要商品信息
+            operation = data.get('操作类型')
+            if operation == '查询库存':
+                invalid_field = self._find_invalid_field(data, _QUERY_FIELDS)
+                if invalid_field:
+                    logger.info(f"库存数据校验未通过: 字段 {invalid_field} 缺失或无效")
+                    return False
+                return self._is_known_product(data)
             
-            optional_fields = {
-                '快递单号': str,
-                '快递手机号': str
-            }
+            required_fields = _RECORD_FIELDS.get(operation)
+            if required_fields is None:
+                logger.info(f"库存数据校验未通过: 未知操作类型 {operation}")
+                return False
+            
+            # 数量、单价是带单位的字符串时，先去掉单位转为数字，无法转换的交给下面的类型校验
+            for field in _AMOUNT_FIELDS[operation]:
+                value = data.get(field)
+                if isinstance(value, str):
+                    try:
+                        data[field] = _parse_number(value.translate(_UNIT_STRIP))
+                    except ValueError:
+                        pass
             
             # 验证仓库信息
-            if '仓库名' in data and data['仓库名']:
-                warehouse_info = self.warehouses[
-                    self.warehouses['仓库名'] == data['仓库名']
-                ].iloc[0] if not self.warehouses.empty else None
+            warehouse_name = data.get('仓库名')
+            if warehouse_name:
+                warehouse_info = self._warehouse_by_name.get(warehouse_name)
                 
                 if warehouse_info is not None:
-                    data['仓库地址'] = warehouse_info['仓库地址']
-                    data['仓库备注'] = warehouse_info.get('仓库备注', '')
+                    data['仓库地址'] = warehouse_info.address
+                    data['仓库备注'] = warehouse_info.remark
                 else:
+                    logger.info(f"库存数据校验未通过: 未知仓库 {warehouse_name}")
                     return False
             
-            # 根据操作类型添加字段
-            if data.get('操作类型') == '入库':
-                base_fields.update({
-                    '入库数量': (int, float),
-                    '入库单价': (int, float),
-                    '供应商': str
-                })
-            elif data.get('操作类型') == '出库':
-                base_fields.update({
-                    '出库数量': (int, float),
-                    '出库单价': (int, float),
-                    '客户': str
-                })
-            else:
-                return False
-            
             # 验证必要字段
-            for field, field_type in base_fields.items():
-                if field not in data:
-                    return False
-                
-                if field == '商品ID':
-                    data[field] = str(data[field])
-                
-                if not isinstance(data[field], field_type):
-                    if isinstance(field_type, tuple):
-                        if not any(isinstance(data[field], t) for t in field_type):
-                            return False
-                    else:
-                        return False
-                
-                if isinstance(data[field], str) and not data[field].strip():
-                    return False
+            invalid_field = self._find_invalid_field(data, required_fields)
+            if invalid_field:
+                logger.info(f"库存数据校验未通过: 字段 {invalid_field} 缺失或无效")
+                return False
+            if not self._is_known_product(data):
+                return False
             
             # 验证可选字段
-            for field, field_type in optional_fields.items():
-                if field in data and data[field]:
+            for field, field_type in _OPTIONAL_FIELDS:
+                if data.get(field):
                     if not isinstance(data[field], field_type):
+                        logger.info(f"库存数据校验未通过: 字段 {field} 类型错误")
                         return False
                 else:
                     data[field] = ""
             
             # 验证数值
-            if data['操作类型'] == '入库':
-                if float(data['入库数量']) <= 0 or float(data['入库单价']) <= 0:
-                    return False
-            else:
-                if float(data['出库数量']) <= 0 or float(data['出库单价']) <= 0:
+            for field in _AMOUNT_FIELDS[operation]:
+                if float(data[field]) <= 0:
+                    logger.info(f"库存数据校验未通过: 字段 {field} 必须大于 0")
                     return False
             
             return True
             
-        except Exception:
+        except Exception as e:
+            logger.info(f"库存数据校验未通过: {str(e)}")
             return False
 
+    def _is_known_product(self, data: dict) -> bool:
+        """商品ID或商品名称需存在于商品表中（商品表为空时不校验）"""
+        if not self._valid_product_ids:
+            return True
+        if data['商品ID'] in self._valid_product_ids or data['商品名称'] in self._valid_product_names:
+            return True
+        logger.info(f"未知商品: {data['商品名称']}（ID: {data['商品ID']}）")
+        return False
+
+    @staticmethod
+    def _find_invalid_field(data: dict, fields: Tuple[Tuple[str, type], ...]) -> Optional[str]:
+        """按字段规则检查必填字段的存在性、类型以及字符串非空，返回第一个不合格的字段名"""
+        for field, field_type in fields:
+            if _is_invalid_value(data.get(field), field_type):
+                return field
+        return None
+
     def _check_stock(self, product_id: str, warehouse: str, required_qty: float) -> tuple[bool, float]:
         """检查商品库存是否充足"""
         try:
@@ -669,7 +1206,7 @@ class DeepSeekChat:
 
 # 使用示例
 async def main():
-    deepseek = DeepSeekChat()  # 移除了不存在的 Config 参数
+    deepseek = await DeepSeekChat.create()
     
     # 创建新会话
     session_id = "user_123"
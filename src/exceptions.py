@@ -1,6 +1,7 @@
 """
 统一异常处理模块
 """
+import asyncio
 import functools
 import logging
 import traceback
@@ -136,42 +137,38 @@ def exception_handler(
         handled_exceptions: 要处理的异常类型
     """
     def decorator(func: Callable) -> Callable:
-        @functools.wraps(func)
-        def sync_wrapper(*args, **kwargs):
-            try:
-                return func(*args, **kwargs)
-            except handled_exceptions as e:
+        def log_error(e: Exception) -> None:
+            if logger:
                 error_msg = f"Error in {func.__name__}: {str(e)}"
+                if isinstance(e, BaseInventoryError):
+                    logger.error(error_msg, extra={"error_details": e.to_dict()})
+                else:
+                    logger.error(error_msg, exc_info=True)
 
-                if logger:
-                    if isinstance(e, BaseInventoryError):
-                        logger.error(error_msg, extra={"error_details": e.to_dict()})
-                    else:
-                        logger.error(error_msg, exc_info=True)
+        # 装饰时就确定函数类型，只创建需要的那个包装函数
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                try:
+                    return await func(*args, **kwargs)
+                except handled_exceptions as e:
+                    log_error(e)
+                    if reraise:
+                        raise
+                    return default_return
 
-                if reraise:
-                    raise
-                return default_return
+            return async_wrapper
 
         @functools.wraps(func)
-        async def async_wrapper(*args, **kwargs):
+        def sync_wrapper(*args, **kwargs):
             try:
-                return await func(*args, **kwargs)
+                return func(*args, **kwargs)
             except handled_exceptions as e:
-                error_msg = f"Error in {func.__name__}: {str(e)}"
-
-                if logger:
-                    if isinstance(e, BaseInventoryError):
-                        logger.error(error_msg, extra={"error_details": e.to_dict()})
-                    else:
-                        logger.error(error_msg, exc_info=True)
-
+                log_error(e)
                 if reraise:
                     raise
                 return default_return
 
-        if asyncio.iscoroutinefunction(func):
-            return async_wrapper
         return sync_wrapper
 
     return decorator
@@ -211,7 +208,3 @@ def safe_execute(
             print(traceback.format_exc())
 
         return default_return
-
-
-# 为了避免循环导入，在这里导入asyncio
-import asyncio
\ No newline at end of file
@@ -1,73 +1,349 @@
-from typing import List, Dict
-import requests
+from typing import List, Dict, Tuple, Iterator, AsyncIterator
+from concurrent.futures import ThreadPoolExecutor, Future
+from functools import lru_cache
 from datetime import datetime, timedelta
 import time
+import uuid
 import logging
+import threading
+import weakref
+import asyncio
+import httpx
+import orjson
+from retry_manager import RetryConfig, CircuitBreaker, create_http_client, create_sync_http_client
+from exceptions import NetworkError, FeishuError
+
+# 限流和服务端暂时性错误的 HTTP 状态码，可以退避后重试
+_RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+
+# 多维表格批量接口单次请求的记录数上限
+BATCH_LIMIT = 500
+
+# 飞书开放平台的限流错误码
+_RATE_LIMIT_CODES = frozenset({99991400})
+
+# 连接阶段的失败，请求一定没有发到服务端，任何请求都可以安全重试
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+# 请求体用 orjson 序列化；兼容标准库 json 允许的非字符串键，并支持 DataFrame 中取出的 numpy 数值
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+@lru_cache(maxsize=256)
+def _table_url(base_url: str, app_token: str, table_id: str) -> str:
+    """多维表格数据表的 URL 前缀，同一张表的各个接口共用"""
+    return f"{base_url}/bitable/v1/apps/{app_token}/tables/{table_id}"
+
+
+def _partial_write_error(created: List[Dict], total: int, cause: Exception) -> FeishuError:
+    """分批写入中途失败：异常里带上已写入的记录，调用方据此核对，不要整批重试"""
+    return FeishuError(
+        f"分批写入失败，{total} 条记录中已写入 {len(created)} 条: {cause}",
+        details={"created_records": created},
+        cause=cause
+    )
+
+
+def _encode_body(json: Dict = None):
+    """请求体序列化一次，重试时复用同一份字节"""
+    return orjson.dumps(json, option=_ORJSON_OPTIONS) if json is not None else None
+
+
+def _has_client_token(json: Dict = None, params: Dict = None) -> bool:
+    """请求是否带了飞书的幂等键 client_token"""
+    return bool((params and params.get("client_token")) or (json and json.get("client_token")))
+
+
+def _warn_not_retried(logger: logging.Logger, method: str, url: str, reason: str) -> None:
+    logger.warning(
+        f"非幂等请求 {method} {url} 失败（{reason}），服务端可能已处理，不自动重试；"
+        f"需要重试时请在请求中携带 client_token"
+    )
+
+
+class _AppToken:
+    """同一应用（app_id）的访问令牌，所有 FeishuSheet 实例共用，只保留一个后台刷新定时器"""
+
+    def __init__(self):
+        self.token = None
+        self.expire_time = None
+        # 令牌的获取和后台刷新互斥，避免并发时重复请求
+        self.lock = threading.RLock()
+        self.refresh_timer = None
+
 
 class FeishuSheet:
+    # 访问令牌的有效期优先使用接口返回的 expire，缺失时按 115 分钟计；过期前 5 分钟在后台提前刷新
+    TOKEN_TTL = timedelta(minutes=115)
+    TOKEN_REFRESH_AHEAD = 300
+
+    # 所有实例访问同一个飞书域名，共用一个熔断器：连续 5 次请求在重试后仍因网络或服务端错误失败时熔断，
+    # 熔断期间直接失败；恢复等待从 0.5 秒起，探测失败时翻倍，最长 60 秒
+    _circuit_breaker = CircuitBreaker(
+        failure_threshold=5,
+        recovery_timeout=0.5,
+        expected_exception=NetworkError,
+        max_recovery_timeout=60.0
+    )
+
+    # 访问令牌按 app_id 在实例间共用：管理器按需创建时不必各自获取令牌，也不会各自起一个刷新定时器
+    _app_tokens: Dict[str, _AppToken] = {}
+    _app_tokens_lock = threading.Lock()
+
     def __init__(self, app_id: str, app_secret: str, tables_config: Dict = None):
         self.app_id = app_id
         self.app_secret = app_secret
         self.base_url = "https://open.feishu.cn/open-apis"
-        self.token = None
-        self.token_expire_time = None
+        with self._app_tokens_lock:
+            self._app_token = self._app_tokens.setdefault(app_id, _AppToken())
         self.max_retries = 3
+        # 首次请求之外最多重试 max_retries 次，退避从 1 秒起翻倍，最长 30 秒
+        self.retry_config = RetryConfig(max_attempts=self.max_retries + 1, base_delay=1.0, max_delay=30.0)
         self.timeout = 10  # 请求超时时间（秒）
+        # 复用同一个 httpx.Client，保持与飞书的长连接；安装了 h2 时启用 HTTP/2，多线程并发请求复用同一条连接
+        # 所有接口都以 JSON 交互，公共请求头放在客户端上
+        self._client = create_sync_http_client(
+            timeout=self.timeout,
+            http2=True,
+            headers={"Content-Type": "application/json; charset=utf-8"}
+        )
+        self._token_lock = self._app_token.lock
+        # (令牌, 请求头)，令牌不变时各请求共用同一个请求头字典
+        self._auth_headers_cache = (None, {})
+        # 字段（表头）配置很少变化，按 (app_token, table_id) 缓存 _fields_ttl 秒，字段增删改时失效
+        self._fields_cache: Dict[Tuple[str, str], Tuple[float, List[Dict]]] = {}
+        self._fields_ttl = 300
+        self._fields_lock = threading.Lock()
+        # 进行中的读请求，相同的并发读共用一次网络请求
+        self._inflight: Dict[Tuple, Future] = {}
+        self._inflight_lock = threading.Lock()
         # logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
 
-    def _make_request(self, method: str, url: str, headers: Dict, json: Dict = None, params: Dict = None, retry_count: int = 0) -> Dict:
-        """统一的请求处理方法，包含重试逻辑"""
+    def _make_request(self, method: str, url: str, headers: Dict, json: Dict = None, params: Dict = None,
+                      idempotent: bool = True) -> Dict:
+        """统一的请求处理方法，经过熔断器，飞书不可用时快速失败而不是每次都等完所有重试
+
+        GET 请求按 URL 和参数合并：同样的读请求正在进行时直接等它的结果，返回的数据被这些调用方共用，不能修改。
+        写请求完成后清空进行中的读请求表，之后的读不会合并到写之前发出的请求上，读到的一定包含这次写入
+        """
+        if method == "GET":
+            return self._coalesced_get(url, headers, params)
         try:
-            response = requests.request(
-                method=method,
-                url=url,
-                headers=headers,
-                json=json,
-                params=params,
-                timeout=self.timeout
-            )
-            data = response.json()
+            return self._circuit_breaker.call(self._request_with_retry, method, url, headers, json, params, idempotent)
+        finally:
+            with self._inflight_lock:
+                self._inflight.clear()
+
+    def _coalesced_get(self, url: str, headers: Dict, params: Dict = None) -> Dict:
+        key = (url, tuple(sorted(params.items())) if params else ())
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                leader = False
+            else:
+                leader = True
+                future = self._inflight[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            data = self._circuit_breaker.call(self._request_with_retry, "GET", url, headers, None, params, True)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(data)
+            return data
+        finally:
+            with self._inflight_lock:
+                # 期间有写请求时表已被清空，可能已换成新的请求
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+
+    def _request_with_retry(self, method: str, url: str, headers: Dict, json: Dict = None, params: Dict = None,
+                            idempotent: bool = True) -> Dict:
+        """发送请求，包含重试逻辑
+
+        超时、连接错误、HTTP 429/5xx 以及飞书限流错误码按指数退避（带抖动）重试，令牌过期时刷新后立即重试；
+        重试耗尽时网络和服务端错误抛出 NetworkError（计入熔断），业务错误抛出普通异常。
+
+        非幂等请求（idempotent=False，如追加行、新建记录）在请求可能已被服务端处理的情况下
+        （读超时、连接中断、HTTP 5xx）不重试，避免重复写入；请求参数或请求体里带 client_token 时
+        由飞书去重，仍按上面的规则重试
+        """
+        retry_safe = idempotent or _has_client_token(json, params)
+        body = _encode_body(json)
+        max_attempts = self.retry_config.max_attempts
+        for attempt in range(1, max_attempts + 1):
+            is_last = attempt == max_attempts
+            try:
+                response = self._client.request(
+                    method=method,
+                    url=url,
+                    headers=headers,
+                    content=body,
+                    params=params
+                )
+            except httpx.TransportError as e:
+                if not retry_safe and not isinstance(e, _NOT_SENT_ERRORS):
+                    _warn_not_retried(self.logger, method, url, str(e))
+                    raise NetworkError(f"请求超时或连接中断，写入结果未知: {str(e)}", url=url, cause=e)
+                if is_last:
+                    self.logger.error(f"请求异常: {str(e)}")
+                    raise NetworkError(f"请求超时或连接失败，已达到最大重试次数: {str(e)}", url=url, cause=e)
+                self._sleep_backoff(attempt, f"请求超时或连接失败: {str(e)}")
+                continue
+
+            # 限流和服务端错误是暂时性的，退避后重试；429 表示请求被拒绝，非幂等请求也可以重试
+            if response.status_code in _RETRYABLE_STATUS:
+                if not retry_safe and response.status_code != 429:
+                    _warn_not_retried(self.logger, method, url, f"HTTP {response.status_code}")
+                    raise NetworkError(
+                        f"API请求失败: HTTP {response.status_code}，写入结果未知",
+                        url=url, status_code=response.status_code
+                    )
+                if is_last:
+                    self.logger.error(f"请求异常: HTTP {response.status_code}")
+                    raise NetworkError(
+                        f"API请求失败: HTTP {response.status_code}", url=url, status_code=response.status_code
+                    )
+                self._sleep_backoff(attempt, f"HTTP {response.status_code}")
+                continue
+
+            try:
+                data = orjson.loads(response.content)
+            except ValueError:
+                self.logger.error(f"请求异常: HTTP {response.status_code} 响应不是 JSON")
+                raise Exception(f"API请求失败: HTTP {response.status_code}")
             
-            # Log response
-            self.logger.info(f"Response: {data}")
+            # 完整响应可能很大（整页记录），只在 DEBUG 级别下才格式化输出
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Response: %s", data)
             
-            if data.get("code") == 0:
+            code = data.get("code")
+            if code == 0:
                 return data
             
-            # 如果是token过期，刷新token后重试
-            if data.get("code") == 99991663 and retry_count < self.max_retries:
-                self.token = None
-                self.logger.info("Token expired, refreshing...")
-                return self._make_request(method, url, headers, json, params, retry_count + 1)
+            if not is_last:
+                # 如果是token过期，刷新token并换上新的请求头后重试
+                if code == 99991663:
+                    self.logger.info("Token expired, refreshing...")
+                    headers = self._refresh_auth_header(headers)
+                    continue
+                if code in _RATE_LIMIT_CODES:
+                    self._sleep_backoff(attempt, f"触发飞书限流 (code={code})")
+                    continue
                 
+            self.logger.error(f"请求异常: API请求失败: {data}")
             raise Exception(f"API请求失败: {data}")
-            
-        except requests.exceptions.Timeout:
-            if retry_count < self.max_retries:
-                self.logger.warning(f"请求超时，第{retry_count + 1}次重试")
-                time.sleep(1)  # 重试前等待1秒
-                return self._make_request(method, url, headers, json, params, retry_count + 1)
-            raise Exception("请求超时，已达到最大重试次数")
-            
-        except Exception as e:
-            self.logger.error(f"请求异常: {str(e)}")
-            raise
+
+    def _sleep_backoff(self, attempt: int, reason: str) -> None:
+        """按第 attempt 次失败计算退避时间并等待"""
+        delay = self.retry_config.calculate_delay(attempt)
+        self.logger.warning(f"{reason}，{delay:.1f} 秒后第{attempt}次重试")
+        time.sleep(delay)
+
+    def close(self) -> None:
+        """关闭底层连接池，并停止令牌的后台刷新（同一应用的其他实例在请求时按需重新获取）"""
+        with self._token_lock:
+            if self._app_token.refresh_timer:
+                self._app_token.refresh_timer.cancel()
+                self._app_token.refresh_timer = None
+        self._client.close()
+
+    @property
+    def token(self) -> str:
+        return self._app_token.token
+
+    @token.setter
+    def token(self, value: str) -> None:
+        self._app_token.token = value
+
+    @property
+    def token_expire_time(self) -> datetime:
+        return self._app_token.expire_time
+
+    @token_expire_time.setter
+    def token_expire_time(self, value: datetime) -> None:
+        self._app_token.expire_time = value
+
+    def _token_valid(self) -> bool:
+        """缓存的令牌是否仍有效，距过期不足 TOKEN_REFRESH_AHEAD 秒时视为需要刷新"""
+        return bool(
+            self.token and self.token_expire_time
+            and datetime.now() + timedelta(seconds=self.TOKEN_REFRESH_AHEAD) < self.token_expire_time
+        )
+
+    def _auth_headers(self) -> Dict:
+        """带当前令牌的请求头，令牌换新时才重新构造；返回的字典被多个请求共用，调用方不能修改"""
+        token = self._get_access_token()
+        cached = self._auth_headers_cache
+        if cached[0] != token:
+            cached = (token, {"Authorization": f"Bearer {token}"})
+            self._auth_headers_cache = cached
+        return cached[1]
+
+    def _refresh_auth_header(self, headers: Dict) -> Dict:
+        """请求因令牌失效被拒时重新获取令牌，返回带新令牌的请求头"""
+        with self._token_lock:
+            # 其他线程可能已经换了新令牌，只有请求用的仍是当前令牌时才作废
+            if headers.get("Authorization") == f"Bearer {self.token}":
+                self.token = None
+            token = self._get_access_token()
+        return {**headers, "Authorization": f"Bearer {token}"}
 
     def _get_access_token(self) -> str:
         """获取访问令牌"""
-        if self.token and self.token_expire_time and datetime.now() < self.token_expire_time:
+        if self._token_valid():
             return self.token
 
+        with self._token_lock:
+            # 等锁期间令牌可能已被其他线程或后台刷新更新
+            if self._token_valid():
+                return self.token
+            return self._fetch_access_token()
+
+    def _fetch_access_token(self) -> str:
+        """请求新的访问令牌，并安排在过期前后台刷新，调用方需持有 _token_lock"""
         url = f"{self.base_url}/auth/v3/tenant_access_token/internal"
-        headers = {"Content-Type": "application/json; charset=utf-8"}
+        headers = {}
         payload = {"app_id": self.app_id, "app_secret": self.app_secret}
         
         data = self._make_request("POST", url, headers, payload)
         self.token = data.get("tenant_access_token")
-        self.token_expire_time = datetime.now() + timedelta(minutes=115)
+        ttl = timedelta(seconds=data["expire"]) if data.get("expire") else self.TOKEN_TTL
+        self.token_expire_time = datetime.now() + ttl
+        self._schedule_token_refresh(ttl.total_seconds() - self.TOKEN_REFRESH_AHEAD)
         return self.token
 
+    def _schedule_token_refresh(self, delay: float) -> None:
+        """用守护线程定时器在令牌过期前刷新，请求路径上不再等待令牌获取
+
+        同一应用只保留一个定时器；定时器只持有实例的弱引用，不会让实例及其连接池常驻，
+        实例被回收后不再刷新，由其他实例的请求路径按需重新获取。调用方需持有 _token_lock
+        """
+        shared = self._app_token
+        if shared.refresh_timer:
+            shared.refresh_timer.cancel()
+        timer = threading.Timer(max(delay, 0), self._refresh_token_in_background, args=(weakref.ref(self),))
+        timer.daemon = True
+        timer.start()
+        shared.refresh_timer = timer
+
+    @staticmethod
+    def _refresh_token_in_background(sheet_ref: "weakref.ref[FeishuSheet]") -> None:
+        """后台刷新访问令牌，失败时保留旧令牌，由请求路径按需重新获取"""
+        sheet = sheet_ref()
+        if sheet is None:
+            return
+        try:
+            with sheet._token_lock:
+                sheet._fetch_access_token()
+            sheet.logger.info("访问令牌已在后台刷新")
+        except Exception as e:
+            sheet.logger.warning(f"后台刷新访问令牌失败，将在下次请求时重新获取: {str(e)}")
+
     def read_sheet(self, table_name: str = None, spreadsheet_token: str = None, 
                   sheet_id: str = None, range: str = None) -> List[List]:
         """读取表格数据"""
@@ -83,10 +359,13 @@ class FeishuSheet:
             raise ValueError("需要提供完整的表格信息")
 
         url = f"{self.base_url}/sheets/v2/spreadsheets/{spreadsheet_token}/values/{sheet_id}!{range}"
-        headers = {"Authorization": f"Bearer {self._get_access_token()}"}
+        headers = self._auth_headers()
         
         data = self._make_request("GET", url, headers)
-        return data.get("data", {}).get("valueRange", {}).get("values", [])
+        try:
+            return data["data"]["valueRange"]["values"]
+        except (KeyError, TypeError):
+            return []
 
     def write_sheet(self, table_name: str = None, values: List[List] = None,
                    spreadsheet_token: str = None, sheet_id: str = None, 
@@ -105,17 +384,14 @@ class FeishuSheet:
 
         # 更新为 v3 API
         url = f"{self.base_url}/sheets/v2/spreadsheets/{spreadsheet_token}/values_append"
-        headers = {
-            "Authorization": f"Bearer {self._get_access_token()}",
-            "Content-Type": "application/json; charset=utf-8"
-        }
+        headers = self._auth_headers()
 
         payload =  {"valueRange":{
             "range": f"{sheet_id}!{range}",
             "values": values
         }}
     
-        self._make_request("POST", url, headers, payload)
+        self._make_request("POST", url, headers, payload, idempotent=False)
 
     def read_bitable(self, app_token: str, table_id: str, page_size: int = 200, page_token: str = None, filter_expr: str = None) -> Dict:
         """读取多维表格数据
@@ -130,11 +406,8 @@ class FeishuSheet:
         Returns:
             Dict: 包含表格数据和元信息的字典
         """
-        url = f"{self.base_url}/bitable/v1/apps/{app_token}/tables/{table_id}/records"
-        headers = {
-            "Authorization": f"Bearer {self._get_access_token()}",
-            "Content-Type": "application/json; charset=utf-8"
-        }
+        url = f"{_table_url(self.base_url, app_token, table_id)}/records"
+        headers = self._auth_headers()
         
         params = {
             "page_size": page_size
@@ -145,31 +418,114 @@ class FeishuSheet:
             params["filter"] = filter_expr
             
         data = self._make_request("GET", url, headers, params=params)
-        return data.get("data", {})
+        try:
+            return data["data"]
+        except KeyError:
+            return {}
+
+    def read_bitable_all(self, app_token: str, table_id: str, page_size: int = 500, filter_expr: str = None) -> Dict:
+        """读取多维表格的全部记录，按 page_token 依次翻页
+        
+        飞书的 page_token 是不透明的游标，只能拿到上一页后才知道下一页，因此无法并发请求各页；
+        这里用接口允许的最大页大小减少往返次数
+        
+        Args:
+            app_token: 多维表格的应用 token
+            table_id: 表格 ID
+            page_size: 每页记录数，默认500（接口上限）
+            filter_expr: 筛选表达式，默认None
+            
+        Returns:
+            Dict: {"items": 全部记录, "total": 记录总数}
+        """
+        items = []
+        page_token = None
+        while True:
+            data = self.read_bitable(app_token, table_id, page_size=page_size,
+                                     page_token=page_token, filter_expr=filter_expr)
+            items.extend(data.get("items") or [])
+            page_token = data.get("page_token")
+            if not data.get("has_more") or not page_token:
+                break
+        return {"items": items, "total": len(items)}
+
+    def iter_bitable(self, app_token: str, table_id: str, page_size: int = 500,
+                     filter_expr: str = None) -> Iterator[List[Dict]]:
+        """逐页返回多维表格的记录，调用方处理当前页时后台已在请求下一页
+        
+        拿到当前页的 page_token 后立即在单线程的线程池里提交下一页请求，再把当前页交给调用方，
+        调用方的处理时间与下一页的网络往返重叠；同一时刻最多只有一个预取中的请求
+        
+        Args:
+            app_token: 多维表格的应用 token
+            table_id: 表格 ID
+            page_size: 每页记录数，默认500（接口上限）
+            filter_expr: 筛选表达式，默认None
+            
+        Yields:
+            List[Dict]: 每一页的记录列表
+        """
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bitable-prefetch")
+        try:
+            data = self.read_bitable(app_token, table_id, page_size=page_size, filter_expr=filter_expr)
+            while True:
+                page_token = data.get("page_token")
+                future = None
+                if data.get("has_more") and page_token:
+                    future = executor.submit(self.read_bitable, app_token, table_id, page_size,
+                                             page_token, filter_expr)
+                yield data.get("items") or []
+                if future is None:
+                    break
+                data = future.result()
+        finally:
+            # 调用方提前结束迭代时不再等待预取中的请求
+            executor.shutdown(wait=False, cancel_futures=True)
 
-    def write_bitable(self, app_token: str, table_id: str, records: List[Dict]) -> Dict:
-        """写入多维表格数据
+    def write_bitable(self, app_token: str, table_id: str, records: List[Dict], client_token: str = None) -> Dict:
+        """写入多维表格数据，超过单次上限（500 条）时按顺序分批提交
         
         Args:
             app_token: 多维表格的应用 token
             table_id: 表格 ID
             records: 要写入的记录列表，每条记录为一个字典，格式如：
                     [{"fields": {"字段名1": "值1", "字段名2": "值2"}}]
+            client_token: 幂等键（uuid4），默认每次调用生成一个；重试时沿用同一个，由飞书去重，不会重复写入。
+                          分批写入时每批各自生成，不能指定
             
         Returns:
-            Dict: API 响应结果
+            Dict: API 响应结果，分批时合并各批返回的记录
+
+        Raises:
+            FeishuError: 分批写入在已有批次写入成功后失败，details["created_records"] 为已写入的记录，
+                         后续批次不再提交；第一批就失败时直接抛出原异常
         """
-        url = f"{self.base_url}/bitable/v1/apps/{app_token}/tables/{table_id}/records/batch_create"
-        headers = {
-            "Authorization": f"Bearer {self._get_access_token()}",
-            "Content-Type": "application/json; charset=utf-8"
-        }
+        url = f"{_table_url(self.base_url, app_token, table_id)}/records/batch_create"
+        headers = self._auth_headers()
         
-        payload = {
-            "records": records
-        }
-        
-        return self._make_request("POST", url, headers, payload)
+        if len(records) <= BATCH_LIMIT:
+            payload = {
+                "records": records
+            }
+            params = {"client_token": client_token or str(uuid.uuid4())}
+            return self._make_request("POST", url, headers, payload, params=params, idempotent=False)
+
+        if client_token:
+            raise ValueError(f"写入超过 {BATCH_LIMIT} 条记录时会分批提交，不能指定 client_token")
+
+        # 按顺序逐批提交，某批失败时停止，已写入的记录随异常返回
+        created = []
+        for start in range(0, len(records), BATCH_LIMIT):
+            params = {"client_token": str(uuid.uuid4())}
+            try:
+                data = self._make_request("POST", url, headers, {"records": records[start:start + BATCH_LIMIT]},
+                                          params=params, idempotent=False)
+            except Exception as e:
+                if not created:
+                    raise
+                raise _partial_write_error(created, len(records), e) from e
+            created.extend(data.get("data", {}).get("records", []))
+        return {"code": 0, "data": {"records": created}}
 
     def update_bitable(self, app_token: str, table_id: str, record_id: str, fields: Dict) -> Dict:
         """更新多维表格中的记录
@@ -183,11 +539,8 @@ class FeishuSheet:
         Returns:
             Dict: API 响应结果
         """
-        url = f"{self.base_url}/bitable/v1/apps/{app_token}/tables/{table_id}/records/{record_id}"
-        headers = {
-            "Authorization": f"Bearer {self._get_access_token()}",
-            "Content-Type": "application/json; charset=utf-8"
-        }
+        url = f"{_table_url(self.base_url, app_token, table_id)}/records/{record_id}"
+        headers = self._auth_headers()
         
         payload = {
             "fields": fields
@@ -214,13 +567,13 @@ class FeishuSheet:
         Returns:
             Dict: API 响应结果
         """
-        url = f"{self.base_url}/bitable/v1/apps/{app_token}/tables/{table_id}/fields/{field_id}"
-        headers = {
-            "Authorization": f"Bearer {self._get_access_token()}",
-            "Content-Type": "application/json; charset=utf-8"
-        }
+        url = f"{_table_url(self.base_url, app_token, table_id)}/fields/{field_id}"
+        headers = self._auth_headers()
         
-        return self._make_request("PUT", url, headers, json=field_config)
+        try:
+            return self._make_request("PUT", url, headers, json=field_config)
+        finally:
+            self.invalidate_fields(app_token, table_id)
 
     def get_bitable_fields(self, app_token: str, table_id: str) -> List[Dict]:
         """获取多维表格的字段（表头）配置
@@ -232,14 +585,28 @@ class FeishuSheet:
         Returns:
             List[Dict]: 字段配置列表，每个字段包含 field_name, type 等信息
         """
-        url = f"{self.base_url}/bitable/v1/apps/{app_token}/tables/{table_id}/fields"
-        headers = {
-            "Authorization": f"Bearer {self._get_access_token()}",
-            "Content-Type": "application/json; charset=utf-8"
-        }
+        key = (app_token, table_id)
+        with self._fields_lock:
+            cached = self._fields_cache.get(key)
+        if cached and time.time() - cached[0] < self._fields_ttl:
+            return list(cached[1])
+
+        url = f"{_table_url(self.base_url, app_token, table_id)}/fields"
+        headers = self._auth_headers()
         
         data = self._make_request("GET", url, headers)
-        return data.get("data", {}).get("items", [])
+        try:
+            items = data["data"]["items"]
+        except (KeyError, TypeError):
+            items = []
+        with self._fields_lock:
+            self._fields_cache[key] = (time.time(), items)
+        return list(items)
+
+    def invalidate_fields(self, app_token: str, table_id: str) -> None:
+        """丢弃缓存的字段配置，在飞书后台直接修改了表头时由调用方调用"""
+        with self._fields_lock:
+            self._fields_cache.pop((app_token, table_id), None)
 
     def create_bitable_field(self, app_token: str, table_id: str, field_config: Dict) -> Dict:
         """创建多维表格的新字段
@@ -259,13 +626,13 @@ class FeishuSheet:
         Returns:
             Dict: API 响应结果
         """
-        url = f"{self.base_url}/bitable/v1/apps/{app_token}/tables/{table_id}/fields"
-        headers = {
-            "Authorization": f"Bearer {self._get_access_token()}",
-            "Content-Type": "application/json; charset=utf-8"
-        }
+        url = f"{_table_url(self.base_url, app_token, table_id)}/fields"
+        headers = self._auth_headers()
         
-        return self._make_request("POST", url, headers, json=field_config)
+        try:
+            return self._make_request("POST", url, headers, json=field_config, idempotent=False)
+        finally:
+            self.invalidate_fields(app_token, table_id)
 
     def delete_bitable_field(self, app_token: str, table_id: str, field_id: str) -> Dict:
         """删除多维表格的字段
@@ -278,15 +645,16 @@ class FeishuSheet:
         Returns:
             Dict: API 响应结果
         """
-        url = f"{self.base_url}/bitable/v1/apps/{app_token}/tables/{table_id}/fields/{field_id}"
-        headers = {
-            "Authorization": f"Bearer {self._get_access_token()}"
-        }
+        url = f"{_table_url(self.base_url, app_token, table_id)}/fields/{field_id}"
+        headers = self._auth_headers()
         
-        return self._make_request("DELETE", url, headers)
+        try:
+            return self._make_request("DELETE", url, headers)
+        finally:
+            self.invalidate_fields(app_token, table_id)
 
     def batch_update_bitable(self, app_token: str, table_id: str, records: List[Dict]) -> Dict:
-        """批量更新多维表格记录
+        """批量更新多维表格记录，超过单次上限（500 条）时分批提交
         
         Args:
             app_token: 多维表格的应用 token
@@ -303,13 +671,18 @@ class FeishuSheet:
         Returns:
             Dict: API 响应结果
         """
-        url = f"{self.base_url}/bitable/v1/apps/{app_token}/tables/{table_id}/records/batch_update"
-        headers = {
-            "Authorization": f"Bearer {self._get_access_token()}",
-            "Content-Type": "application/json; charset=utf-8"
-        }
+        url = f"{_table_url(self.base_url, app_token, table_id)}/records/batch_update"
+        headers = self._auth_headers()
         
-        return self._make_request("POST", url, headers, json={"records": records})
+        if len(records) <= BATCH_LIMIT:
+            return self._make_request("POST", url, headers, json={"records": records})
+
+        # 分批提交，合并各批返回的记录
+        updated = []
+        for start in range(0, len(records), BATCH_LIMIT):
+            data = self._make_request("POST", url, headers, json={"records": records[start:start + BATCH_LIMIT]})
+            updated.extend(data.get("data", {}).get("records", []))
+        return {"code": 0, "data": {"records": updated}}
 
     def delete_bitable_records(self, app_token: str, table_id: str, record_ids: List[str]) -> Dict:
         """批量删除多维表格记录
@@ -322,11 +695,8 @@ class FeishuSheet:
         Returns:
             Dict: API 响应结果
         """
-        url = f"{self.base_url}/bitable/v1/apps/{app_token}/tables/{table_id}/records/batch_delete"
-        headers = {
-            "Authorization": f"Bearer {self._get_access_token()}",
-            "Content-Type": "application/json; charset=utf-8"
-        }
+        url = f"{_table_url(self.base_url, app_token, table_id)}/records/batch_delete"
+        headers = self._auth_headers()
         
         return self._make_request("POST", url, headers, json={"records": record_ids})
 
@@ -344,11 +714,8 @@ class FeishuSheet:
         Returns:
             Dict: API 响应结果
         """
-        url = f"{self.base_url}/bitable/v1/apps/{app_token}/tables/{table_id}/records/list"
-        headers = {
-            "Authorization": f"Bearer {self._get_access_token()}",
-            "Content-Type": "application/json; charset=utf-8"
-        }
+        url = f"{_table_url(self.base_url, app_token, table_id)}/records/list"
+        headers = self._auth_headers()
         
         params = {
             "filter": filter_expr,
@@ -359,6 +726,310 @@ class FeishuSheet:
             
         return self._make_request("GET", url, headers, params=params)
 
+class AsyncFeishuSheet:
+    """FeishuSheet 的异步版本，基于 httpx.AsyncClient（可用时启用 HTTP/2），多个表格操作可以用 asyncio.gather 并发执行
+
+    接口与 FeishuSheet 对应，方法均为协程；同步的 FeishuSheet 保持不变，供现有调用方使用
+    """
+
+    TOKEN_TTL = FeishuSheet.TOKEN_TTL
+    TOKEN_REFRESH_AHEAD = FeishuSheet.TOKEN_REFRESH_AHEAD
+
+    def __init__(self, app_id: str, app_secret: str):
+        self.app_id = app_id
+        self.app_secret = app_secret
+        self.base_url = "https://open.feishu.cn/open-apis"
+        self.token = None
+        self.token_expire_time = None
+        self.max_retries = 3
+        self.timeout = 10  # 请求超时时间（秒）
+        self.retry_config = RetryConfig(max_attempts=self.max_retries + 1, base_delay=1.0, max_delay=30.0)
+        self._client = create_http_client(
+            timeout=self.timeout,
+            http2=True,
+            headers={"Content-Type": "application/json; charset=utf-8"}
+        )
+        # 协程之间共用令牌，刷新互斥，避免并发时重复请求
+        self._token_lock = asyncio.Lock()
+        self._fields_cache: Dict[Tuple[str, str], Tuple[float, List[Dict]]] = {}
+        self._fields_ttl = 300
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+        self.logger = logging.getLogger(__name__)
+
+    async def aclose(self) -> None:
+        """关闭底层连接池"""
+        await self._client.aclose()
+
+    def _token_valid(self) -> bool:
+        """缓存的令牌是否仍有效，距过期不足 TOKEN_REFRESH_AHEAD 秒时视为需要刷新"""
+        return bool(
+            self.token and self.token_expire_time
+            and datetime.now() + timedelta(seconds=self.TOKEN_REFRESH_AHEAD) < self.token_expire_time
+        )
+
+    async def _get_access_token(self) -> str:
+        """获取访问令牌"""
+        if self._token_valid():
+            return self.token
+
+        async with self._token_lock:
+            if self._token_valid():
+                return self.token
+
+            url = f"{self.base_url}/auth/v3/tenant_access_token/internal"
+            payload = {"app_id": self.app_id, "app_secret": self.app_secret}
+            data = await self._make_request("POST", url, payload, auth=False)
+            self.token = data.get("tenant_access_token")
+            ttl = timedelta(seconds=data["expire"]) if data.get("expire") else self.TOKEN_TTL
+            self.token_expire_time = datetime.now() + ttl
+            return self.token
+
+    async def _make_request(self, method: str, url: str, json: Dict = None, params: Dict = None,
+                            auth: bool = True, idempotent: bool = True) -> Dict:
+        """统一的请求处理方法，并发的相同 GET 请求合并为一次，规则与 FeishuSheet._make_request 相同"""
+        if method != "GET":
+            try:
+                return await self._request_with_retry(method, url, json, params, auth, idempotent)
+            finally:
+                self._inflight.clear()
+
+        key = (url, tuple(sorted(params.items())) if params else ())
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._request_with_retry(method, url, None, params, auth, idempotent))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._inflight.pop(key) if self._inflight.get(key) is t else None)
+        # 某个调用方被取消时不影响共用同一请求的其他调用方
+        return await asyncio.shield(task)
+
+    async def _request_with_retry(self, method: str, url: str, json: Dict = None, params: Dict = None,
+                                  auth: bool = True, idempotent: bool = True) -> Dict:
+        """发送请求，重试策略与 FeishuSheet._request_with_retry 相同，退避用 asyncio.sleep 不阻塞事件循环"""
+        retry_safe = idempotent or _has_client_token(json, params)
+        body = _encode_body(json)
+        max_attempts = self.retry_config.max_attempts
+        for attempt in range(1, max_attempts + 1):
+            is_last = attempt == max_attempts
+            headers = {"Authorization": f"Bearer {await self._get_access_token()}"} if auth else None
+            try:
+                response = await self._client.request(method, url, headers=headers, content=body, params=params)
+            except httpx.TransportError as e:
+                if not retry_safe and not isinstance(e, _NOT_SENT_ERRORS):
+                    _warn_not_retried(self.logger, method, url, str(e))
+                    raise NetworkError(f"请求超时或连接中断，写入结果未知: {str(e)}", url=url, cause=e)
+                if is_last:
+                    self.logger.error(f"请求异常: {str(e)}")
+                    raise NetworkError(f"请求超时或连接失败，已达到最大重试次数: {str(e)}", url=url, cause=e)
+                await self._sleep_backoff(attempt, f"请求超时或连接失败: {str(e)}")
+                continue
+
+            if response.status_code in _RETRYABLE_STATUS:
+                if not retry_safe and response.status_code != 429:
+                    _warn_not_retried(self.logger, method, url, f"HTTP {response.status_code}")
+                    raise NetworkError(
+                        f"API请求失败: HTTP {response.status_code}，写入结果未知",
+                        url=url, status_code=response.status_code
+                    )
+                if is_last:
+                    self.logger.error(f"请求异常: HTTP {response.status_code}")
+                    raise NetworkError(
+                        f"API请求失败: HTTP {response.status_code}", url=url, status_code=response.status_code
+                    )
+                await self._sleep_backoff(attempt, f"HTTP {response.status_code}")
+                continue
+
+            try:
+                data = orjson.loads(response.content)
+            except ValueError:
+                self.logger.error(f"请求异常: HTTP {response.status_code} 响应不是 JSON")
+                raise Exception(f"API请求失败: HTTP {response.status_code}")
+
+            code = data.get("code")
+            if code == 0:
+                return data
+
+            if not is_last:
+                # 令牌过期时作废当前令牌，下一次循环重新获取并换上新的请求头
+                if code == 99991663 and auth:
+                    self.logger.info("Token expired, refreshing...")
+                    if headers["Authorization"] == f"Bearer {self.token}":
+                        self.token = None
+                    continue
+                if code in _RATE_LIMIT_CODES:
+                    await self._sleep_backoff(attempt, f"触发飞书限流 (code={code})")
+                    continue
+
+            self.logger.error(f"请求异常: API请求失败: {data}")
+            raise Exception(f"API请求失败: {data}")
+
+    async def _sleep_backoff(self, attempt: int, reason: str) -> None:
+        """按第 attempt 次失败计算退避时间并等待"""
+        delay = self.retry_config.calculate_delay(attempt)
+        self.logger.warning(f"{reason}，{delay:.1f} 秒后第{attempt}次重试")
+        await asyncio.sleep(delay)
+
+    async def read_sheet(self, spreadsheet_token: str, sheet_id: str, range: str) -> List[List]:
+        """读取表格数据"""
+        url = f"{self.base_url}/sheets/v2/spreadsheets/{spreadsheet_token}/values/{sheet_id}!{range}"
+        data = await self._make_request("GET", url)
+        try:
+            return data["data"]["valueRange"]["values"]
+        except (KeyError, TypeError):
+            return []
+
+    async def write_sheet(self, spreadsheet_token: str, sheet_id: str, range: str, values: List[List]) -> None:
+        """写入表格数据"""
+        url = f"{self.base_url}/sheets/v2/spreadsheets/{spreadsheet_token}/values_append"
+        payload = {"valueRange": {"range": f"{sheet_id}!{range}", "values": values}}
+        await self._make_request("POST", url, payload, idempotent=False)
+
+    async def read_bitable(self, app_token: str, table_id: str, page_size: int = 200, page_token: str = None,
+                           filter_expr: str = None) -> Dict:
+        """读取多维表格数据"""
+        url = f"{_table_url(self.base_url, app_token, table_id)}/records"
+        params = {"page_size": page_size}
+        if page_token:
+            params["page_token"] = page_token
+        if filter_expr:
+            params["filter"] = filter_expr
+        data = await self._make_request("GET", url, params=params)
+        try:
+            return data["data"]
+        except KeyError:
+            return {}
+
+    async def read_bitable_all(self, app_token: str, table_id: str, page_size: int = 500,
+                               filter_expr: str = None) -> Dict:
+        """读取多维表格的全部记录，按 page_token 依次翻页"""
+        items = []
+        page_token = None
+        while True:
+            data = await self.read_bitable(app_token, table_id, page_size=page_size,
+                                           page_token=page_token, filter_expr=filter_expr)
+            items.extend(data.get("items") or [])
+            page_token = data.get("page_token")
+            if not data.get("has_more") or not page_token:
+                break
+        return {"items": items, "total": len(items)}
+
+    async def iter_bitable(self, app_token: str, table_id: str, page_size: int = 500,
+                           filter_expr: str = None) -> AsyncIterator[List[Dict]]:
+        """逐页返回多维表格的记录，调用方处理当前页时下一页已在请求中，与 FeishuSheet.iter_bitable 相同"""
+        data = await self.read_bitable(app_token, table_id, page_size=page_size, filter_expr=filter_expr)
+        while True:
+            page_token = data.get("page_token")
+            task = None
+            if data.get("has_more") and page_token:
+                task = asyncio.ensure_future(self.read_bitable(app_token, table_id, page_size=page_size,
+                                                               page_token=page_token, filter_expr=filter_expr))
+            try:
+                yield data.get("items") or []
+            except BaseException:
+                if task:
+                    task.cancel()
+                raise
+            if task is None:
+                break
+            data = await task
+
+    async def write_bitable(self, app_token: str, table_id: str, records: List[Dict], client_token: str = None) -> Dict:
+        """写入多维表格数据，超过单次上限时按顺序分批提交；client_token 和分批失败的处理与 FeishuSheet.write_bitable 相同"""
+        url = f"{_table_url(self.base_url, app_token, table_id)}/records/batch_create"
+        if len(records) <= BATCH_LIMIT:
+            params = {"client_token": client_token or str(uuid.uuid4())}
+            return await self._make_request("POST", url, {"records": records}, params=params, idempotent=False)
+
+        if client_token:
+            raise ValueError(f"写入超过 {BATCH_LIMIT} 条记录时会分批提交，不能指定 client_token")
+
+        created = []
+        for start in range(0, len(records), BATCH_LIMIT):
+            try:
+                data = await self._make_request("POST", url, {"records": records[start:start + BATCH_LIMIT]},
+                                                params={"client_token": str(uuid.uuid4())}, idempotent=False)
+            except Exception as e:
+                if not created:
+                    raise
+                raise _partial_write_error(created, len(records), e) from e
+            created.extend(data.get("data", {}).get("records", []))
+        return {"code": 0, "data": {"records": created}}
+
+    async def update_bitable(self, app_token: str, table_id: str, record_id: str, fields: Dict) -> Dict:
+        """更新多维表格中的记录"""
+        url = f"{_table_url(self.base_url, app_token, table_id)}/records/{record_id}"
+        return await self._make_request("PUT", url, {"fields": fields})
+
+    async def batch_update_bitable(self, app_token: str, table_id: str, records: List[Dict]) -> Dict:
+        """批量更新多维表格记录，超过单次上限时分批并发提交"""
+        url = f"{_table_url(self.base_url, app_token, table_id)}/records/batch_update"
+        if len(records) <= BATCH_LIMIT:
+            return await self._make_request("POST", url, {"records": records})
+
+        results = await asyncio.gather(*(
+            self._make_request("POST", url, {"records": records[start:start + BATCH_LIMIT]})
+            for start in range(0, len(records), BATCH_LIMIT)
+        ))
+        updated = [record for data in results for record in data.get("data", {}).get("records", [])]
+        return {"code": 0, "data": {"records": updated}}
+
+    async def delete_bitable_records(self, app_token: str, table_id: str, record_ids: List[str]) -> Dict:
+        """批量删除多维表格记录"""
+        url = f"{_table_url(self.base_url, app_token, table_id)}/records/batch_delete"
+        return await self._make_request("POST", url, {"records": record_ids})
+
+    async def filter_bitable_records(self, app_token: str, table_id: str, filter_expr: str,
+                                     sort: List[Dict] = None, page_size: int = 100) -> Dict:
+        """按条件筛选多维表格记录"""
+        url = f"{_table_url(self.base_url, app_token, table_id)}/records/list"
+        params = {"filter": filter_expr, "page_size": page_size}
+        if sort:
+            params["sort"] = sort
+        return await self._make_request("GET", url, params=params)
+
+    async def get_bitable_fields(self, app_token: str, table_id: str) -> List[Dict]:
+        """获取多维表格的字段（表头）配置，缓存规则与 FeishuSheet.get_bitable_fields 相同"""
+        key = (app_token, table_id)
+        cached = self._fields_cache.get(key)
+        if cached and time.time() - cached[0] < self._fields_ttl:
+            return list(cached[1])
+
+        url = f"{_table_url(self.base_url, app_token, table_id)}/fields"
+        data = await self._make_request("GET", url)
+        try:
+            items = data["data"]["items"]
+        except (KeyError, TypeError):
+            items = []
+        self._fields_cache[key] = (time.time(), items)
+        return list(items)
+
+    def invalidate_fields(self, app_token: str, table_id: str) -> None:
+        """丢弃缓存的字段配置"""
+        self._fields_cache.pop((app_token, table_id), None)
+
+    async def create_bitable_field(self, app_token: str, table_id: str, field_config: Dict) -> Dict:
+        """创建多维表格的新字段"""
+        url = f"{_table_url(self.base_url, app_token, table_id)}/fields"
+        try:
+            return await self._make_request("POST", url, field_config, idempotent=False)
+        finally:
+            self.invalidate_fields(app_token, table_id)
+
+    async def update_bitable_fields(self, app_token: str, table_id: str, field_id: str, field_config: Dict) -> Dict:
+        """更新多维表格的字段（表头）配置"""
+        url = f"{_table_url(self.base_url, app_token, table_id)}/fields/{field_id}"
+        try:
+            return await self._make_request("PUT", url, field_config)
+        finally:
+            self.invalidate_fields(app_token, table_id)
+
+    async def delete_bitable_field(self, app_token: str, table_id: str, field_id: str) -> Dict:
+        """删除多维表格的字段"""
+        url = f"{_table_url(self.base_url, app_token, table_id)}/fields/{field_id}"
+        try:
+            return await self._make_request("DELETE", url)
+        finally:
+            self.invalidate_fields(app_token, table_id)
+
 def test_bitable():
     """测试多维表格的读写功能"""
     # 测试配置
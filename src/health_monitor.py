@@ -2,19 +2,14 @@
 健康检查和监控模块
 """
 import asyncio
+import os
 import time
 import json
-from typing import Dict, Any, List, Optional, Callable
-
-# 尝试导入psutil，如果失败则使用替代方案
-try:
-    import psutil
-    PSUTIL_AVAILABLE = True
-except ImportError:
-    PSUTIL_AVAILABLE = False
-    import os
+from collections import deque
+from itertools import islice
+from typing import Dict, Any, List, Optional, Callable, Tuple
 from datetime import datetime, timedelta
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass
 from pathlib import Path
 import logging
 from aiohttp import web, ClientSession
@@ -23,6 +18,31 @@ from message_queue import MessageQueue
 
 logger = logging.getLogger(__name__)
 
+# psutil 是可选依赖，第一次采集系统指标时才导入（加载 C 扩展并探测 /proc），不做健康监控的路径不付这个代价；
+# 导入失败时使用替代数据。PSUTIL_AVAILABLE 在尝试导入之前为 None
+psutil = None
+PSUTIL_AVAILABLE: Optional[bool] = None
+
+
+def _load_psutil() -> bool:
+    """按需导入 psutil，返回是否可用"""
+    global psutil, PSUTIL_AVAILABLE
+    if PSUTIL_AVAILABLE is None:
+        try:
+            import psutil as _psutil
+            psutil = _psutil
+            PSUTIL_AVAILABLE = True
+        except ImportError:
+            PSUTIL_AVAILABLE = False
+    return PSUTIL_AVAILABLE
+
+
+# 容器的内存上限和当前用量：cgroup v2 与 v1 的文件位置
+_CGROUP_V2_LIMIT = Path("/sys/fs/cgroup/memory.max")
+_CGROUP_V2_USAGE = Path("/sys/fs/cgroup/memory.current")
+_CGROUP_V1_LIMIT = Path("/sys/fs/cgroup/memory/memory.limit_in_bytes")
+_CGROUP_V1_USAGE = Path("/sys/fs/cgroup/memory/memory.usage_in_bytes")
+
 
 @dataclass
 class HealthStatus:
@@ -40,20 +60,33 @@ class HealthStatus:
             self.details = {}
 
     def to_dict(self) -> Dict[str, Any]:
-        return asdict(self)
+        # 字段固定且很少，直接构造字典，避免 asdict 对每个值做 deepcopy；details 浅拷贝即可
+        return {
+            "component": self.component,
+            "status": self.status,
+            "message": self.message,
+            "details": dict(self.details),
+            "timestamp": self.timestamp,
+        }
 
 
 class HealthChecker:
     """健康检查器"""
 
-    def __init__(self):
+    def __init__(self, overall_ttl: float = 5.0):
         self.checks: Dict[str, Callable] = {}
+        # 检查名称的快照，注册时更新；run_all_checks 遍历它，不受并发注册影响
+        self._check_names: Tuple[str, ...] = ()
         self.check_results: Dict[str, HealthStatus] = {}
         self.check_interval = 30  # 30秒检查一次
+        # 负载均衡的存活探测可能每秒一次，overall_ttl 秒内复用上一次的整体状态，不重复运行全部检查
+        self._overall_ttl = overall_ttl
+        self._overall_cache: Optional[Tuple[float, Dict[str, Any]]] = None
 
     def register_check(self, name: str, check_func: Callable):
         """注册健康检查函数"""
         self.checks[name] = check_func
+        self._check_names = tuple(self.checks)
         logger.info(f"Registered health check: {name}")
 
     async def run_check(self, name: str) -> HealthStatus:
@@ -70,7 +103,8 @@ class HealthChecker:
             if asyncio.iscoroutinefunction(check_func):
                 result = await check_func()
             else:
-                result = check_func()
+                # 同步检查（如 psutil 系统调用）放到线程中执行，不阻塞事件循环
+                result = await asyncio.to_thread(check_func)
 
             if isinstance(result, HealthStatus):
                 return result
@@ -92,52 +126,122 @@ class HealthChecker:
             )
 
     async def run_all_checks(self) -> Dict[str, HealthStatus]:
-        """运行所有健康检查"""
-        results = {}
-
-        for name in self.checks:
-            result = await self.run_check(name)
-            results[name] = result
-            self.check_results[name] = result
+        """并发运行所有健康检查，耗时取决于最慢的一项；run_check 自行处理异常，不会中断其他检查"""
+        names = self._check_names
+        statuses = await asyncio.gather(*(self.run_check(name) for name in names))
+        results = dict(zip(names, statuses))
+        self.check_results.update(results)
 
         return results
 
-    async def get_overall_status(self) -> Dict[str, Any]:
-        """获取整体健康状态"""
-        results = await self.run_all_checks()
-
-        # 计算整体状态
-        has_error = any(r.status == "error" for r in results.values())
-        has_warning = any(r.status == "warning" for r in results.values())
+    async def get_overall_status(self, force: bool = False) -> Dict[str, Any]:
+        """获取整体健康状态，force=True 时忽略缓存重新运行全部检查"""
+        if not force and self._overall_cache is not None:
+            cached_at, cached_status = self._overall_cache
+            if time.time() - cached_at < self._overall_ttl:
+                return cached_status
 
-        if has_error:
-            overall_status = "error"
-        elif has_warning:
-            overall_status = "warning"
-        else:
-            overall_status = "healthy"
+        results = await self.run_all_checks()
 
-        return {
+        # 计算整体状态，同一次遍历中生成各项检查的结果
+        overall_status = "healthy"
+        checks = {}
+        for name, result in results.items():
+            checks[name] = result.to_dict()
+            if result.status == "error":
+                overall_status = "error"
+            elif result.status == "warning" and overall_status == "healthy":
+                overall_status = "warning"
+
+        now = time.time()
+        status = {
             "overall_status": overall_status,
-            "timestamp": datetime.now().isoformat(),
-            "checks": {name: result.to_dict() for name, result in results.items()}
+            "timestamp": datetime.fromtimestamp(now).isoformat(),
+            # 与 timestamp 同一时刻，供清理历史记录时直接比较，不必解析字符串
+            "timestamp_epoch": now,
+            "checks": checks
         }
+        self._overall_cache = (now, status)
+        return status
 
 
 class SystemMonitor:
     """系统资源监控"""
 
-    def __init__(self):
-        if PSUTIL_AVAILABLE:
-            self.process = psutil.Process()
-        else:
-            self.process = None
+    def __init__(self, stats_ttl: float = 5.0):
+        # 第一次采集时由 _ensure_psutil 创建
+        self.process = None
         self.start_time = time.time()
+        # 监控循环和 /metrics 等多处都会读取系统指标，stats_ttl 秒内的重复读取直接返回上一次的结果
+        self._stats_ttl = stats_ttl
+        self._stats_cache: Optional[Dict[str, Any]] = None
+        self._stats_cache_ts = 0.0
+        # 容器内 virtual_memory() 返回的是宿主机内存；上限在进程生命周期内不变，只读一次
+        self._cgroup_limit, self._cgroup_usage_file = self._cgroup_memory_limit()
+
+    def _ensure_psutil(self) -> bool:
+        """导入 psutil 并创建 Process 对象，返回 psutil 是否可用"""
+        if self.process is None and _load_psutil():
+            # Process 对象在多次采样间复用；cpu_percent 以上一次调用为基准计算，先调用一次作为起点
+            self.process = psutil.Process()
+            psutil.cpu_percent(interval=None)
+            self.process.cpu_percent()
+        return bool(PSUTIL_AVAILABLE)
+
+    @staticmethod
+    def _cgroup_memory_limit():
+        """返回 (cgroup 内存上限字节数, 用量文件)，未在受限的 cgroup 中运行时返回 (None, None)"""
+        for limit_file, usage_file in ((_CGROUP_V2_LIMIT, _CGROUP_V2_USAGE), (_CGROUP_V1_LIMIT, _CGROUP_V1_USAGE)):
+            try:
+                raw = limit_file.read_text().strip()
+            except OSError:
+                continue
+            if raw == "max":
+                return None, None
+            try:
+                limit = int(raw)
+            except ValueError:
+                return None, None
+            # cgroup v1 未设上限时是一个接近 2^63 的值，不小于物理内存就视为不受限
+            try:
+                physical = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+            except (ValueError, OSError, AttributeError):
+                physical = None
+            if physical and limit >= physical:
+                return None, None
+            return limit, usage_file
+        return None, None
+
+    def _cgroup_memory_stats(self) -> Dict[str, Any]:
+        """容器内存上限、当前用量和使用率"""
+        used = int(self._cgroup_usage_file.read_text().strip())
+        return {
+            "cgroup_limit": self._cgroup_limit,
+            "cgroup_used": used,
+            "cgroup_percent": used / self._cgroup_limit * 100
+        }
 
     def get_system_stats(self) -> Dict[str, Any]:
-        """获取系统统计信息"""
+        """获取系统统计信息，距上次采集不足 stats_ttl 秒时返回缓存的结果（运行时长按当前时间更新）"""
+        now = time.time()
+        if self._stats_cache is not None and now - self._stats_cache_ts < self._stats_ttl:
+            return {**self._stats_cache, "uptime": now - self.start_time}
+
+        stats = self._collect_system_stats()
+        if "error" not in stats and self._cgroup_limit:
+            try:
+                stats["memory"].update(self._cgroup_memory_stats())
+            except (OSError, ValueError) as e:
+                logger.warning(f"Failed to read cgroup memory usage: {e}")
+        if "error" not in stats:
+            self._stats_cache = stats
+            self._stats_cache_ts = now
+        return stats
+
+    def _collect_system_stats(self) -> Dict[str, Any]:
+        """采集系统统计信息"""
         try:
-            if not PSUTIL_AVAILABLE:
+            if not self._ensure_psutil():
                 return {
                     "cpu": {"system_percent": 0, "process_percent": 0},
                     "memory": {
@@ -159,12 +263,17 @@ class SystemMonitor:
                     "note": "psutil not available - using mock data"
                 }
 
-            # CPU使用率
-            cpu_percent = psutil.cpu_percent(interval=1)
+            # CPU使用率：取距上次采样以来的平均值，不阻塞等待采样间隔
+            cpu_percent = psutil.cpu_percent(interval=None)
 
             # 内存使用情况
             memory = psutil.virtual_memory()
-            process_memory = self.process.memory_info()
+
+            # 本进程的指标在 oneshot 中一次读取 /proc
+            with self.process.oneshot():
+                process_cpu_percent = self.process.cpu_percent()
+                process_memory = self.process.memory_info()
+                num_threads = self.process.num_threads()
 
             # 磁盘使用情况
             disk = psutil.disk_usage('/')
@@ -175,7 +284,7 @@ class SystemMonitor:
             return {
                 "cpu": {
                     "system_percent": cpu_percent,
-                    "process_percent": self.process.cpu_percent()
+                    "process_percent": process_cpu_percent
                 },
                 "memory": {
                     "system_total": memory.total,
@@ -197,7 +306,7 @@ class SystemMonitor:
                     "packets_recv": network.packets_recv
                 },
                 "uptime": time.time() - self.start_time,
-                "threads": self.process.num_threads()
+                "threads": num_threads
             }
 
         except Exception as e:
@@ -224,9 +333,10 @@ class SystemMonitor:
                 issues.append(f"High CPU usage: {stats['cpu']['system_percent']:.1f}%")
                 status = "warning"
 
-            # 检查内存使用率
-            if stats["memory"]["system_percent"] > 90:
-                issues.append(f"High memory usage: {stats['memory']['system_percent']:.1f}%")
+            # 检查内存使用率，在受限的容器中按容器上限计算
+            memory_percent = stats["memory"].get("cgroup_percent", stats["memory"]["system_percent"])
+            if memory_percent > 90:
+                issues.append(f"High memory usage: {memory_percent:.1f}%")
                 status = "warning"
 
             # 检查磁盘使用率
@@ -258,21 +368,24 @@ class HealthMonitor:
         self,
         message_queue: Optional[MessageQueue] = None,
         check_interval: int = 30,
-        port: int = 8080
+        port: int = 8080,
+        status_ttl: float = 5.0
     ):
         self.message_queue = message_queue
         self.check_interval = check_interval
         self.port = port
 
-        self.health_checker = HealthChecker()
+        # status_ttl 应小于探测间隔，否则探测看到的可能是上一轮的状态
+        self.health_checker = HealthChecker(overall_ttl=status_ttl)
         self.system_monitor = SystemMonitor()
 
         # 注册默认健康检查
         self._register_default_checks()
 
         # 监控历史记录
-        self.history: List[Dict[str, Any]] = []
         self.max_history = 100
+        # 环形缓冲，超过 max_history 时自动丢弃最旧的记录
+        self.history: deque = deque(maxlen=self.max_history)
 
     def _register_default_checks(self):
         """注册默认的健康检查"""
@@ -305,13 +418,11 @@ class HealthMonitor:
 
         while True:
             try:
-                # 运行健康检查
-                overall_status = await self.health_checker.get_overall_status()
+                # 运行健康检查，监控循环总是重新检查
+                overall_status = await self.health_checker.get_overall_status(force=True)
 
                 # 记录历史
                 self.history.append(overall_status)
-                if len(self.history) > self.max_history:
-                    self.history.pop(0)
 
                 # 记录严重问题
                 if overall_status["overall_status"] == "error":
@@ -331,7 +442,7 @@ class HealthMonitor:
     async def get_health_report(self) -> Dict[str, Any]:
         """获取健康报告"""
         current_status = await self.health_checker.get_overall_status()
-        system_stats = self.system_monitor.get_system_stats()
+        system_stats = await asyncio.to_thread(self.system_monitor.get_system_stats)
 
         report = {
             "current_status": current_status,
@@ -381,7 +492,10 @@ class HealthMonitor:
         """健康检查历史HTTP端点"""
         try:
             limit = int(request.query.get('limit', 20))
-            history = self.history[-limit:] if limit > 0 else self.history
+            if 0 < limit < len(self.history):
+                history = list(islice(self.history, len(self.history) - limit, None))
+            else:
+                history = list(self.history)
 
             return web.json_response({
                 "history": history,
@@ -411,10 +525,11 @@ class HealthMonitor:
 
         app.router.add_get('/', root_handler)
 
-        runner = web.AppRunner(app)
+        # 探测和指标抓取频繁，关闭逐请求的访问日志；保持连接 75 秒，长于常见负载均衡的空闲超时（60 秒），避免连接被提前关闭
+        runner = web.AppRunner(app, access_log=None, keepalive_timeout=75)
         await runner.setup()
 
-        site = web.TCPSite(runner, '0.0.0.0', self.port)
+        site = web.TCPSite(runner, '0.0.0.0', self.port, backlog=512)
         await site.start()
 
         logger.info(f"Health monitor web server started on port {self.port}")
@@ -426,10 +541,10 @@ class HealthMonitor:
             cutoff_time = time.time() - (max_age_hours * 3600)
 
             # 过滤掉过旧的记录
-            self.history = [
-                record for record in self.history
-                if datetime.fromisoformat(record["timestamp"]).timestamp() > cutoff_time
-            ]
+            self.history = deque(
+                (record for record in self.history if record["timestamp_epoch"] > cutoff_time),
+                maxlen=self.max_history
+            )
 
             logger.debug(f"Cleaned up old health history, {len(self.history)} records remaining")
 
@@ -444,10 +559,11 @@ _health_monitor: Optional[HealthMonitor] = None
 def get_health_monitor(
     message_queue: Optional[MessageQueue] = None,
     check_interval: int = 30,
-    port: int = 8080
+    port: int = 8080,
+    status_ttl: float = 5.0
 ) -> HealthMonitor:
     """获取全局健康监控实例"""
     global _health_monitor
     if _health_monitor is None:
-        _health_monitor = HealthMonitor(message_queue, check_interval, port)
+        _health_monitor = HealthMonitor(message_queue, check_interval, port, status_ttl)
     return _health_monitor
\ No newline at end of file
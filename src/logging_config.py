@@ -5,23 +5,49 @@ import logging
 import logging.handlers
 import sys
 import json
+import copy
+import queue
+import atexit
 from pathlib import Path
 from typing import Dict, Any, Optional
 from datetime import datetime
 import traceback
 
 
+# LogRecord 自带的属性，不作为额外字段输出
+_RESERVED_LOG_ATTRS = frozenset({
+    'name', 'msg', 'args', 'levelname', 'levelno', 'pathname',
+    'filename', 'module', 'lineno', 'funcName', 'created',
+    'msecs', 'relativeCreated', 'thread', 'threadName',
+    'processName', 'process', 'exc_info', 'exc_text', 'stack_info',
+    'message', 'asctime',
+})
+
+# 可以直接 JSON 序列化的标量类型
+_JSON_SCALARS = (str, int, float, bool, type(None))
+
+
 class JSONFormatter(logging.Formatter):
     """JSON格式的日志formatter"""
 
     def __init__(self, include_extra: bool = True):
         super().__init__()
         self.include_extra = include_extra
+        # (整数秒, 该秒的 ISO 时间前缀)，同一秒内的日志复用，只拼接秒以下的部分
+        self._second_cache = (-1, "")
+
+    def _format_timestamp(self, created: float) -> str:
+        sec = int(created)
+        cached_sec, prefix = self._second_cache
+        if cached_sec != sec:
+            prefix = datetime.fromtimestamp(sec).isoformat()
+            self._second_cache = (sec, prefix)
+        return f"{prefix}.{int((created - sec) * 1_000_000):06d}"
 
     def format(self, record: logging.LogRecord) -> str:
         """格式化日志记录为JSON"""
         log_entry = {
-            "timestamp": datetime.fromtimestamp(record.created).isoformat(),
+            "timestamp": self._format_timestamp(record.created),
             "level": record.levelname,
             "logger": record.name,
             "message": record.getMessage(),
@@ -43,22 +69,22 @@ class JSONFormatter(logging.Formatter):
                 "traceback": traceback.format_exception(*record.exc_info)
             }
 
-        # 添加额外字段
+        # 添加额外字段，无法序列化的值由 default=str 转为字符串，只做一次序列化
+        extra_keys = []
         if self.include_extra:
             for key, value in record.__dict__.items():
-                if key not in ('name', 'msg', 'args', 'levelname', 'levelno', 'pathname',
-                             'filename', 'module', 'lineno', 'funcName', 'created',
-                             'msecs', 'relativeCreated', 'thread', 'threadName',
-                             'processName', 'process', 'exc_info', 'exc_text', 'stack_info'):
-                    try:
-                        # 尝试JSON序列化值
-                        json.dumps(value)
-                        log_entry[key] = value
-                    except (TypeError, ValueError):
-                        # 如果无法序列化，转为字符串
-                        log_entry[key] = str(value)
+                if key not in _RESERVED_LOG_ATTRS:
+                    log_entry[key] = value
+                    extra_keys.append(key)
 
-        return json.dumps(log_entry, ensure_ascii=False, default=str)
+        try:
+            return json.dumps(log_entry, ensure_ascii=False, default=str)
+        except (TypeError, ValueError):
+            # default 处理不了的情况（非字符串的字典键、循环引用），把非标量的额外字段整体转为字符串
+            for key in extra_keys:
+                if not isinstance(log_entry[key], _JSON_SCALARS):
+                    log_entry[key] = str(log_entry[key])
+            return json.dumps(log_entry, ensure_ascii=False, default=str)
 
 
 class ColoredConsoleFormatter(logging.Formatter):
@@ -74,6 +100,11 @@ class ColoredConsoleFormatter(logging.Formatter):
         'RESET': '\033[0m'        # 重置
     }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (整数秒, 格式化后的时间)，同一秒内的日志复用
+        self._second_cache = (-1, "")
+
     def format(self, record: logging.LogRecord) -> str:
         """格式化日志记录，添加颜色"""
         # 获取颜色
@@ -81,7 +112,11 @@ class ColoredConsoleFormatter(logging.Formatter):
         reset = self.COLORS['RESET']
 
         # 格式化时间
-        timestamp = datetime.fromtimestamp(record.created).strftime('%Y-%m-%d %H:%M:%S')
+        sec = int(record.created)
+        cached_sec, timestamp = self._second_cache
+        if cached_sec != sec:
+            timestamp = datetime.fromtimestamp(sec).strftime('%Y-%m-%d %H:%M:%S')
+            self._second_cache = (sec, timestamp)
 
         # 构建日志消息
         log_parts = [
@@ -99,6 +134,25 @@ class ColoredConsoleFormatter(logging.Formatter):
         return " ".join(log_parts)
 
 
+# 格式化器没有按 handler 区分的状态，所有 handler 共用同一个实例
+_JSON_FORMATTER = JSONFormatter()
+_FILE_FORMATTER = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+
+class _RecordQueueHandler(logging.handlers.QueueHandler):
+    """只把日志记录放入队列，格式化留给监听线程中的各个 handler
+
+    默认的 QueueHandler.prepare 会先格式化并清掉 exc_info，JSON 日志就拿不到结构化的异常信息；
+    这里只在调用线程里合并消息参数，其余字段原样保留
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
 class LoggingConfig:
     """日志配置管理器"""
 
@@ -126,11 +180,15 @@ class LoggingConfig:
         # 存储已配置的logger
         self._configured_loggers = set()
 
+        # 后台写日志的监听线程
+        self._listener: Optional[logging.handlers.QueueListener] = None
+
     def setup_root_logger(self) -> logging.Logger:
         """配置根logger"""
         root_logger = logging.getLogger()
 
         # 清除现有的handlers
+        self.stop_listener()
         root_logger.handlers.clear()
 
         # 设置日志级别
@@ -142,7 +200,7 @@ class LoggingConfig:
             console_handler.setLevel(self.log_level)
 
             if self.json_format:
-                console_formatter = JSONFormatter()
+                console_formatter = _JSON_FORMATTER
             else:
                 console_formatter = ColoredConsoleFormatter()
 
@@ -152,8 +210,35 @@ class LoggingConfig:
         # 添加文件handler
         self._add_file_handlers(root_logger)
 
+        # 控制台输出和文件写入（含轮转）交给后台线程，记录日志的线程（包括事件循环）只做一次入队
+        self._start_queue_listener(root_logger)
+
         return root_logger
 
+    def _start_queue_listener(self, root_logger: logging.Logger):
+        """把根logger上的handlers移到 QueueListener，根logger只保留入队的 QueueHandler"""
+        handlers = list(root_logger.handlers)
+        log_queue = queue.Queue(-1)
+
+        root_logger.handlers.clear()
+        root_logger.addHandler(_RecordQueueHandler(log_queue))
+
+        self._listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        self._listener.start()
+        # 退出时先写完队列中剩余的日志，再由 logging.shutdown 关闭各个 handler
+        atexit.register(self.stop_listener)
+
+    def stop_listener(self):
+        """停止后台写日志的线程，队列中剩余的日志会先写完"""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+            atexit.unregister(self.stop_listener)
+
+    def _file_formatter(self) -> logging.Formatter:
+        """文件日志使用的格式化器（共享实例）"""
+        return _JSON_FORMATTER if self.json_format else _FILE_FORMATTER
+
     def _add_file_handlers(self, logger: logging.Logger):
         """添加文件handlers"""
         # 主日志文件 - 包含所有级别
@@ -166,12 +251,7 @@ class LoggingConfig:
         )
         main_handler.setLevel(logging.DEBUG)
 
-        if self.json_format:
-            main_formatter = JSONFormatter()
-        else:
-            main_formatter = logging.Formatter(
-                '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-            )
+        main_formatter = self._file_formatter()
 
         main_handler.setFormatter(main_formatter)
         logger.addHandler(main_handler)
@@ -223,14 +303,7 @@ class LoggingConfig:
                 encoding='utf-8'
             )
 
-            if self.json_format:
-                formatter = JSONFormatter()
-            else:
-                formatter = logging.Formatter(
-                    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-                )
-
-            file_handler.setFormatter(formatter)
+            file_handler.setFormatter(self._file_formatter())
             logger.addHandler(file_handler)
 
         self._configured_loggers.add(module_name)
@@ -13,6 +13,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 停止信号，通知工作线程不再重试
+_shutdown = threading.Event()
+
 class AsyncThread(threading.Thread):
     """用于在线程中运行异步函数的特殊线程类"""
     def __init__(self, func, name):
@@ -25,28 +28,30 @@ class AsyncThread(threading.Thread):
         asyncio.run(self.func())
 
 def run_message_store():
-    """在独立线程中运行消息存储机器人"""
-    try:
-        bot = FeishuBot(config=FEISHU_CONFIG)
-        logger.info("Message store bot started")
-        bot.start()
-    except Exception as e:
-        logger.error(f"Message store bot error: {str(e)}", exc_info=True)
-        # 添加重试逻辑
-        time.sleep(5)  # 等待5秒后重试
-        run_message_store()  # 递归重试
+    """在独立线程中运行消息存储机器人，出错后等待5秒重试，直到收到停止信号"""
+    while not _shutdown.is_set():
+        try:
+            bot = FeishuBot(config=FEISHU_CONFIG)
+            logger.info("Message store bot started")
+            bot.start()
+            return
+        except Exception as e:
+            logger.error(f"Message store bot error: {str(e)}", exc_info=True)
+            # 等待5秒后重试，收到停止信号时立即退出
+            _shutdown.wait(5)
 
 def run_message_processor():
-    """在独立线程中运行消息处理器"""
-    try:
-        processor = MessageProcessor()
-        logger.info("Message processor started")
-        asyncio.run(processor.run())
-    except Exception as e:
-        logger.error(f"Message processor error: {str(e)}", exc_info=True)
-        # 添加重试逻辑
-        time.sleep(5)  # 等待5秒后重试
-        run_message_processor()  # 递归重试
+    """在独立线程中运行消息处理器，出错后等待5秒重试，直到收到停止信号"""
+    while not _shutdown.is_set():
+        try:
+            processor = MessageProcessor()
+            logger.info("Message processor started")
+            asyncio.run(processor.run())
+            return
+        except Exception as e:
+            logger.error(f"Message processor error: {str(e)}", exc_info=True)
+            # 等待5秒后重试，收到停止信号时立即退出
+            _shutdown.wait(5)
 
 def main():
     """主函数：使用线程并发运行两个服务"""
@@ -71,6 +76,7 @@ def main():
             
     except KeyboardInterrupt:
         logger.info("Shutting down gracefully...")
+        _shutdown.set()
         # 等待线程完成
         for thread in threads:
             thread.join(timeout=5)
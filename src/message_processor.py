@@ -1,6 +1,6 @@
 import os
-import time
 import json
+import orjson
 from pathlib import Path
 import logging
 from lark_oapi import Client
@@ -19,11 +19,17 @@ from table_manage import (
 from asyncio import Lock
 from collections import defaultdict
 from lark_oapi.api.im.v1 import *
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Set
 import traceback
-import aiohttp
 import pandas as pd
 
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import PatternMatchingEventHandler
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    WATCHDOG_AVAILABLE = False
+
 # 设置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -31,11 +37,56 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 用于从 AI 回复中移除 JSON 数据块
+_JSON_BLOCK_RE = re.compile(r'<JSON>.*?</JSON>', re.DOTALL)
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _dumps(obj) -> str:
+    """序列化为 JSON 字符串，中文不转义，与 json.dumps(obj, ensure_ascii=False) 相同"""
+    return orjson.dumps(obj, option=_ORJSON_OPTIONS).decode()
+
+
+# 正在处理的消息文件后缀
+CLAIMED_SUFFIX = ".json.processing"
+# 同时进行的飞书消息发送/更新请求上限
+MAX_CONCURRENT_SENDS = 32
+
+if WATCHDOG_AVAILABLE:
+    class _MessageFileHandler(PatternMatchingEventHandler):
+        """监听消息目录，把新写入的消息文件投递到事件循环"""
+
+        def __init__(self, loop: asyncio.AbstractEventLoop, callback):
+            super().__init__(patterns=["*.json"], ignore_directories=True)
+            self._loop = loop
+            self._callback = callback
+
+        def _dispatch(self, path: str) -> None:
+            # watchdog 在自己的线程中回调，需要切回事件循环线程
+            try:
+                self._loop.call_soon_threadsafe(self._callback, Path(path))
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+        def on_created(self, event):
+            self._dispatch(event.src_path)
+
+        def on_modified(self, event):
+            # 文件创建时可能尚未写完，写入完成后会再次触发
+            self._dispatch(event.src_path)
+
+        def on_moved(self, event):
+            if event.dest_path.endswith(".json"):
+                self._dispatch(event.dest_path)
+
 class MessageProcessor:
     def __init__(self, message_dir="messages", app_id=None, app_secret=None):
         self.message_dir = Path(message_dir)
         self.message_dir.mkdir(exist_ok=True)
-        self.processed_files = set()
+        # 上次进程退出时未处理完的文件只在启动时恢复一次
+        self._recover_claimed_files()
         self.app_id = app_id or FEISHU_CONFIG["APP_ID"]
         self.app_secret = app_secret or FEISHU_CONFIG["APP_SECRET"]
         
@@ -48,868 +99,1000 @@ class MessageProcessor:
         
         # 添加停止标志
         self._should_stop = False
-        self.deepseek = DeepSeekChat()
+        # DeepSeekChat 初始化需要读取飞书表格，在 run() 中异步创建，避免阻塞事件循环
+        self.deepseek: Optional[DeepSeekChat] = None
         self.warehouse_mgr = WarehouseManager()
         self.product_mgr = ProductManager()
+        # 表单提交复用同一组管理器，避免每次提交重新获取令牌、校验表头
+        self.inbound_mgr = InboundManager()
+        self.outbound_mgr = OutboundManager()
+        self.inventory_mgr = InventorySummaryManager()
         self.running = True  # 控制处理循环
         self.sleep_interval = 0.1  # 无消息时的休眠时间（秒）
+        self.poll_interval = 2  # 未安装 watchdog 时扫描消息目录的间隔（秒）
+
+        # 待处理消息文件队列，由目录监听或轮询扫描填充
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._queued_files = set()
+        self._user_queues: Dict[str, asyncio.Queue] = {}
+        # 持有用户处理任务的引用，避免任务被垃圾回收，退出时统一取消
+        self._user_tasks: Set[asyncio.Task] = set()
+        # 各用户并发处理，限制同时发往飞书消息接口的请求数，避免触发限流
+        self._send_sem = asyncio.Semaphore(MAX_CONCURRENT_SENDS)
+        self._observer = None
         
         # 添加用户锁字典
         self.user_locks = defaultdict(Lock)
 
     async def run(self):
         """运行消息处理循环"""
-        while self.running:
-            try:
-                # 处理消息
-                await self.process_messages()
-                
-                # 无消息时休眠一段时间
-                time.sleep(self.sleep_interval)
-                
-            except Exception as e:
-                logger.error(f"消息处理循环发生错误: {e}")
-                # 发生错误时稍微延长休眠时间
-                time.sleep(self.sleep_interval * 2)
-                continue  # 继续循环
+        if self.deepseek is None:
+            self.deepseek = await DeepSeekChat.create()
+        try:
+            while self.running:
+                try:
+                    # 处理消息
+                    await self.process_messages()
+                    
+                    # 无消息时休眠一段时间
+                    await asyncio.sleep(self.sleep_interval)
+                    
+                except Exception as e:
+                    logger.error(f"消息处理循环发生错误: {e}")
+                    # 发生错误时稍微延长休眠时间
+                    await asyncio.sleep(self.sleep_interval * 2)
+                    continue  # 继续循环
+        finally:
+            # 退出时释放 DeepSeek 的连接池
+            await self.deepseek.aclose()
 
     def stop(self):
         """停止消息处理"""
         self.running = False
 
+    def _enqueue_file(self, msg_file: Path) -> None:
+        """把待处理的消息文件放入队列，已在队列中的文件不重复放入"""
+        if msg_file in self._queued_files:
+            return
+        self._queued_files.add(msg_file)
+        self._queue.put_nowait(msg_file)
+
+    def _recover_claimed_files(self) -> None:
+        """把上次进程退出时未处理完的 *.json.processing 文件恢复为 *.json，重新处理"""
+        for claimed in self.message_dir.glob(f"*/*{CLAIMED_SUFFIX}"):
+            msg_file = claimed.with_name(claimed.name[:-len(CLAIMED_SUFFIX)] + ".json")
+            try:
+                os.rename(claimed, msg_file)
+                logger.info("Recovered unfinished message file: %s", msg_file)
+            except OSError as e:
+                logger.error("Failed to recover message file %s: %s", claimed, e)
+
+    def _scan_message_files(self) -> None:
+        """扫描消息目录，把已存在的消息文件按用户、时间顺序放入队列"""
+        for user_dir in self.message_dir.iterdir():
+            if user_dir.is_dir():
+                for msg_file in sorted(user_dir.glob("*.json")):
+                    self._enqueue_file(msg_file)
+
+    def _start_watcher(self) -> bool:
+        """启动消息目录监听，未安装 watchdog 时返回 False，改用轮询"""
+        if self._observer is not None:
+            return True
+        if not WATCHDOG_AVAILABLE:
+            return False
+        try:
+            handler = _MessageFileHandler(asyncio.get_running_loop(), self._enqueue_file)
+            observer = Observer()
+            observer.schedule(handler, str(self.message_dir), recursive=True)
+            observer.start()
+        except Exception as e:
+            logger.warning("Failed to start message directory watcher, falling back to polling: %s", e)
+            return False
+        self._observer = observer
+        logger.info("Watching %s for new message files", self.message_dir)
+        return True
+
+    def _stop_watcher(self) -> None:
+        """停止消息目录监听"""
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+            self._observer = None
+
     async def process_messages(self):
-        """处理消息（异步方法）"""
+        """处理消息（异步方法）
+
+        每个用户一个处理任务：同一用户的消息按顺序处理，不同用户之间并发处理。
+        """
         logger.info("Starting message processing loop")
-        while not self._should_stop:
+        watching = self._start_watcher()
+        try:
+            # 监听启动前写入的文件不会触发事件，先扫描一次
+            self._scan_message_files()
+            while not self._should_stop:
+                try:
+                    if not watching and self._queue.empty():
+                        await asyncio.sleep(self.poll_interval)
+                        self._scan_message_files()
+                        continue
+
+                    msg_file = await self._queue.get()
+                    user_id = msg_file.parent.name
+                    user_queue = self._user_queues.get(user_id)
+                    if user_queue is None:
+                        user_queue = self._user_queues[user_id] = asyncio.Queue()
+                        task = asyncio.create_task(self._process_user(user_id, user_queue))
+                        self._user_tasks.add(task)
+                        task.add_done_callback(self._user_tasks.discard)
+                    user_queue.put_nowait(msg_file)
+
+                except Exception as e:
+                    logger.error("Error in process_messages loop: %s", str(e), exc_info=True)
+                    # 添加短暂延迟，避免在错误情况下的快速循环
+                    await asyncio.sleep(0.5)
+                    continue
+        finally:
+            self._stop_watcher()
+            # 取消仍在运行的用户处理任务，下次启动时重新创建
+            tasks = list(self._user_tasks)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._user_queues.clear()
+            self._queued_files.clear()
+
+    async def _process_user(self, user_id: str, user_queue: asyncio.Queue) -> None:
+        """按顺序处理单个用户的消息文件，队列取空后退出
+
+        处理前先把文件重命名为 *.json.processing 认领，扫描和目录监听只匹配 *.json，
+        认领后的文件不会被重复处理；重命名失败说明文件已被处理，直接跳过。
+        处理成功的文件会被删除；处理后仍存在（内容未写完、发送失败等）的文件在
+        poll_interval 秒后恢复为 *.json，重新排队处理。
+        """
+        while not user_queue.empty():
+            msg_file = user_queue.get_nowait()
+            self._queued_files.discard(msg_file)
+            claimed = msg_file.with_suffix(CLAIMED_SUFFIX)
+            try:
+                await asyncio.to_thread(os.rename, msg_file, claimed)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                # 文件仍被写入方占用（Windows），写完后会再次触发事件
+                logger.warning("Failed to claim message file %s: %s", msg_file, e)
+                continue
             try:
-                # 遍历所有用户目录
-                user_dirs = [d for d in self.message_dir.iterdir() if d.is_dir()]
+                await self._handle_file(claimed)
+            except Exception as e:
+                logger.error("Error processing file %s: %s", claimed, str(e), exc_info=True)
+            if claimed.exists():
+                asyncio.get_running_loop().call_later(
+                    self.poll_interval, self._release_claimed_file, claimed, msg_file
+                )
+        # 检查队列与删除之间没有 await，不会丢失新放入的文件
+        del self._user_queues[user_id]
+
+    def _release_claimed_file(self, claimed: Path, msg_file: Path) -> None:
+        """把未处理完的文件恢复为 *.json，由目录监听或下一次扫描重新放入队列"""
+        try:
+            os.rename(claimed, msg_file)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error("Failed to release message file %s: %s", claimed, e)
+
+    async def _handle_file(self, msg_file: Path) -> None:
+        """处理单个消息文件"""
+        try:
+            logger.info("Processing file: %s", msg_file)
+            message = orjson.loads(await asyncio.to_thread(msg_file.read_bytes))
+            
+            # 处理不同类型的消息
+            message_type = message.get("type")
+            
+            if message_type == "card_action":
+                print("开始处理卡片操作...")  # 调试日志
+                data = message.get("data", {})
+                action_value = data.get("action_value", {})
+                form_data = data.get("form_data",{})
                 
-                for user_dir in user_dirs:
-                    # 获取该用户的所有未处理消息
-                    message_files = [
-                        f for f in user_dir.glob("*.json") 
-                        if f not in self.processed_files
-                    ]
-                    
-                    if message_files:
-                        logger.info("Found %d new message files for user %s", 
-                                  len(message_files), user_dir.name)
+                if isinstance(action_value, str):
+                    action_value = orjson.loads(action_value)
+                
+                # 从 raw_data 中获取 message_id
+                raw_data = orjson.loads(data.get("raw_data", "{}"))
+                message_id = raw_data.get("event", {}).get("context", {}).get("open_message_id")
+                
+                if action_value.get("action") == "confirm_products" and action_value.get("form_type") == "inbound":
+                    try:
+                        # 获取当前行数
+                        current_products = form_data.get("products", [])
+                        inbound_id = action_value.get("inbound_id")
+                        
+                        # 生成新的表单
+                        new_card = await asyncio.to_thread(
+                            self.generate_inbound_form,
+                            inbound_id=inbound_id,
+                            selected_products=current_products
+                        )
+                        
+                        if new_card and message_id:
+                            # 使用 SDK 更新卡片
+                            logger.info(f"Updating card message: {message_id} with {current_products}")
+                            
+                            # 构造请求对象
+                            request = PatchMessageRequest.builder() \
+                                .message_id(message_id) \
+                                .request_body(PatchMessageRequestBody.builder()
+                                    .content(_dumps(new_card))
+                                    .build()) \
+                                .build()
 
-                    # 按时间顺序处理消息
-                    for msg_file in sorted(message_files):
-                        try:
-                            logger.info("Processing file: %s", msg_file)
-                            with open(msg_file, 'r', encoding='utf-8') as f:
-                                message = json.load(f)
+                            # 发起请求
+                            async with self._send_sem:
+                                response = await self.client.im.v1.message.apatch(request)
+
+                            # 检查响应
+                            if response.success():
+                                logger.info("Card updated successfully")
+                                # 删除消息文件
+                                try:
+                                    await asyncio.to_thread(os.remove, msg_file)
+                                    logger.info(f"Successfully processed and removed file: {msg_file}")
+                                except Exception as e:
+                                    logger.error(f"Error removing message file: {e}")
+                            else:
+                                logger.error(
+                                    f"Failed to update card: code={response.code}, "
+                                    f"msg={response.msg}, log_id={response.get_log_id()}"
+                                )
+                        else:
+                            logger.error(f"Invalid card update parameters: message_id={message_id}, rows={current_products}")
+                            
+                    except Exception as e:
+                        logger.error(f"处理添加商品操作失败: {e}", exc_info=True)
+                        operator_id = data.get("operator_id")
+                        if operator_id:
+                            await self.send_text_message(
+                                receive_id=operator_id,
+                                content=f"❌ 添加商品失败: {str(e)}\n请重试或联系管理员"
+                            )
+                elif action_value.get("action") == "confirm_products" and action_value.get("form_type") == "outbound":
+                    try:
+                        # 详细记录接收到的数据
+                        logger.info(f"Received outbound add_product action with data: {json.dumps(action_value, indent=2)}")
+                        
+                        # 获取当前行数
+                        current_products = form_data.get("products", [])
+                        outbound_id = action_value.get("outbound_id")
+                        
+                        if not outbound_id:
+                            raise ValueError("Missing outbound_id in action_value")
+                            
+                        logger.info(f"Generating outbound form with {current_products} products for outbound_id: {outbound_id}")
+                        
+                        # 生成新的表单
+                        new_card = await asyncio.to_thread(
+                            self.generate_outbound_form,
+                            outbound_id=outbound_id,
+                            selected_products=current_products
+                        )
+                        
+                        if not new_card:
+                            raise ValueError("Failed to generate outbound form card")
+                            
+                        if not message_id:
+                            raise ValueError("Missing message_id")
                             
-                            # 处理不同类型的消息
-                            message_type = message.get("type")
+                        logger.info(f"Updating card message {message_id} with new form")
+                        
+                        # 构造请求对象
+                        request = PatchMessageRequest.builder() \
+                            .message_id(message_id) \
+                            .request_body(PatchMessageRequestBody.builder()
+                                .content(_dumps(new_card))
+                                .build()) \
+                            .build()
+
+                        # 发起请求
+                        logger.info("Sending patch request to Feishu API")
+                        async with self._send_sem:
+                            response = await self.client.im.v1.message.apatch(request)
+
+                        # 检查响应
+                        if response.success():
+                            logger.info("Card updated successfully")
+                            # 删除消息文件
+                            try:
+                                await asyncio.to_thread(os.remove, msg_file)
+                                logger.info(f"Successfully processed and removed file: {msg_file}")
+                            except Exception as e:
+                                logger.error(f"Error removing message file: {e}", exc_info=True)
+                                # 继续执行，因为卡片更新已经成功
+                        else:
+                            error_msg = (
+                                f"Failed to update card: code={response.code}, "
+                                f"msg={response.msg}, log_id={response.get_log_id()}"
+                            )
+                            logger.error(error_msg)
+                            raise Exception(error_msg)
+                            
+                    except Exception as e:
+                        error_msg = f"处理添加商品操作失败: {str(e)}"
+                        logger.error(error_msg, exc_info=True)
+                        operator_id = data.get("operator_id")
+                        if operator_id:
+                            try:
+                                await self.send_text_message(
+                                    receive_id=operator_id,
+                                    content=f"❌ {error_msg}\n请重试或联系管理员"
+                                )
+                                logger.info(f"Error message sent to operator {operator_id}")
+                            except Exception as send_error:
+                                logger.error(f"Failed to send error message: {send_error}", exc_info=True)
+                elif action_value.get("action") == "submit" and action_value.get("form_type") == "outbound":
+                    try:
+                        # 收集所有商品数据
+                        form_data = data.get("form_data", {})
+                        outbound_id = action_value.get("outbound_id")
+                        operator_id = data.get("operator_id")
+                        current_time = int(datetime.now().timestamp() * 1000)
+                        
+                        outbound_records = []
+                        insufficient_stock = []
+                        i = 0
+                        
+                        # 商品、仓库数据在循环前读取一次，放到线程中执行，不阻塞其他用户
+                        product_df, warehouse_df = await asyncio.gather(
+                            asyncio.to_thread(self.product_mgr.get_data),
+                            asyncio.to_thread(self.warehouse_mgr.get_data)
+                        )
+                        
+                        while True:
+                            product_key = f"product_{i}"
+                            quantity_key = f"quantity_{i}"
+                            price_key = f"price_{i}"
                             
-                            if message_type == "card_action":
-                                print("开始处理卡片操作...")  # 调试日志
-                                data = message.get("data", {})
-                                action_value = data.get("action_value", {})
-                                form_data = data.get("form_data",{})
+                            if product_key not in form_data:
+                                break
                                 
-                                if isinstance(action_value, str):
-                                    action_value = json.loads(action_value)
+                            product_id = form_data.get(product_key)
+                            quantity = float(form_data.get(quantity_key, 0))
+                            price = float(form_data.get(price_key, 0))
+                            
+                            if product_id and quantity > 0 and price > 0:
+                                # 获取商品详情
+                                product_info = product_df[product_df['商品ID'] == product_id].to_dict('records')
                                 
-                                # 从 raw_data 中获取 message_id
-                                raw_data = json.loads(data.get("raw_data", "{}"))
-                                message_id = raw_data.get("event", {}).get("context", {}).get("open_message_id")
+                                if not product_info:
+                                    raise ValueError(f"商品ID无效: {product_id}")
                                 
-                                if action_value.get("action") == "confirm_products" and action_value.get("form_type") == "inbound":
-                                    try:
-                                        # 获取当前行数
-                                        current_products = form_data.get("products", [])
-                                        inbound_id = action_value.get("inbound_id")
+                                product_info = product_info[0]
+                                
+                                # 获取仓库信息
+                                warehouse_info = warehouse_df[warehouse_df['仓库名'] == form_data['warehouse']].to_dict('records')
+                                
+                                if not warehouse_info:
+                                    raise ValueError(f"仓库名无效: {form_data['warehouse']}")
+                                
+                                warehouse_info = warehouse_info[0]
+                                
+                                # 检查库存是否充足
+                                has_stock, current_stock = await asyncio.to_thread(
+                                    self._check_stock,
+                                    self.inventory_mgr,
+                                    product_id,
+                                    warehouse_info['仓库名'],
+                                    quantity
+                                )
+                                
+                                if not has_stock:
+                                    insufficient_stock.append({
+                                        'name': product_info['商品名称'],
+                                        'warehouse': warehouse_info['仓库名'],  # 添加仓库名
+                                        'required': quantity,
+                                        'current': current_stock
+                                    })
+                                    logger.warning(f"Insufficient stock for {product_info['商品名称']}: "
+                                                 f"required={quantity}, available={current_stock}")
+                                    break
+                                
+                                outbound_records.append({
+                                    "fields": {
+                                        "出库单号": outbound_id,
+                                        "出库日期": int(datetime.strptime(form_data['outbound_date'], "%Y-%m-%d %z").timestamp() * 1000),
+                                        "客户": form_data.get('customer', ''),
+                                        "仓库名": warehouse_info['仓库名'],
+                                        "仓库备注": warehouse_info.get('仓库备注', ''),
+                                        "仓库地址": warehouse_info.get('仓库地址', ''),
+                                        "商品ID": product_id,
+                                        "商品名称": product_info['商品名称'],
+                                        "商品规格": product_info.get('商品规格', ''),
+                                        "出库数量": quantity,
+                                        "出库单价": price,
+                                        "出库总价": quantity * price,
+                                        "操作者ID": [{"id": operator_id}],
+                                        "操作时间": current_time,
+                                        "快递单号": form_data.get('tracking', ''),
+                                        "快递手机号": form_data.get('phone', '')
+                                    }
+                                })
+                            i += 1
+                        
+                        if insufficient_stock:
+                            logger.info("Found insufficient stock, preparing error card...")
+                            # 生成库存不足提示卡片
+                            error_content = {
+                                "schema": "2.0",
+                                "config": {
+                                    "update_multi": True,
+                                    "wide_screen_mode": True
+                                },
+                                "body": {
+                                    "elements": [
+                                        {
+                                            "tag": "markdown",
+                                            "content": "❌ **库存不足**\n\n以下商品库存不足：\n\n" + "\n".join([
+                                                f"- **{item['name']}** | {item['warehouse']}\n  需求数量: {item['required']:.0f}\n  当前库存: {item['current']:.0f}"
+                                                for item in insufficient_stock
+                                            ]),
+                                            "text_align": "left"
+                                        }
+                                    ]
+                                },
+                                "header": {
+                                    "template": "red",
+                                    "title": {
+                                        "content": "库存不足提示",
+                                        "tag": "plain_text"
+                                    }
+                                }
+                            }
+                            
+                            logger.info(f"Updating message {message_id} with error card...")
+                            logger.info(f"Error content: {_dumps(error_content)}")
+                            
+                            # 更新卡片
+                            try:
+                                # 构造请求对象
+                                request = PatchMessageRequest.builder() \
+                                    .message_id(message_id) \
+                                    .request_body(PatchMessageRequestBody.builder()
+                                        .content(_dumps(error_content))
+                                        .build()) \
+                                    .build()
+                                
+                                # 发送请求
+                                logger.info("Sending patch request to update card...")
+                                async with self._send_sem:
+                                    response = await self.client.im.v1.message.apatch(request)
+                                
+                                # 检查响应
+                                if response.success():
+                                    logger.info("Successfully updated card with insufficient stock message")
+                                    logger.info(f"Successfully processed file: {msg_file}")
+                                else:
+                                    logger.error(
+                                        f"Failed to update error card: code={response.code}, "
+                                        f"msg={response.msg}, log_id={response.get_log_id()}"
+                                    )
+                            except Exception as e:
+                                logger.error(f"Error updating card with insufficient stock message: {e}", exc_info=True)
+                            finally:
+                                # 无论成功与否，都确保文件被删除
+                                try:
+                                    await asyncio.to_thread(os.remove, msg_file)
+                                    logger.info(f"Successfully removed file: {msg_file}")
+                                except Exception as e:
+                                    logger.error(f"Error removing message file: {e}")
+                                # 确保在库存不足时立即返回
+                                return True
+                            
+                        # 如果没有库存不足的情况，继续处理
+                        if not outbound_records:
+                            raise ValueError("没有有效的出库记录")
+                        
+                        # 写入出库记录
+                        # 写入会等待其他用户的库存写入完成，放到线程中执行，不阻塞事件循环
+                        if await asyncio.to_thread(self.outbound_mgr.add_outbound, outbound_records):
+                            try:
+                                # 获取出库明细记录
+                                outbound_details = await asyncio.to_thread(self.outbound_mgr.get_outbound_details, outbound_id)
+
+                                # 按商品分组显示
+                                product_groups = {}
+                                for record in outbound_details:
+                                    fields = record["fields"]
+                                    product_id = fields["商品ID"]
+                                    if product_id not in product_groups:
+                                        product_groups[product_id] = []
+                                    product_groups[product_id].append(fields)
+
+                                logger.info("Product groups: %s", json.dumps(product_groups, indent=2, ensure_ascii=False))
+
+                                # 添加商品明细
+                                total_amount = 0
+                                total_profit = 0  # 添加总毛利变量
+                                details_content = ""
+
+                                # 遍历每个商品组
+                                for product_id, records in product_groups.items():
+                                    product_info = records[0]  # 获取第一条记录的商品信息
+                                    warehouse_name = product_info['仓库名']
+                                    details_content += f"\n**{product_info['商品名称']}** | {warehouse_name}\n"
+                                    
+                                    group_total_qty = sum(float(r['出库数量']) for r in records)
+                                    group_total_amount = sum(float(r['出库总价']) for r in records)
+                                    total_amount += group_total_amount
+                                    
+                                    # 计算该商品组的毛利
+                                    group_total_profit = sum(
+                                        (float(r['出库单价']) - float(r['入库单价'])) * float(r['出库数量'])
+                                        for r in records
+                                    )
+                                    total_profit += group_total_profit
+                                    
+                                    details_content += (
+                                        f"  总数量: {group_total_qty:.0f} | "
+                                        f"总金额: ¥{group_total_amount:.2f} | "
+                                        f"毛利: ¥{group_total_profit:.2f}\n"
+                                    )
+                                    
+                                    # 显示每条出库记录的详细信息
+                                    for record in records:
+                                        cost_price = float(record['入库单价'])
+                                        out_price = float(record['出库单价'])
+                                        out_qty = float(record['出库数量'])
+                                        profit = (out_price - cost_price) * out_qty
                                         
-                                        # 生成新的表单
-                                        new_card = self.generate_inbound_form(
-                                            inbound_id=inbound_id,
-                                            selected_products = current_products
+                                        details_content += (
+                                            f"    - 入库价: ¥{cost_price:.2f} | "
+                                            f"出库价: ¥{out_price:.2f} | "
+                                            f"出库数量: {out_qty:.0f} | "
+                                            f"毛利: ¥{profit:.2f}\n"
                                         )
-                                        
-                                        if new_card and message_id:
-                                            # 使用 SDK 更新卡片
-                                            logger.info(f"Updating card message: {message_id} with {current_products}")
-                                            
-                                            # 构造请求对象
-                                            request = PatchMessageRequest.builder() \
-                                                .message_id(message_id) \
-                                                .request_body(PatchMessageRequestBody.builder()
-                                                    .content(json.dumps(new_card, ensure_ascii=False))
-                                                    .build()) \
-                                                .build()
-
-                                            # 发起请求
-                                            response = self.client.im.v1.message.patch(request)
-
-                                            # 检查响应
-                                            if response.success():
-                                                logger.info("Card updated successfully")
-                                                # 删除消息文件
-                                                try:
-                                                    os.remove(msg_file)
-                                                    self.processed_files.add(msg_file)
-                                                    logger.info(f"Successfully processed and removed file: {msg_file}")
-                                                except Exception as e:
-                                                    logger.error(f"Error removing message file: {e}")
-                                            else:
-                                                logger.error(
-                                                    f"Failed to update card: code={response.code}, "
-                                                    f"msg={response.msg}, log_id={response.get_log_id()}"
-                                                )
-                                        else:
-                                            logger.error(f"Invalid card update parameters: message_id={message_id}, rows={current_products}")
-                                            
-                                    except Exception as e:
-                                        logger.error(f"处理添加商品操作失败: {e}", exc_info=True)
-                                        operator_id = data.get("operator_id")
-                                        if operator_id:
-                                            await self.send_text_message(
-                                                receive_id=operator_id,
-                                                content=f"❌ 添加商品失败: {str(e)}\n请重试或联系管理员"
-                                            )
-                                elif action_value.get("action") == "confirm_products" and action_value.get("form_type") == "outbound":
+
+                                # 生成成功消息卡片
+                                success_content = {
+                                    "schema": "2.0",
+                                    "config": {
+                                        "update_multi": True,
+                                        "style": {
+                                            "text_size": {
+                                                "normal_v2": {
+                                                    "default": "normal",
+                                                    "pc": "normal",
+                                                    "mobile": "heading"
+                                                }
+                                            }
+                                        }
+                                    },
+                                    "body": {
+                                        "elements": [
+                                            {
+                                                "tag": "markdown",
+                                                "content": f":OK: **出库单 {outbound_id} 处理成功**\n\n",
+                                                "text_align": "left",
+                                                "text_size": "normal_v2"
+                                            },
+                                            {
+                                                "tag": "markdown",
+                                                "content": f"👤 **客户：** {form_data.get('customer', '')}\n\n",
+                                                "text_align": "left",
+                                                "text_size": "normal_v2"
+                                            },
+                                            {
+                                                "tag": "markdown",
+                                                "content": "📦 **出库明细：**\n",
+                                                "text_align": "left",
+                                                "text_size": "normal_v2"
+                                            }
+                                        ]
+                                    }
+                                }
+                                
+                                success_content["body"]["elements"].append({
+                                    "tag": "markdown",
+                                    "content": details_content,
+                                    "text_align": "left",
+                                    "text_size": "normal_v2"
+                                })
+                                
+                                success_content["body"]["elements"].append({
+                                    "tag": "markdown",
+                                    "content": f"\n💰 **订单总计：** ¥{total_amount:.2f} | **总毛利：** ¥{total_profit:.2f}",
+                                    "text_align": "left",
+                                    "text_size": "normal_v2"
+                                })
+
+                                # 添加快递信息（如果存在）
+                                tracking_info = []
+                                if form_data.get('tracking'):
+                                    tracking_info.append(f"📬 **快递单号：** {form_data['tracking']}")
+                                if form_data.get('phone'):
+                                    tracking_info.append(f"📱 **收件手机：** {form_data['phone']}")
+
+                                if tracking_info:
+                                    success_content["body"]["elements"].append({
+                                        "tag": "markdown",
+                                        "content": "\n" + "\n".join(tracking_info) + "\n",
+                                        "text_align": "left",
+                                        "text_size": "normal_v2"
+                                    }) 
+                                                                                   # 更新卡片
+                                request = PatchMessageRequest.builder() \
+                                    .message_id(message_id) \
+                                    .request_body(PatchMessageRequestBody.builder()
+                                        .content(_dumps(success_content))
+                                        .build()) \
+                                    .build()
+
+                                async with self._send_sem:
+                                    response = await self.client.im.v1.message.apatch(request)
+                                
+                                if response.success():
+                                    logger.info("Success card updated successfully")
+                                    # 删除消息文件
                                     try:
-                                        # 详细记录接收到的数据
-                                        logger.info(f"Received outbound add_product action with data: {json.dumps(action_value, indent=2)}")
-                                        
-                                        # 获取当前行数
-                                        current_products = form_data.get("products", [])
-                                        outbound_id = action_value.get("outbound_id")
-                                        
-                                        if not outbound_id:
-                                            raise ValueError("Missing outbound_id in action_value")
-                                            
-                                        logger.info(f"Generating outbound form with {current_products} products for outbound_id: {outbound_id}")
-                                        
-                                        # 生成新的表单
-                                        new_card = self.generate_outbound_form(
-                                            outbound_id=outbound_id,
-                                            selected_products=current_products
-                                        )
-                                        
-                                        if not new_card:
-                                            raise ValueError("Failed to generate outbound form card")
-                                            
-                                        if not message_id:
-                                            raise ValueError("Missing message_id")
-                                            
-                                        logger.info(f"Updating card message {message_id} with new form")
-                                        
-                                        # 构造请求对象
-                                        request = PatchMessageRequest.builder() \
-                                            .message_id(message_id) \
-                                            .request_body(PatchMessageRequestBody.builder()
-                                                .content(json.dumps(new_card, ensure_ascii=False))
-                                                .build()) \
-                                            .build()
-
-                                        # 发起请求
-                                        logger.info("Sending patch request to Feishu API")
-                                        response = self.client.im.v1.message.patch(request)
-
-                                        # 检查响应
-                                        if response.success():
-                                            logger.info("Card updated successfully")
-                                            # 删除消息文件
-                                            try:
-                                                os.remove(msg_file)
-                                                self.processed_files.add(msg_file)
-                                                logger.info(f"Successfully processed and removed file: {msg_file}")
-                                            except Exception as e:
-                                                logger.error(f"Error removing message file: {e}", exc_info=True)
-                                                # 继续执行，因为卡片更新已经成功
-                                        else:
-                                            error_msg = (
-                                                f"Failed to update card: code={response.code}, "
-                                                f"msg={response.msg}, log_id={response.get_log_id()}"
-                                            )
-                                            logger.error(error_msg)
-                                            raise Exception(error_msg)
-                                            
+                                        await asyncio.to_thread(os.remove, msg_file)
+                                        logger.info(f"Successfully processed and removed file: {msg_file}")
                                     except Exception as e:
-                                        error_msg = f"处理添加商品操作失败: {str(e)}"
-                                        logger.error(error_msg, exc_info=True)
-                                        operator_id = data.get("operator_id")
-                                        if operator_id:
-                                            try:
-                                                await self.send_text_message(
-                                                    receive_id=operator_id,
-                                                    content=f"❌ {error_msg}\n请重试或联系管理员"
-                                                )
-                                                logger.info(f"Error message sent to operator {operator_id}")
-                                            except Exception as send_error:
-                                                logger.error(f"Failed to send error message: {send_error}", exc_info=True)
-                                elif action_value.get("action") == "submit" and action_value.get("form_type") == "outbound":
-                                    try:
-                                        # 收集所有商品数据
-                                        form_data = data.get("form_data", {})
-                                        outbound_id = action_value.get("outbound_id")
-                                        operator_id = data.get("operator_id")
-                                        current_time = int(datetime.now().timestamp() * 1000)
-                                        
-                                        outbound_records = []
-                                        insufficient_stock = []
-                                        i = 0
-                                        
-                                        while True:
-                                            product_key = f"product_{i}"
-                                            quantity_key = f"quantity_{i}"
-                                            price_key = f"price_{i}"
-                                            
-                                            if product_key not in form_data:
-                                                break
-                                                
-                                            product_id = form_data.get(product_key)
-                                            quantity = float(form_data.get(quantity_key, 0))
-                                            price = float(form_data.get(price_key, 0))
-                                            
-                                            if product_id and quantity > 0 and price > 0:
-                                                # 获取商品详情
-                                                product_df = self.product_mgr.get_data()
-                                                product_info = product_df[product_df['商品ID'] == product_id].to_dict('records')
-                                                
-                                                if not product_info:
-                                                    raise ValueError(f"商品ID无效: {product_id}")
-                                                
-                                                product_info = product_info[0]
-                                                
-                                                # 获取仓库信息
-                                                warehouse_df = self.warehouse_mgr.get_data()
-                                                warehouse_info = warehouse_df[warehouse_df['仓库名'] == form_data['warehouse']].to_dict('records')
-                                                
-                                                if not warehouse_info:
-                                                    raise ValueError(f"仓库名无效: {form_data['warehouse']}")
-                                                
-                                                warehouse_info = warehouse_info[0]
-                                                
-                                                # 检查库存是否充足
-                                                inventory_mgr = InventorySummaryManager()
-                                                has_stock, current_stock = self._check_stock(
-                                                    inventory_mgr,
-                                                    product_id,
-                                                    warehouse_info['仓库名'],
-                                                    quantity
-                                                )
-                                                
-                                                if not has_stock:
-                                                    insufficient_stock.append({
-                                                        'name': product_info['商品名称'],
-                                                        'warehouse': warehouse_info['仓库名'],  # 添加仓库名
-                                                        'required': quantity,
-                                                        'current': current_stock
-                                                    })
-                                                    logger.warning(f"Insufficient stock for {product_info['商品名称']}: "
-                                                                 f"required={quantity}, available={current_stock}")
-                                                    break
-                                                
-                                                outbound_records.append({
-                                                    "fields": {
-                                                        "出库单号": outbound_id,
-                                                        "出库日期": int(datetime.strptime(form_data['outbound_date'], "%Y-%m-%d %z").timestamp() * 1000),
-                                                        "客户": form_data.get('customer', ''),
-                                                        "仓库名": warehouse_info['仓库名'],
-                                                        "仓库备注": warehouse_info.get('仓库备注', ''),
-                                                        "仓库地址": warehouse_info.get('仓库地址', ''),
-                                                        "商品ID": product_id,
-                                                        "商品名称": product_info['商品名称'],
-                                                        "商品规格": product_info.get('商品规格', ''),
-                                                        "出库数量": quantity,
-                                                        "出库单价": price,
-                                                        "出库总价": quantity * price,
-                                                        "操作者ID": [{"id": operator_id}],
-                                                        "操作时间": current_time,
-                                                        "快递单号": form_data.get('tracking', ''),
-                                                        "快递手机号": form_data.get('phone', '')
-                                                    }
-                                                })
-                                            i += 1
-                                        
-                                        if insufficient_stock:
-                                            logger.info("Found insufficient stock, preparing error card...")
-                                            # 生成库存不足提示卡片
-                                            error_content = {
-                                                "schema": "2.0",
-                                                "config": {
-                                                    "update_multi": True,
-                                                    "wide_screen_mode": True
-                                                },
-                                                "body": {
-                                                    "elements": [
-                                                        {
-                                                            "tag": "markdown",
-                                                            "content": "❌ **库存不足**\n\n以下商品库存不足：\n\n" + "\n".join([
-                                                                f"- **{item['name']}** | {item['warehouse']}\n  需求数量: {item['required']:.0f}\n  当前库存: {item['current']:.0f}"
-                                                                for item in insufficient_stock
-                                                            ]),
-                                                            "text_align": "left"
-                                                        }
-                                                    ]
-                                                },
-                                                "header": {
-                                                    "template": "red",
-                                                    "title": {
-                                                        "content": "库存不足提示",
-                                                        "tag": "plain_text"
-                                                    }
+                                        logger.error(f"Error removing message file: {e}")
+                                else:
+                                    logger.error(
+                                        f"Failed to update success card: code={response.code}, "
+                                        f"msg={response.msg}, log_id={response.get_log_id()}"
+                                    )
+                            except Exception as e:
+                                logger.error(f"Error updating inventory: {str(e)}", exc_info=True)
+                                raise
+                            finally:
+                                try:
+                                    await asyncio.to_thread(os.remove, msg_file)
+                                    logger.info(f"Successfully processed and removed file: {msg_file}")
+                                except Exception as e:
+                                    logger.error(f"Error removing message file: {e}")
+                                return True
+                        else:
+                            raise Exception("出库记录写入失败")
+                        
+                    except Exception as e:
+                        error_msg = f"❌ 出库失败: {str(e)}\n请重试或联系管理员"
+                        logger.error(f"Error processing outbound form: {str(e)}", exc_info=True)
+                        await self.send_text_message(
+                            receive_id=data.get('operator_id'),
+                            content=error_msg
+                        )
+                    finally:
+                        try:
+                            await asyncio.to_thread(os.remove, msg_file)
+                            logger.info(f"Successfully processed and removed file: {msg_file}")
+                        except Exception as e:
+                            logger.error(f"Error removing message file: {e}")
+                        return True
+                elif action_value.get("action") == "submit" and action_value.get("form_type") == "inbound":
+                    try:
+                        # 收集所有商品数据
+                        form_data = data.get("form_data", {})
+                        inbound_id = action_value.get("inbound_id")
+                        operator_id = data.get("operator_id")
+                        current_time = int(datetime.now().timestamp() * 1000)
+                        
+                        inbound_records = []
+                        i = 0
+                        
+                        # 商品、仓库数据在循环前读取一次，放到线程中执行，不阻塞其他用户
+                        product_df, warehouse_df = await asyncio.gather(
+                            asyncio.to_thread(self.product_mgr.get_data),
+                            asyncio.to_thread(self.warehouse_mgr.get_data)
+                        )
+                        
+                        while True:
+                            product_key = f"product_{i}"
+                            quantity_key = f"quantity_{i}"
+                            price_key = f"price_{i}"
+                            
+                            if product_key not in form_data:
+                                break
+                                
+                            product_id = form_data.get(product_key)
+                            quantity = float(form_data.get(quantity_key, 0))
+                            price = float(form_data.get(price_key, 0))
+                            
+                            if product_id and quantity > 0 and price > 0:
+                                # 获取商品详情
+                                product_info = product_df[product_df['商品ID'] == product_id].to_dict('records')
+                                
+                                if not product_info:
+                                    raise ValueError(f"商品ID无效: {product_id}")
+                                
+                                product_info = product_info[0]
+                                
+                                # 获取仓库信息
+                                warehouse_info = warehouse_df[warehouse_df['仓库名'] == form_data['warehouse']].to_dict('records')
+                                
+                                if not warehouse_info:
+                                    raise ValueError(f"仓库名无效: {form_data['warehouse']}")
+                                
+                                warehouse_info = warehouse_info[0]
+                                
+                                inbound_records.append({
+                                    "fields": {
+                                        "入库单号": inbound_id,
+                                        "入库日期": int(datetime.strptime(form_data['inbound_date'], "%Y-%m-%d %z").timestamp() * 1000),
+                                        "供应商": form_data.get('supplier', ''),
+                                        "仓库名": warehouse_info['仓库名'],
+                                        "仓库备注": warehouse_info.get('仓库备注', ''),
+                                        "仓库地址": warehouse_info.get('仓库地址', ''),
+                                        "商品ID": product_id,
+                                        "商品名称": product_info['商品名称'],
+                                        "商品规格": product_info.get('商品规格', ''),
+                                        "入库数量": quantity,
+                                        "入库单价": price,
+                                        "入库总价": quantity * price,
+                                        "操作者ID": [{"id": operator_id}],
+                                        "操作时间": current_time,
+                                        "快递单号": form_data.get('tracking', ''),
+                                        "快递手机号": form_data.get('phone', '')
+                                    }
+                                })
+                            i += 1
+                        
+                        if not inbound_records:
+                            raise ValueError("没有有效的入库记录")
+                        
+                        # 写入入库记录
+                        # 写入会等待其他用户的库存写入完成，放到线程中执行，不阻塞事件循环
+                        if await asyncio.to_thread(self.inbound_mgr.add_inbound, inbound_records):
+                            try:
+                                # 生成成功消息卡片
+                                success_content = {
+                                    "schema": "2.0",
+                                    "config": {
+                                        "update_multi": True,
+                                        "style": {
+                                            "text_size": {
+                                                "normal_v2": {
+                                                    "default": "normal",
+                                                    "pc": "normal",
+                                                    "mobile": "heading"
                                                 }
                                             }
-                                            
-                                            logger.info(f"Updating message {message_id} with error card...")
-                                            logger.info(f"Error content: {json.dumps(error_content, ensure_ascii=False)}")
-                                            
-                                            # 更新卡片
-                                            try:
-                                                # 构造请求对象
-                                                request = PatchMessageRequest.builder() \
-                                                    .message_id(message_id) \
-                                                    .request_body(PatchMessageRequestBody.builder()
-                                                        .content(json.dumps(error_content, ensure_ascii=False))
-                                                        .build()) \
-                                                    .build()
-                                                
-                                                # 发送请求
-                                                logger.info("Sending patch request to update card...")
-                                                response = self.client.im.v1.message.patch(request)
-                                                
-                                                # 检查响应
-                                                if response.success():
-                                                    logger.info("Successfully updated card with insufficient stock message")
-                                                    logger.info(f"Successfully processed file: {msg_file}")
-                                                else:
-                                                    logger.error(
-                                                        f"Failed to update error card: code={response.code}, "
-                                                        f"msg={response.msg}, log_id={response.get_log_id()}"
-                                                    )
-                                            except Exception as e:
-                                                logger.error(f"Error updating card with insufficient stock message: {e}", exc_info=True)
-                                            finally:
-                                                # 无论成功与否，都确保文件被标记为已处理并删除
-                                                self.processed_files.add(msg_file)
-                                                try:
-                                                    os.remove(msg_file)
-                                                    logger.info(f"Successfully removed file: {msg_file}")
-                                                except Exception as e:
-                                                    logger.error(f"Error removing message file: {e}")
-                                                # 确保在库存不足时立即返回
-                                                return True
-                                            
-                                        # 如果没有库存不足的情况，继续处理
-                                        if not outbound_records:
-                                            raise ValueError("没有有效的出库记录")
-                                        
-                                        # 写入出库记录
-                                        outbound_mgr = OutboundManager()
-                                        if outbound_mgr.add_outbound(outbound_records):
-                                            try:
-                                                # 获取出库明细记录
-                                                outbound_details = outbound_mgr.get_outbound_details(outbound_id)
-
-                                                # 按商品分组显示
-                                                product_groups = {}
-                                                for record in outbound_details:
-                                                    fields = record["fields"]
-                                                    product_id = fields["商品ID"]
-                                                    if product_id not in product_groups:
-                                                        product_groups[product_id] = []
-                                                    product_groups[product_id].append(fields)
-
-                                                logger.info("Product groups: %s", json.dumps(product_groups, indent=2, ensure_ascii=False))
-
-                                                # 添加商品明细
-                                                total_amount = 0
-                                                total_profit = 0  # 添加总毛利变量
-                                                details_content = ""
-
-                                                # 遍历每个商品组
-                                                for product_id, records in product_groups.items():
-                                                    product_info = records[0]  # 获取第一条记录的商品信息
-                                                    warehouse_name = product_info['仓库名']
-                                                    details_content += f"\n**{product_info['商品名称']}** | {warehouse_name}\n"
-                                                    
-                                                    group_total_qty = sum(float(r['出库数量']) for r in records)
-                                                    group_total_amount = sum(float(r['出库总价']) for r in records)
-                                                    total_amount += group_total_amount
-                                                    
-                                                    # 计算该商品组的毛利
-                                                    group_total_profit = sum(
-                                                        (float(r['出库单价']) - float(r['入库单价'])) * float(r['出库数量'])
-                                                        for r in records
-                                                    )
-                                                    total_profit += group_total_profit
-                                                    
-                                                    details_content += (
-                                                        f"  总数量: {group_total_qty:.0f} | "
-                                                        f"总金额: ¥{group_total_amount:.2f} | "
-                                                        f"毛利: ¥{group_total_profit:.2f}\n"
-                                                    )
-                                                    
-                                                    # 显示每条出库记录的详细信息
-                                                    for record in records:
-                                                        cost_price = float(record['入库单价'])
-                                                        out_price = float(record['出库单价'])
-                                                        out_qty = float(record['出库数量'])
-                                                        profit = (out_price - cost_price) * out_qty
-                                                        
-                                                        details_content += (
-                                                            f"    - 入库价: ¥{cost_price:.2f} | "
-                                                            f"出库价: ¥{out_price:.2f} | "
-                                                            f"出库数量: {out_qty:.0f} | "
-                                                            f"毛利: ¥{profit:.2f}\n"
-                                                        )
-
-                                                # 生成成功消息卡片
-                                                success_content = {
-                                                    "schema": "2.0",
-                                                    "config": {
-                                                        "update_multi": True,
-                                                        "style": {
-                                                            "text_size": {
-                                                                "normal_v2": {
-                                                                    "default": "normal",
-                                                                    "pc": "normal",
-                                                                    "mobile": "heading"
-                                                                }
-                                                            }
-                                                        }
-                                                    },
-                                                    "body": {
-                                                        "elements": [
-                                                            {
-                                                                "tag": "markdown",
-                                                                "content": f":OK: **出库单 {outbound_id} 处理成功**\n\n",
-                                                                "text_align": "left",
-                                                                "text_size": "normal_v2"
-                                                            },
-                                                            {
-                                                                "tag": "markdown",
-                                                                "content": f"👤 **客户：** {form_data.get('customer', '')}\n\n",
-                                                                "text_align": "left",
-                                                                "text_size": "normal_v2"
-                                                            },
-                                                            {
-                                                                "tag": "markdown",
-                                                                "content": "📦 **出库明细：**\n",
-                                                                "text_align": "left",
-                                                                "text_size": "normal_v2"
-                                                            }
-                                                        ]
-                                                    }
-                                                }
-                                                
-                                                success_content["body"]["elements"].append({
-                                                    "tag": "markdown",
-                                                    "content": details_content,
-                                                    "text_align": "left",
-                                                    "text_size": "normal_v2"
-                                                })
-                                                
-                                                success_content["body"]["elements"].append({
-                                                    "tag": "markdown",
-                                                    "content": f"\n💰 **订单总计：** ¥{total_amount:.2f} | **总毛利：** ¥{total_profit:.2f}",
-                                                    "text_align": "left",
-                                                    "text_size": "normal_v2"
-                                                })
-
-                                                # 添加快递信息（如果存在）
-                                                tracking_info = []
-                                                if form_data.get('tracking'):
-                                                    tracking_info.append(f"📬 **快递单号：** {form_data['tracking']}")
-                                                if form_data.get('phone'):
-                                                    tracking_info.append(f"📱 **收件手机：** {form_data['phone']}")
-
-                                                if tracking_info:
-                                                    success_content["body"]["elements"].append({
-                                                        "tag": "markdown",
-                                                        "content": "\n" + "\n".join(tracking_info) + "\n",
-                                                        "text_align": "left",
-                                                        "text_size": "normal_v2"
-                                                    }) 
-                                                                                                   # 更新卡片
-                                                request = PatchMessageRequest.builder() \
-                                                    .message_id(message_id) \
-                                                    .request_body(PatchMessageRequestBody.builder()
-                                                        .content(json.dumps(success_content, ensure_ascii=False))
-                                                        .build()) \
-                                                    .build()
-
-                                                response = self.client.im.v1.message.patch(request)
-                                                
-                                                if response.success():
-                                                    logger.info("Success card updated successfully")
-                                                    # 删除消息文件
-                                                    try:
-                                                        os.remove(msg_file)
-                                                        self.processed_files.add(msg_file)
-                                                        logger.info(f"Successfully processed and removed file: {msg_file}")
-                                                    except Exception as e:
-                                                        logger.error(f"Error removing message file: {e}")
-                                                else:
-                                                    logger.error(
-                                                        f"Failed to update success card: code={response.code}, "
-                                                        f"msg={response.msg}, log_id={response.get_log_id()}"
-                                                    )
-                                            except Exception as e:
-                                                logger.error(f"Error updating inventory: {str(e)}", exc_info=True)
-                                                raise
-                                            finally:
-                                                try:
-                                                    os.remove(msg_file)
-                                                    self.processed_files.add(msg_file)
-                                                    logger.info(f"Successfully processed and removed file: {msg_file}")
-                                                except Exception as e:
-                                                    logger.error(f"Error removing message file: {e}")
-                                                return True
-                                        else:
-                                            raise Exception("出库记录写入失败")
-                                        
-                                    except Exception as e:
-                                        error_msg = f"❌ 出库失败: {str(e)}\n请重试或联系管理员"
-                                        logger.error(f"Error processing outbound form: {str(e)}", exc_info=True)
-                                        await self.send_text_message(
-                                            receive_id=data.get('operator_id'),
-                                            content=error_msg
-                                        )
-                                    finally:
-                                        try:
-                                            os.remove(msg_file)
-                                            self.processed_files.add(msg_file)
-                                            logger.info(f"Successfully processed and removed file: {msg_file}")
-                                        except Exception as e:
-                                            logger.error(f"Error removing message file: {e}")
-                                        return True
-                                elif action_value.get("action") == "submit" and action_value.get("form_type") == "inbound":
+                                        }
+                                    },
+                                    "body": {
+                                        "elements": [
+                                            {
+                                                "tag": "markdown",
+                                                "content": f":OK: **入库单 {inbound_id} 处理成功**\n\n",
+                                                "text_align": "left",
+                                                "text_size": "normal_v2"
+                                            },
+                                            {
+                                                "tag": "markdown",
+                                                "content": f"👤 **供应商：** {form_data.get('supplier', '')}\n\n",
+                                                "text_align": "left",
+                                                "text_size": "normal_v2"
+                                            },
+                                            {
+                                                "tag": "markdown",
+                                                "content": "📦 **入库明细：**\n",
+                                                "text_align": "left",
+                                                "text_size": "normal_v2"
+                                            }
+                                        ]
+                                    }
+                                }
+                                
+                                # 添加商品明细
+                                total_amount = 0
+                                details_content = ""
+                                for record in inbound_records:
+                                    fields = record["fields"]
+                                    total_amount += fields['入库总价']
+                                    details_content += (
+                                        f"- {fields['商品名称']} ({fields['商品规格']}) | {fields['仓库名']}\n"
+                                        f"  数量: {fields['入库数量']:.0f} | "
+                                        f"单价: ¥{fields['入库单价']:.2f} | "
+                                        f"小计: ¥{fields['入库总价']:.2f}\n"
+                                    )
+                                
+                                # 添加快递信息到成功消息
+                                if fields.get('tracking') or fields.get('phone'):
+                                    details_content += (
+                                        f"📬 **快递信息：**\n" + 
+                                        (f"- 快递单号：{fields['快递单号']}\n" if fields.get('tracking') else "") +
+                                        (f"- 收件手机：{fields['快递手机号']}\n" if fields.get('phone') else "")
+                                    )
+                                
+                                success_content["body"]["elements"].append({
+                                    "tag": "markdown",
+                                    "content": details_content,
+                                    "text_align": "left",
+                                    "text_size": "normal_v2"
+                                })
+                                
+                                success_content["body"]["elements"].append({
+                                    "tag": "markdown",
+                                    "content": f"\n💰 **总金额：** ¥{total_amount:.2f}",
+                                    "text_align": "left",
+                                    "text_size": "normal_v2"
+                                })
+                                
+                                # 更新卡片
+                                request = PatchMessageRequest.builder() \
+                                    .message_id(message_id) \
+                                    .request_body(PatchMessageRequestBody.builder()
+                                        .content(_dumps(success_content))
+                                        .build()) \
+                                    .build()
+
+                                async with self._send_sem:
+                                    response = await self.client.im.v1.message.apatch(request)
+                                
+                                if response.success():
+                                    logger.info("Success card updated successfully")
+                                    # 删除消息文件并标记为已处理
                                     try:
-                                        # 收集所有商品数据
-                                        form_data = data.get("form_data", {})
-                                        inbound_id = action_value.get("inbound_id")
-                                        operator_id = data.get("operator_id")
-                                        current_time = int(datetime.now().timestamp() * 1000)
-                                        
-                                        inbound_records = []
-                                        i = 0
-                                        
-                                        while True:
-                                            product_key = f"product_{i}"
-                                            quantity_key = f"quantity_{i}"
-                                            price_key = f"price_{i}"
-                                            
-                                            if product_key not in form_data:
-                                                break
-                                                
-                                            product_id = form_data.get(product_key)
-                                            quantity = float(form_data.get(quantity_key, 0))
-                                            price = float(form_data.get(price_key, 0))
-                                            
-                                            if product_id and quantity > 0 and price > 0:
-                                                # 获取商品详情
-                                                product_df = self.product_mgr.get_data()
-                                                product_info = product_df[product_df['商品ID'] == product_id].to_dict('records')
-                                                
-                                                if not product_info:
-                                                    raise ValueError(f"商品ID无效: {product_id}")
-                                                
-                                                product_info = product_info[0]
-                                                
-                                                # 获取仓库信息
-                                                warehouse_df = self.warehouse_mgr.get_data()
-                                                warehouse_info = warehouse_df[warehouse_df['仓库名'] == form_data['warehouse']].to_dict('records')
-                                                
-                                                if not warehouse_info:
-                                                    raise ValueError(f"仓库名无效: {form_data['warehouse']}")
-                                                
-                                                warehouse_info = warehouse_info[0]
-                                                
-                                                inbound_records.append({
-                                                    "fields": {
-                                                        "入库单号": inbound_id,
-                                                        "入库日期": int(datetime.strptime(form_data['inbound_date'], "%Y-%m-%d %z").timestamp() * 1000),
-                                                        "供应商": form_data.get('supplier', ''),
-                                                        "仓库名": warehouse_info['仓库名'],
-                                                        "仓库备注": warehouse_info.get('仓库备注', ''),
-                                                        "仓库地址": warehouse_info.get('仓库地址', ''),
-                                                        "商品ID": product_id,
-                                                        "商品名称": product_info['商品名称'],
-                                                        "商品规格": product_info.get('商品规格', ''),
-                                                        "入库数量": quantity,
-                                                        "入库单价": price,
-                                                        "入库总价": quantity * price,
-                                                        "操作者ID": [{"id": operator_id}],
-                                                        "操作时间": current_time,
-                                                        "快递单号": form_data.get('tracking', ''),
-                                                        "快递手机号": form_data.get('phone', '')
-                                                    }
-                                                })
-                                            i += 1
-                                        
-                                        if not inbound_records:
-                                            raise ValueError("没有有效的入库记录")
-                                        
-                                        # 写入入库记录
-                                        inbound_mgr = InboundManager()
-                                        if inbound_mgr.add_inbound(inbound_records):
-                                            try:
-                                                # 生成成功消息卡片
-                                                success_content = {
-                                                    "schema": "2.0",
-                                                    "config": {
-                                                        "update_multi": True,
-                                                        "style": {
-                                                            "text_size": {
-                                                                "normal_v2": {
-                                                                    "default": "normal",
-                                                                    "pc": "normal",
-                                                                    "mobile": "heading"
-                                                                }
-                                                            }
-                                                        }
-                                                    },
-                                                    "body": {
-                                                        "elements": [
-                                                            {
-                                                                "tag": "markdown",
-                                                                "content": f":OK: **入库单 {inbound_id} 处理成功**\n\n",
-                                                                "text_align": "left",
-                                                                "text_size": "normal_v2"
-                                                            },
-                                                            {
-                                                                "tag": "markdown",
-                                                                "content": f"👤 **供应商：** {form_data.get('supplier', '')}\n\n",
-                                                                "text_align": "left",
-                                                                "text_size": "normal_v2"
-                                                            },
-                                                            {
-                                                                "tag": "markdown",
-                                                                "content": "📦 **入库明细：**\n",
-                                                                "text_align": "left",
-                                                                "text_size": "normal_v2"
-                                                            }
-                                                        ]
-                                                    }
-                                                }
-                                                
-                                                # 添加商品明细
-                                                total_amount = 0
-                                                details_content = ""
-                                                for record in inbound_records:
-                                                    fields = record["fields"]
-                                                    total_amount += fields['入库总价']
-                                                    details_content += (
-                                                        f"- {fields['商品名称']} ({fields['商品规格']}) | {fields['仓库名']}\n"
-                                                        f"  数量: {fields['入库数量']:.0f} | "
-                                                        f"单价: ¥{fields['入库单价']:.2f} | "
-                                                        f"小计: ¥{fields['入库总价']:.2f}\n"
-                                                    )
-                                                
-                                                # 添加快递信息到成功消息
-                                                if fields.get('tracking') or fields.get('phone'):
-                                                    details_content += (
-                                                        f"📬 **快递信息：**\n" + 
-                                                        (f"- 快递单号：{fields['快递单号']}\n" if fields.get('tracking') else "") +
-                                                        (f"- 收件手机：{fields['快递手机号']}\n" if fields.get('phone') else "")
-                                                    )
-                                                
-                                                success_content["body"]["elements"].append({
-                                                    "tag": "markdown",
-                                                    "content": details_content,
-                                                    "text_align": "left",
-                                                    "text_size": "normal_v2"
-                                                })
-                                                
-                                                success_content["body"]["elements"].append({
-                                                    "tag": "markdown",
-                                                    "content": f"\n💰 **总金额：** ¥{total_amount:.2f}",
-                                                    "text_align": "left",
-                                                    "text_size": "normal_v2"
-                                                })
-                                                
-                                                # 更新卡片
-                                                request = PatchMessageRequest.builder() \
-                                                    .message_id(message_id) \
-                                                    .request_body(PatchMessageRequestBody.builder()
-                                                        .content(json.dumps(success_content, ensure_ascii=False))
-                                                        .build()) \
-                                                    .build()
-
-                                                response = self.client.im.v1.message.patch(request)
-                                                
-                                                if response.success():
-                                                    logger.info("Success card updated successfully")
-                                                    # 删除消息文件并标记为已处理
-                                                    try:
-                                                        os.remove(msg_file)
-                                                        self.processed_files.add(msg_file)
-                                                        logger.info(f"Successfully processed and removed file: {msg_file}")
-                                                    except Exception as e:
-                                                        logger.error(f"Error removing message file: {e}")
-                                                else:
-                                                    logger.error(
-                                                        f"Failed to update success card: code={response.code}, "
-                                                        f"msg={response.msg}, log_id={response.get_log_id()}"
-                                                    )
-                                            except Exception as e:
-                                                logger.error(f"Error updating inventory: {str(e)}", exc_info=True)
-                                                raise
-                                            finally:
-                                                # 无论成功与否，都确保文件被标记为已处理
-                                                self.processed_files.add(msg_file)
-                                                return True
-                                        else:
-                                            raise ValueError("入库记录写入失败")
-                                        
+                                        await asyncio.to_thread(os.remove, msg_file)
+                                        logger.info(f"Successfully processed and removed file: {msg_file}")
                                     except Exception as e:
-                                        error_msg = f"❌ 入库失败: {str(e)}\n请重试或联系管理员"
-                                        logger.error(f"Error processing inbound form: {str(e)}", exc_info=True)
-                                        await self.send_text_message(
-                                            receive_id=data.get('operator_id'),
-                                            content=error_msg
-                                        )
-                                        # 确保在发生错误时也标记文件为已处理
-                                        try:
-                                            self.processed_files.add(msg_file)
-                                            os.remove(msg_file)
-                                        except Exception as e:
-                                            logger.error(f"Error removing message file: {e}")
-                                        return True
-                            elif message_type in ["p2p_message", "message"]:
+                                        logger.error(f"Error removing message file: {e}")
+                                else:
+                                    logger.error(
+                                        f"Failed to update success card: code={response.code}, "
+                                        f"msg={response.msg}, log_id={response.get_log_id()}"
+                                    )
+                            except Exception as e:
+                                logger.error(f"Error updating inventory: {str(e)}", exc_info=True)
+                                raise
+                            finally:
+                                # 入库记录已写入，无论卡片是否更新成功都删除文件，避免重试时重复入库
                                 try:
-                                    event_data = json.loads(message["data"])
-                                    event = event_data["event"]
-                                    message_type = event["message"]["chat_type"]
-                                    
-                                    # 获取发送者 ID 和消息内容
-                                    sender_open_id = event["sender"]["sender_id"]["open_id"]
-                                    message_content = json.loads(event["message"]["content"])
-                                    original_text = message_content.get("text", "")
-                                    
-                                    # 确定接收者 ID 和类型
-                                    if message_type == "group":
-                                        receive_id = event["message"]["chat_id"]
-                                        chat_type = "group"
-                                    else:
-                                        receive_id = sender_open_id
-                                        chat_type = "p2p"
-                                    
-                                    logger.info("Received %s message from %s: %s", 
-                                                chat_type, sender_open_id, original_text)
-                                    
-                                    # 使用用户锁确保顺序处理
-                                    async with self.user_locks[sender_open_id]:
-                                        # Get AI response
-                                        ai_response = await self.deepseek.chat(original_text, sender_open_id)
-                                        
-                                        # 提取用户可读的消息（去除JSON部分）
-                                        user_message = self._extract_user_message(ai_response)
-                                        
-                                        # For group chats, mention the sender
-                                        if chat_type == "group":
-                                            user_message = f"<at user_id=\"{sender_open_id}\"></at>\n{user_message}"
-                                        
-                                        # Send AI response back
-                                        success = await self.send_message(receive_id, user_message, chat_type)
-                                        if success:
-                                            logger.info("AI reply sent successfully")
-                                            # 删除消息文件
-                                            try:
-                                                os.remove(msg_file)
-                                                self.processed_files.add(msg_file)
-                                                logger.info(f"Successfully processed and removed file: {msg_file}")
-                                            except Exception as e:
-                                                logger.error(f"Error removing message file: {e}")
-                                        else:
-                                            logger.error("Failed to send AI reply")
-                                            continue  # 如果发送失败，跳过文件删除
-                                    
+                                    await asyncio.to_thread(os.remove, msg_file)
+                                except FileNotFoundError:
+                                    pass
                                 except Exception as e:
-                                    logger.error(f"Error processing message: {e}")
-                                    continue
-                            elif message_type == "bot_menu_event":
+                                    logger.error(f"Error removing message file: {e}")
+                                return True
+                        else:
+                            raise ValueError("入库记录写入失败")
+                        
+                    except Exception as e:
+                        error_msg = f"❌ 入库失败: {str(e)}\n请重试或联系管理员"
+                        logger.error(f"Error processing inbound form: {str(e)}", exc_info=True)
+                        await self.send_text_message(
+                            receive_id=data.get('operator_id'),
+                            content=error_msg
+                        )
+                        # 确保在发生错误时也删除文件
+                        try:
+                            await asyncio.to_thread(os.remove, msg_file)
+                        except Exception as e:
+                            logger.error(f"Error removing message file: {e}")
+                        return True
+            elif message_type in ["p2p_message", "message"]:
+                try:
+                    event_data = orjson.loads(message["data"])
+                    event = event_data["event"]
+                    message_type = event["message"]["chat_type"]
+                    
+                    # 获取发送者 ID 和消息内容
+                    sender_open_id = event["sender"]["sender_id"]["open_id"]
+                    message_content = orjson.loads(event["message"]["content"])
+                    original_text = message_content.get("text", "")
+                    
+                    # 确定接收者 ID 和类型
+                    if message_type == "group":
+                        receive_id = event["message"]["chat_id"]
+                        chat_type = "group"
+                    else:
+                        receive_id = sender_open_id
+                        chat_type = "p2p"
+                    
+                    logger.info("Received %s message from %s: %s", 
+                                chat_type, sender_open_id, original_text)
+                    
+                    # 使用用户锁确保顺序处理
+                    async with self.user_locks[sender_open_id]:
+                        # Get AI response
+                        ai_response = await self.deepseek.chat(original_text, sender_open_id)
+                        
+                        # 提取用户可读的消息（去除JSON部分）
+                        user_message = self._extract_user_message(ai_response)
+                        
+                        # For group chats, mention the sender
+                        if chat_type == "group":
+                            user_message = f"<at user_id=\"{sender_open_id}\"></at>\n{user_message}"
+                        
+                        # Send AI response back
+                        success = await self.send_message(receive_id, user_message, chat_type)
+                        if success:
+                            logger.info("AI reply sent successfully")
+                            # 删除消息文件
+                            try:
+                                await asyncio.to_thread(os.remove, msg_file)
+                                logger.info(f"Successfully processed and removed file: {msg_file}")
+                            except Exception as e:
+                                logger.error(f"Error removing message file: {e}")
+                        else:
+                            logger.error("Failed to send AI reply")
+                            return  # 如果发送失败，跳过文件删除
+                    
+                except Exception as e:
+                    logger.error(f"Error processing message: {e}")
+                    return
+            elif message_type == "bot_menu_event":
+                try:
+                    event_data = orjson.loads(message["data"])
+                    event = event_data["event"]
+                    receive_id = event["operator"]["operator_id"]["open_id"]
+                    
+                    if event.get("event_key") == "INBOUND":
+                        # 生成入库表单卡片
+                        card = await asyncio.to_thread(self.generate_inbound_form)
+                        if card:
+                            # 发送卡片消息
+                            if await self.send_card_message(
+                                receive_id=receive_id,
+                                card_content=card
+                            ):
+                                logger.info("Inbound form card sent successfully")
+                                # 处理成功后删除消息文件
                                 try:
-                                    event_data = json.loads(message["data"])
-                                    event = event_data["event"]
-                                    receive_id = event["operator"]["operator_id"]["open_id"]
-                                    
-                                    if event.get("event_key") == "INBOUND":
-                                        # 生成入库表单卡片
-                                        card = self.generate_inbound_form()
-                                        if card:
-                                            # 发送卡片消息
-                                            if await self.send_card_message(
-                                                receive_id=receive_id,
-                                                card_content=card
-                                            ):
-                                                logger.info("Inbound form card sent successfully")
-                                                # 处理成功后删除消息文件
-                                                try:
-                                                    os.remove(msg_file)
-                                                    self.processed_files.add(msg_file)
-                                                    logger.info(f"Successfully processed and removed file: {msg_file}")
-                                                except Exception as e:
-                                                    logger.error(f"Error removing message file: {e}")
-                                            else:
-                                                logger.error("Failed to send inbound form card")
-                                                continue  # 如果发送失败，跳过文件删除
-                                        else:
-                                            # 发送错误消息
-                                            await self.send_text_message(
-                                                receive_id=receive_id,
-                                                content="❌ 生成入库表单失败，请稍后重试"
-                                            )
-                                            continue
-                                            
-                                    elif event.get("event_key") == "OUTBOUND":
-                                        # 生成出库表单卡片
-                                        card = self.generate_outbound_form()
-                                        if card:
-                                            # 发送卡片消息
-                                            if await self.send_card_message(
-                                                receive_id=receive_id,
-                                                card_content=card
-                                            ):
-                                                logger.info("Outbound form card sent successfully")
-                                                # 处理成功后删除消息文件
-                                                try:
-                                                    os.remove(msg_file)
-                                                    self.processed_files.add(msg_file)
-                                                    logger.info(f"Successfully processed and removed file: {msg_file}")
-                                                except Exception as e:
-                                                    logger.error(f"Error removing message file: {e}")
-                                            else:
-                                                logger.error("Failed to send outbound form card")
-                                                continue  # 如果发送失败，跳过文件删除
-                                        else:
-                                            # 发送错误消息
-                                            await self.send_text_message(
-                                                receive_id=receive_id,
-                                                content="❌ 生成出库表单失败，请稍后重试"
-                                            )
-                                            continue
-                                            
+                                    await asyncio.to_thread(os.remove, msg_file)
+                                    logger.info(f"Successfully processed and removed file: {msg_file}")
                                 except Exception as e:
-                                    logger.error(f"Error processing bot menu event: {e}", exc_info=True)
-                                    continue
+                                    logger.error(f"Error removing message file: {e}")
+                            else:
+                                logger.error("Failed to send inbound form card")
+                                return  # 如果发送失败，跳过文件删除
+                        else:
+                            # 发送错误消息
+                            await self.send_text_message(
+                                receive_id=receive_id,
+                                content="❌ 生成入库表单失败，请稍后重试"
+                            )
+                            return
                             
-                        except Exception as e:
-                            logger.error("Error processing file %s: %s", msg_file, str(e))
-                            continue
-                    
-                # 将 sleep 移到循环末尾，并增加可配置性
-                await asyncio.sleep(self.poll_interval if hasattr(self, 'poll_interval') else 2)
-                
-            except Exception as e:
-                logger.error("Error in process_messages loop: %s", str(e), exc_info=True)
-                # 添加短暂延迟，避免在错误情况下的快速循环
-                await asyncio.sleep(0.5)
-                continue
+                    elif event.get("event_key") == "OUTBOUND":
+                        # 生成出库表单卡片
+                        card = await asyncio.to_thread(self.generate_outbound_form)
+                        if card:
+                            # 发送卡片消息
+                            if await self.send_card_message(
+                                receive_id=receive_id,
+                                card_content=card
+                            ):
+                                logger.info("Outbound form card sent successfully")
+                                # 处理成功后删除消息文件
+                                try:
+                                    await asyncio.to_thread(os.remove, msg_file)
+                                    logger.info(f"Successfully processed and removed file: {msg_file}")
+                                except Exception as e:
+                                    logger.error(f"Error removing message file: {e}")
+                            else:
+                                logger.error("Failed to send outbound form card")
+                                return  # 如果发送失败，跳过文件删除
+                        else:
+                            # 发送错误消息
+                            await self.send_text_message(
+                                receive_id=receive_id,
+                                content="❌ 生成出库表单失败，请稍后重试"
+                            )
+                            return
+                            
+                except Exception as e:
+                    logger.error(f"Error processing bot menu event: {e}", exc_info=True)
+                    return
+            
+        except Exception as e:
+            logger.error("Error processing file %s: %s", msg_file, str(e))
 
     def _extract_user_message(self, ai_response: str) -> str:
         """从AI响应中提取用户可读的消息部分"""
         # 移除 JSON 部分
-        message = re.sub(r'<JSON>.*?</JSON>', '', ai_response, flags=re.DOTALL)
+        message = _JSON_BLOCK_RE.sub('', ai_response) if "<JSON>" in ai_response else ai_response
         # 清理多余的空行
         message = '\n'.join(line for line in message.splitlines() if line.strip())
         return message.strip()
@@ -1717,13 +1900,12 @@ class MessageProcessor:
         """发送卡片消息（异步方法）"""
         try:
             logger.info("Attempting to send card message")
-            from lark_oapi.api.im.v1 import CreateMessageRequest, CreateMessageRequestBody
 
             # 使用 builder 模式构建请求体
             request_body = CreateMessageRequestBody.builder() \
                 .receive_id(receive_id) \
                 .msg_type("interactive") \
-                .content(json.dumps(card_content, ensure_ascii=False)) \
+                .content(_dumps(card_content)) \
                 .build()
 
             # 构建完整请求
@@ -1733,7 +1915,8 @@ class MessageProcessor:
                 .build()
 
             logger.info("Sending card message...")
-            response = self.client.im.v1.message.create(request)
+            async with self._send_sem:
+                response = await self.client.im.v1.message.acreate(request)
             
             # 详细记录响应信息
             if not response.success():
@@ -1763,7 +1946,6 @@ class MessageProcessor:
         """发送消息（异步方法）"""
         try:
             logger.info("Attempting to send message to %s: %s", chat_type, receive_id)
-            from lark_oapi.api.im.v1 import CreateMessageRequest, CreateMessageRequestBody
 
             # 根据消息类型设置 receive_id_type
             receive_id_type = "open_id" if chat_type == "p2p" else "chat_id"
@@ -1772,7 +1954,7 @@ class MessageProcessor:
             request_body = CreateMessageRequestBody.builder() \
                 .receive_id(receive_id) \
                 .msg_type("text") \
-                .content(json.dumps({"text": content}, ensure_ascii=False)) \
+                .content(_dumps({"text": content})) \
                 .build()
 
             # 构建完整请求
@@ -1782,7 +1964,8 @@ class MessageProcessor:
                 .build()
 
             logger.info("Sending request...")
-            response = self.client.im.v1.message.create(request)
+            async with self._send_sem:
+                response = await self.client.im.v1.message.acreate(request)
             
             # 详细记录响应信息
             if not response.success():
@@ -1817,9 +2000,9 @@ class MessageProcessor:
             async with self.user_locks[sender_id]:
                 # 如果消息内容是JSON字符串，解析它
                 try:
-                    content_json = json.loads(msg_content)
+                    content_json = orjson.loads(msg_content)
                     msg_text = content_json.get("text", "")
-                except json.JSONDecodeError:
+                except orjson.JSONDecodeError:
                     msg_text = msg_content
 
                 logger.info(f"处理用户 {sender_id} 的消息: {msg_text[:100]}...")
@@ -1842,7 +2025,6 @@ class MessageProcessor:
         """发送交互式消息（异步方法）"""
         try:
             logger.info("Attempting to send interactive message to %s: %s", chat_type, receive_id)
-            from lark_oapi.api.im.v1 import CreateMessageRequest, CreateMessageRequestBody
 
             # 根据消息类型设置 receive_id_type
             receive_id_type = "open_id" if chat_type == "p2p" else "chat_id"
@@ -1861,7 +2043,8 @@ class MessageProcessor:
                 .build()
 
             logger.info("Sending interactive request...")
-            response = self.client.im.v1.message.create(request)
+            async with self._send_sem:
+                response = await self.client.im.v1.message.acreate(request)
             
             # 详细记录响应信息
             if not response.success():
@@ -1880,31 +2063,6 @@ class MessageProcessor:
             return False
 
 
-    async def get_tenant_access_token(self) -> str:
-        """获取租户访问令牌"""
-        try:
-            url = "https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal"
-            headers = {
-                "Content-Type": "application/json; charset=utf-8"
-            }
-            data = {
-                "app_id": self.app_id,
-                "app_secret": self.app_secret
-            }
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=data) as response:
-                    result = await response.json()
-                    if result.get("code") == 0:
-                        return result.get("tenant_access_token")
-                    else:
-                        logger.error(f"Failed to get tenant access token: {result}")
-                        return None
-                        
-        except Exception as e:
-            logger.error(f"Error getting tenant access token: {e}")
-            return None
-
     def get_warehouse_options(self) -> list:
         """获取仓库选项列表"""
         try:
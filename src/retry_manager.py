@@ -10,6 +10,13 @@ from functools import wraps
 import httpx
 from exceptions import NetworkError, BaseInventoryError
 
+# 尝试导入h2，用于启用HTTP/2
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
 
@@ -58,11 +65,15 @@ class CircuitBreaker:
         self,
         failure_threshold: int = 5,
         recovery_timeout: float = 60.0,
-        expected_exception: Type[Exception] = Exception
+        expected_exception: Type[Exception] = Exception,
+        max_recovery_timeout: Optional[float] = None
     ):
         self.failure_threshold = failure_threshold
         self.recovery_timeout = recovery_timeout
         self.expected_exception = expected_exception
+        # 设置后 HALF_OPEN 探测失败时恢复等待时间翻倍，最长不超过该值；探测成功后恢复初始值
+        self.initial_recovery_timeout = recovery_timeout
+        self.max_recovery_timeout = max_recovery_timeout
 
         self.failure_count = 0
         self.last_failure_time = None
@@ -81,16 +92,23 @@ class CircuitBreaker:
             result = func(*args, **kwargs)
             if self.state == "HALF_OPEN":
                 self.state = "CLOSED"
-                self.failure_count = 0
+                self.recovery_timeout = self.initial_recovery_timeout
                 logger.info("Circuit breaker reset to CLOSED state")
+            self.failure_count = 0
             return result
         except self.expected_exception as e:
             self.failure_count += 1
             self.last_failure_time = time.time()
 
+            if self.state == "HALF_OPEN" and self.max_recovery_timeout is not None:
+                self.recovery_timeout = min(self.recovery_timeout * 2, self.max_recovery_timeout)
+
             if self.failure_count >= self.failure_threshold:
                 self.state = "OPEN"
-                logger.warning(f"Circuit breaker opened after {self.failure_count} failures")
+                logger.warning(
+                    f"Circuit breaker opened after {self.failure_count} failures, "
+                    f"retry in {self.recovery_timeout:.1f}s"
+                )
 
             raise
 
@@ -312,11 +330,17 @@ retry_manager = RetryManager()
 
 
 # HTTP客户端重试配置
-def create_http_client(timeout: float = 30.0) -> httpx.AsyncClient:
-    """创建带重试配置的HTTP客户端"""
+def create_http_client(
+    timeout: float = 30.0,
+    http2: bool = False,
+    **client_kwargs
+) -> httpx.AsyncClient:
+    """创建带重试配置的HTTP客户端，其余参数（如 base_url、headers）透传给 AsyncClient"""
     transport = httpx.AsyncHTTPTransport(
         retries=2,
-        verify=True
+        verify=True,
+        # HTTP/2 依赖 h2 包，未安装时退回 HTTP/1.1
+        http2=http2 and HTTP2_AVAILABLE
     )
 
     return httpx.AsyncClient(
@@ -325,5 +349,29 @@ def create_http_client(timeout: float = 30.0) -> httpx.AsyncClient:
         limits=httpx.Limits(
             max_keepalive_connections=10,
             max_connections=20
-        )
+        ),
+        **client_kwargs
+    )
+
+
+def create_sync_http_client(
+    timeout: float = 30.0,
+    http2: bool = False,
+    **client_kwargs
+) -> httpx.Client:
+    """create_http_client 的同步版本，供在线程中调用的同步代码使用"""
+    transport = httpx.HTTPTransport(
+        retries=2,
+        verify=True,
+        http2=http2 and HTTP2_AVAILABLE
+    )
+
+    return httpx.Client(
+        timeout=httpx.Timeout(timeout),
+        transport=transport,
+        limits=httpx.Limits(
+            max_keepalive_connections=10,
+            max_connections=20
+        ),
+        **client_kwargs
     )
\ No newline at end of file
@@ -1,11 +1,18 @@
 import pandas as pd
+from typing import List, Dict
 from config import FEISHU_CONFIG
 from feishu_sheet import FeishuSheet
 from datetime import datetime
+from contextlib import contextmanager
+import time
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
+# 库存汇总表按行读改写，进程内所有入库/出库写入串行执行，避免并发时丢失更新
+INVENTORY_WRITE_LOCK = threading.RLock()
+
 class BaseTableManager:
     def __init__(self):
         self.sheet_client = FeishuSheet(
@@ -13,9 +20,16 @@ class BaseTableManager:
             app_secret=FEISHU_CONFIG["APP_SECRET"]
         )
         self.bitable_config = FEISHU_CONFIG["BITABLES"]
+        self._inventory_mgr = None
         # Add column validation
         self._validate_and_update_columns()
 
+    def _get_inventory_mgr(self) -> "InventorySummaryManager":
+        """获取库存汇总管理器，首次使用时创建后复用（创建时要获取令牌并校验表头）"""
+        if self._inventory_mgr is None:
+            self._inventory_mgr = InventorySummaryManager()
+        return self._inventory_mgr
+
     def _validate_and_update_columns(self):
         """验证并更新表格列名和字段类型"""
         if not hasattr(self, 'TABLE_NAME') or not hasattr(self, 'COLUMNS') or not hasattr(self, 'FIELD_TYPES'):
@@ -96,58 +110,98 @@ class WarehouseManager(BaseTableManager):
         "仓库备注": 1,  # 文本类型
         "仓库地址": 1,  # 文本类型
     }
+    # 仓库表很少变化，读取结果缓存的秒数；本实例写入后立即失效
+    CACHE_TTL = 60
 
-    def get_data(self) -> pd.DataFrame:
-        """查看仓库数据"""
+    def __init__(self):
+        super().__init__()
+        self._records_cache = None  # (读取时间, 记录列表)
+        self._pending_records = None  # buffered_updates 期间待写入的记录
+
+    def get_records(self) -> List[Dict[str, str]]:
+        """查看仓库数据，每个仓库一个字典，键为 COLUMNS；仓库表很小，不需要 DataFrame 的调用方直接用这个"""
+        cached = self._records_cache
+        if cached and time.time() - cached[0] < self.CACHE_TTL:
+            return [dict(record) for record in cached[1]]
         try:
             config = self.bitable_config[self.TABLE_NAME]
-            data = self.sheet_client.read_bitable(
+            data = self.sheet_client.read_bitable_all(
                 app_token=config["app_token"],
                 table_id=config["table_id"]
             )
             
             if not data or not data.get("items"):
-                return pd.DataFrame()
-            
-            # 转换多维表格数据为DataFrame格式
-            records = []
-            for item in data["items"]:
-                fields = item["fields"]
-                records.append([
-                    fields.get("仓库名", ""),
-                    fields.get("仓库备注", ""),
-                    fields.get("仓库地址", "")
-                ])
+                return []
             
-            return pd.DataFrame(records, columns=self.COLUMNS)
+            records = [
+                {column: item["fields"].get(column, "") for column in self.COLUMNS}
+                for item in data["items"]
+            ]
+            self._records_cache = (time.time(), records)
+            return [dict(record) for record in records]
         except Exception as e:
             print(f"读取库存数据失败: {e}")
+            return []
+
+    def get_data(self) -> pd.DataFrame:
+        """查看仓库数据"""
+        records = self.get_records()
+        if not records:
             return pd.DataFrame()
+        return pd.DataFrame(records, columns=self.COLUMNS)
 
     def update_data(self, warehouse_name: str, category: str, address: str) -> None:
-        """更新仓库数据"""
+        """更新仓库数据，在 buffered_updates() 中调用时先暂存，退出时一次写入"""
+        # 构造新记录
+        new_record = [{
+            "fields": {
+                "仓库名": warehouse_name,
+                "仓库备注": category,
+                "仓库地址": address
+            }
+        }]
+
+        if self._pending_records is not None:
+            self._pending_records.extend(new_record)
+            return
+        self._write_records(new_record)
+
+    @contextmanager
+    def buffered_updates(self):
+        """批量更新仓库数据：期间的 update_data 只暂存，正常退出时用一次请求写入
+
+        with warehouse_mgr.buffered_updates():
+            warehouse_mgr.update_data(...)
+            warehouse_mgr.update_data(...)
+
+        with 块内抛出异常时丢弃暂存的记录；嵌套使用时由最外层统一写入
+        """
+        if self._pending_records is not None:
+            yield self
+            return
+
+        self._pending_records = []
+        try:
+            yield self
+            pending = self._pending_records
+        finally:
+            self._pending_records = None
+        if pending:
+            self._write_records(pending)
+
+    def _write_records(self, records: List[Dict]) -> None:
         try:
-            # 获取当前数据以生成新的编号
-            df = self.get_data()
-            next_id = str(len(df) + 1) if not df.empty else "1"
-            
-            # 构造新记录
-            new_record = [{
-                "fields": {
-                    "仓库名": warehouse_name,
-                    "仓库备注": category,
-                    "仓库地址": address
-                }
-            }]
-            
             config = self.bitable_config[self.TABLE_NAME]
             self.sheet_client.write_bitable(
                 app_token=config["app_token"],
                 table_id=config["table_id"],
-                records=new_record
+                records=records
             )
         except Exception as e:
             raise Exception(f"更新仓库数据失败: {e}")
+        finally:
+            # 写入失败时也可能已部分写入，一并丢弃缓存
+            self._records_cache = None
 
 class InboundManager(BaseTableManager):
     TABLE_NAME = "inbound"
@@ -174,19 +228,25 @@ class InboundManager(BaseTableManager):
     }
 
     def add_inbound(self, data_list: list[dict]) -> bool:
-        """添加多条入库记录
+        """添加多条入库记录，持有 INVENTORY_WRITE_LOCK 执行
         Args:
             data_list: 包含多个商品入库信息的列表
         """
+        with INVENTORY_WRITE_LOCK:
+            return self._add_inbound(data_list)
+
+    def _add_inbound(self, data_list: list[dict]) -> bool:
         try:
             success_count = 0
-            inventory_mgr = InventorySummaryManager()
+            inventory_mgr = self._get_inventory_mgr()
             config = self.bitable_config[self.TABLE_NAME]
 
             # 如果能从数据中解析出来入库单号 则用解析到的
             inbound_no = data_list[0].get('fields', {}).get('入库单号', f"IN-{datetime.now().strftime('%Y%m%d%H%M%S')}")
             print(f"使用入库单号: {inbound_no}")
 
+            records = []
+            inventory_updates = []
             for data in data_list:
                 try:
                     # 获取字段数据
@@ -204,7 +264,7 @@ class InboundManager(BaseTableManager):
                         continue
 
                     # 构造入库记录，使用相同的入库单号
-                    new_record = [{
+                    records.append({
                         "fields": {
                             "入库单号": inbound_no,  # 使用同一个入库单号
                             "入库日期": fields.get('入库日期', fields.get('出入库日期', '')),  # 优先使用入库日期字段
@@ -222,41 +282,46 @@ class InboundManager(BaseTableManager):
                             "操作时间": fields.get('操作时间', ''),
                             "入库总价": quantity * price
                         }
-                    }]
-
-                    print(f"准备写入入库记录: {new_record}")
-                    
-                    response = self.sheet_client.write_bitable(
-                        app_token=config["app_token"],
-                        table_id=config["table_id"],
-                        records=new_record
-                    )
-                    
-                    if response:
-                        # 构造用于更新库存的数据
-                        inventory_data = {
-                            "商品ID": fields.get('商品ID', ''),
-                            "商品名称": fields.get('商品名称', ''),
-                            "仓库名": fields.get('仓库名', ''),
-                            "入库数量": quantity,
-                            "入库单价": price
-                        }
-                        print(f"准备更新库存汇总: {inventory_data}")
-                        
-                        if inventory_mgr.update_inbound(inventory_data):
-                            success_count += 1
-                            print(f"成功处理第 {success_count} 条记录")
-                        else:
-                            print("更新库存汇总失败")
-                            return False
-                    else:
-                        print("写入入库记录失败")
-                        return False
+                    })
+
+                    # 构造用于更新库存的数据
+                    inventory_updates.append({
+                        "商品ID": fields.get('商品ID', ''),
+                        "商品名称": fields.get('商品名称', ''),
+                        "仓库名": fields.get('仓库名', ''),
+                        "入库数量": quantity,
+                        "入库单价": price
+                    })
                 
                 except (ValueError, TypeError) as e:
                     print(f"处理数据时发生错误: {e}")
                     return False
 
+            if not records:
+                print("没有有效的入库记录")
+                return False
+
+            # 整单明细通过一次 batch_create 写入
+            print(f"准备写入 {len(records)} 条入库记录")
+            response = self.sheet_client.write_bitable(
+                app_token=config["app_token"],
+                table_id=config["table_id"],
+                records=records
+            )
+            if not response:
+                print("写入入库记录失败")
+                return False
+
+            # 汇总表按商品、仓库、单价读改写，逐条串行更新
+            for inventory_data in inventory_updates:
+                print(f"准备更新库存汇总: {inventory_data}")
+                if inventory_mgr.update_inbound(inventory_data):
+                    success_count += 1
+                    print(f"成功处理第 {success_count} 条记录")
+                else:
+                    print("更新库存汇总失败")
+                    return False
+
             return success_count == len(data_list)
             
         except Exception as e:
@@ -290,9 +355,13 @@ class OutboundManager(BaseTableManager):
     }
 
     def add_outbound(self, data_list: list[dict]) -> bool:
-        """添加多条出库记录"""
+        """添加多条出库记录，持有 INVENTORY_WRITE_LOCK 执行"""
+        with INVENTORY_WRITE_LOCK:
+            return self._add_outbound(data_list)
+
+    def _add_outbound(self, data_list: list[dict]) -> bool:
         try:
-            inventory_mgr = InventorySummaryManager()
+            inventory_mgr = self._get_inventory_mgr()
             config = self.bitable_config[self.TABLE_NAME]
             successful_records = []
 
@@ -455,7 +524,7 @@ class OutboundManager(BaseTableManager):
             config = self.bitable_config[self.TABLE_NAME]
             filter_expr = f'CurrentValue.[出库单号] = "{outbound_id}"'  # 单个条件不需要AND()
             
-            data = self.sheet_client.read_bitable(
+            data = self.sheet_client.read_bitable_all(
                 app_token=config["app_token"],
                 table_id=config["table_id"],
                 filter_expr=filter_expr
@@ -478,7 +547,7 @@ class ProductManager(BaseTableManager):
         """查看商品数据"""
         try:
             config = self.bitable_config[self.TABLE_NAME]
-            data = self.sheet_client.read_bitable(
+            data = self.sheet_client.read_bitable_all(
                 app_token=config["app_token"],
                 table_id=config["table_id"]
             )
@@ -630,7 +699,7 @@ class InventorySummaryManager(BaseTableManager):
                 f'CurrentValue.[当前库存] > 0)'
             )
             
-            existing_data = self.sheet_client.read_bitable(
+            existing_data = self.sheet_client.read_bitable_all(
                 app_token=config["app_token"],
                 table_id=config["table_id"],
                 filter_expr=filter_expr
@@ -659,6 +728,7 @@ class InventorySummaryManager(BaseTableManager):
             current_time = int(datetime.now().timestamp() * 1000)
 
             outbound_details = []
+            updates = []
             
             # 从高价库存开始出库
             for record in matching_records:
@@ -684,26 +754,29 @@ class InventorySummaryManager(BaseTableManager):
                 new_current_qty = current_stock - outbound_qty
                 new_outbound_total = float(record["fields"].get("出库总价", 0)) + outbound_qty * outbound_price
 
-                update_fields = {
-                    "累计出库数量": new_outbound_qty,
-                    "当前库存": new_current_qty,
-                    "出库总价": new_outbound_total,
-                    "最后更新时间": current_time,
-                    "最后出库时间": current_time
-                }
-
-                self.sheet_client.update_bitable(
-                    app_token=config["app_token"],
-                    table_id=config["table_id"],
-                    record_id=record["record_id"],
-                    fields=update_fields
-                )
+                updates.append({
+                    "record_id": record["record_id"],
+                    "fields": {
+                        "累计出库数量": new_outbound_qty,
+                        "当前库存": new_current_qty,
+                        "出库总价": new_outbound_total,
+                        "最后更新时间": current_time,
+                        "最后出库时间": current_time
+                    }
+                })
 
                 remaining_qty -= outbound_qty
             
+            # 库存足够时才写入，所有涉及的汇总行通过一次批量更新提交
             if remaining_qty > 0:
                 raise Exception("库存不足")
             
+            self.sheet_client.batch_update_bitable(
+                app_token=config["app_token"],
+                table_id=config["table_id"],
+                records=updates
+            )
+            
             return outbound_details
             
         except Exception as e:
@@ -725,7 +798,7 @@ class InventorySummaryManager(BaseTableManager):
             # 使用AND()函数组合筛选条件
             filter_expr = f'AND({", ".join(filter_conditions)})' if filter_conditions else None
             
-            data = self.sheet_client.read_bitable(
+            data = self.sheet_client.read_bitable_all(
                 app_token=config["app_token"],
                 table_id=config["table_id"],
                 filter_expr=filter_expr
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# src 下的模块之间按顶层模块名互相导入（from retry_manager import ...），测试时同样加入搜索路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
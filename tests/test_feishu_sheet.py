@@ -0,0 +1,176 @@
+"""
+FeishuSheet / AsyncFeishuSheet 请求重试与幂等规则的测试，用 httpx.MockTransport 模拟飞书接口
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from exceptions import NetworkError
+from feishu_sheet import FeishuSheet, AsyncFeishuSheet
+from retry_manager import CircuitBreaker
+
+BASE_URL = "https://open.feishu.cn/open-apis"
+RECORDS_URL = f"{BASE_URL}/bitable/v1/apps/app_token/tables/table_id/records"
+JSON_HEADERS = {"Content-Type": "application/json; charset=utf-8"}
+
+
+def ok(data=None):
+    return httpx.Response(200, json={"code": 0, "msg": "success", "data": data or {}})
+
+
+class FakeFeishu:
+    """按顺序返回预设响应的飞书接口，令牌接口每次签发一个新令牌
+
+    responses 中的元素为 httpx.Response，或 httpx 传输异常类（请求时抛出）
+    """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+        self.tokens_issued = 0
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/auth/v3/tenant_access_token/internal"):
+            self.tokens_issued += 1
+            return httpx.Response(200, json={
+                "code": 0, "tenant_access_token": f"token-{self.tokens_issued}", "expire": 7200
+            })
+        self.requests.append(request)
+        result = self.responses.pop(0)
+        if isinstance(result, type) and issubclass(result, httpx.TransportError):
+            raise result("simulated transport error", request=request)
+        return result
+
+
+@pytest.fixture
+def sheet_factory(monkeypatch):
+    """创建接到 FakeFeishu 上的 FeishuSheet，令牌和熔断器不在测试之间共用，退避不等待"""
+    monkeypatch.setattr(FeishuSheet, "_app_tokens", {})
+    monkeypatch.setattr(FeishuSheet, "_circuit_breaker", CircuitBreaker(
+        failure_threshold=100, recovery_timeout=0.5, expected_exception=NetworkError
+    ))
+    monkeypatch.setattr(FeishuSheet, "_sleep_backoff", lambda self, attempt, reason: None)
+    sheets = []
+
+    def factory(responses):
+        api = FakeFeishu(responses)
+        sheet = FeishuSheet("app_id", "app_secret")
+        sheet._client.close()
+        sheet._client = httpx.Client(transport=httpx.MockTransport(api.handle), headers=JSON_HEADERS)
+        sheets.append(sheet)
+        return sheet, api
+
+    yield factory
+    for sheet in sheets:
+        sheet.close()
+
+
+@pytest.fixture
+def async_sheet_factory(monkeypatch):
+    """创建接到 FakeFeishu 上的 AsyncFeishuSheet，退避不等待"""
+    async def no_sleep(self, attempt, reason):
+        return None
+
+    monkeypatch.setattr(AsyncFeishuSheet, "_sleep_backoff", no_sleep)
+
+    def factory(responses):
+        api = FakeFeishu(responses)
+        sheet = AsyncFeishuSheet("app_id", "app_secret")
+        sheet._client = httpx.AsyncClient(transport=httpx.MockTransport(api.handle), headers=JSON_HEADERS)
+        return sheet, api
+
+    return factory
+
+
+def run(sheet, coro):
+    """在新的事件循环中执行协程，结束后关闭 sheet 的连接池"""
+    async def main():
+        try:
+            return await coro
+        finally:
+            await sheet.aclose()
+
+    return asyncio.run(main())
+
+
+class TestFeishuSheetRetry:
+    @pytest.mark.parametrize("failure", [httpx.ReadTimeout, httpx.RemoteProtocolError, httpx.Response(503)])
+    def test_non_idempotent_post_fails_fast_when_outcome_unknown(self, sheet_factory, failure):
+        sheet, api = sheet_factory([failure, ok()])
+        with pytest.raises(NetworkError):
+            sheet._make_request("POST", RECORDS_URL, sheet._auth_headers(), {"fields": {}}, idempotent=False)
+        assert len(api.requests) == 1
+
+    def test_non_idempotent_post_retries_when_request_not_sent(self, sheet_factory):
+        sheet, api = sheet_factory([httpx.ConnectError, ok({"record": {"record_id": "rec1"}})])
+        data = sheet._make_request("POST", RECORDS_URL, sheet._auth_headers(), {"fields": {}}, idempotent=False)
+        assert data["data"]["record"]["record_id"] == "rec1"
+        assert len(api.requests) == 2
+
+    def test_post_with_client_token_is_retried_with_same_token(self, sheet_factory):
+        sheet, api = sheet_factory([httpx.ReadTimeout, httpx.Response(502), ok({"records": [{"record_id": "rec1"}]})])
+        result = sheet.write_bitable("app_token", "table_id", [{"fields": {"商品ID": "P001"}}])
+        assert result["data"]["records"] == [{"record_id": "rec1"}]
+        assert len(api.requests) == 3
+        client_tokens = {request.url.params["client_token"] for request in api.requests}
+        assert len(client_tokens) == 1
+
+    def test_429_is_retried_for_non_idempotent_post(self, sheet_factory):
+        sheet, api = sheet_factory([httpx.Response(429), ok()])
+        data = sheet._make_request("POST", RECORDS_URL, sheet._auth_headers(), {"fields": {}}, idempotent=False)
+        assert data["code"] == 0
+        assert len(api.requests) == 2
+
+    def test_retries_exhausted_raises_network_error(self, sheet_factory):
+        sheet, api = sheet_factory([])
+        attempts = sheet.retry_config.max_attempts
+        api.responses = [httpx.Response(503)] * attempts
+        with pytest.raises(NetworkError):
+            sheet._make_request("PUT", f"{RECORDS_URL}/rec1", sheet._auth_headers(), {"fields": {}})
+        assert len(api.requests) == attempts
+
+    def test_expired_token_is_refreshed_and_request_retried_once(self, sheet_factory):
+        sheet, api = sheet_factory([
+            httpx.Response(200, json={"code": 99991663, "msg": "token expired"}),
+            ok({"record": {"record_id": "rec1"}}),
+        ])
+        data = sheet._make_request("POST", RECORDS_URL, sheet._auth_headers(), {"fields": {}}, idempotent=False)
+        assert data["data"]["record"]["record_id"] == "rec1"
+        assert api.tokens_issued == 2
+        assert [request.headers["Authorization"] for request in api.requests] == [
+            "Bearer token-1", "Bearer token-2"
+        ]
+
+
+class TestAsyncFeishuSheetRetry:
+    @pytest.mark.parametrize("failure", [httpx.ReadTimeout, httpx.Response(500)])
+    def test_non_idempotent_post_fails_fast_when_outcome_unknown(self, async_sheet_factory, failure):
+        sheet, api = async_sheet_factory([failure, ok()])
+        with pytest.raises(NetworkError):
+            run(sheet, sheet._make_request("POST", RECORDS_URL, {"fields": {}}, idempotent=False))
+        assert len(api.requests) == 1
+
+    def test_post_with_client_token_is_retried_with_same_token(self, async_sheet_factory):
+        sheet, api = async_sheet_factory([httpx.ReadTimeout, ok({"records": [{"record_id": "rec1"}]})])
+        result = run(sheet, sheet.write_bitable("app_token", "table_id", [{"fields": {"商品ID": "P001"}}]))
+        assert result["data"]["records"] == [{"record_id": "rec1"}]
+        client_tokens = {request.url.params["client_token"] for request in api.requests}
+        assert len(api.requests) == 2 and len(client_tokens) == 1
+
+    def test_429_is_retried_for_non_idempotent_post(self, async_sheet_factory):
+        sheet, api = async_sheet_factory([httpx.Response(429), ok()])
+        data = run(sheet, sheet._make_request("POST", RECORDS_URL, {"fields": {}}, idempotent=False))
+        assert data["code"] == 0
+        assert len(api.requests) == 2
+
+    def test_expired_token_is_refreshed_and_request_retried_once(self, async_sheet_factory):
+        sheet, api = async_sheet_factory([
+            httpx.Response(200, json={"code": 99991663, "msg": "token expired"}),
+            ok(),
+        ])
+        run(sheet, sheet._make_request("POST", RECORDS_URL, {"fields": {}}, idempotent=False))
+        assert api.tokens_issued == 2
+        assert [request.headers["Authorization"] for request in api.requests] == [
+            "Bearer token-1", "Bearer token-2"
+        ]